@@ -133,17 +133,14 @@ class NaturaXmlToXlsxEsp:
 
                         regne = taxon_info['REGNE']  # Récupérer le règne
                         if regne:  # Vérifier que le règne n'est pas vide
-                            if regne not in regne_data:
-                                regne_data[
-                                    regne] = []  # Initialiser une liste pour ce règne si elle n'existe pas encore
-
-                            regne_data[regne].append({
-                                "SITECODE - SITE_NAME": f"{sitecode} - {site_name}",
-                                "GROUPE": taxon_info['GROUPE'],
-                                "CD_NOM": cd_nom,
-                                "NOM_COMPLET": taxon_info['NOM_COMPLET'],
-                                "NOM_VERN": taxon_info['NOM_VERN']
-                            })
+                            # Une liste par colonne et par règne plutôt qu'un dictionnaire par ligne
+                            columns = regne_data.setdefault(regne, {"SITECODE - SITE_NAME": [], "GROUPE": [],
+                                                                    "CD_NOM": [], "NOM_COMPLET": [], "NOM_VERN": []})
+                            columns["SITECODE - SITE_NAME"].append(f"{sitecode} - {site_name}")
+                            columns["GROUPE"].append(taxon_info['GROUPE'])
+                            columns["CD_NOM"].append(cd_nom)
+                            columns["NOM_COMPLET"].append(taxon_info['NOM_COMPLET'])
+                            columns["NOM_VERN"].append(taxon_info['NOM_VERN'])
 
             xml_processing_time = time.time() - start_time
             QgsMessageLog.logMessage(f"Fichier {xml_file} traité en {xml_processing_time:.2f} secondes.", "NaturaXmlToXlsxEsp", Qgis.Info)
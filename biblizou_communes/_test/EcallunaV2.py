@@ -9,6 +9,7 @@ from pathlib import Path
 import concurrent.futures
 import time
 import logging
+import os
 from threading import Lock  # Importation du verrou pour synchroniser les mises à jour
 
 # Configuration des logs
@@ -19,6 +20,8 @@ cache_fuzzy_results = {}
 cache_taxref_results = {}
 lock = Lock()  # Création d'un verrou pour éviter les accès concurrents au DataFrame
 session = requests.Session()  # Session globale pour réutiliser les connexions HTTP
+# Adresse de l'API TaxRef (redirigeable vers un serveur local pour les tests de charge)
+TAXREF_API_URL = os.environ.get('BIBLIZOU_TAXREF_URL', 'https://taxref.mnhn.fr/api').rstrip('/')
 insee = {'Melgven' : 29146, 'Rosporden' : 29241, 'Elliant' : 29049, 'Saint-Yvi' :29272}
 
 # options d'affichage pandas
@@ -116,7 +119,7 @@ def fuzzy_match(nom_tax: str) -> Tuple[str, int]:
 
     word = nom_tax.split()
     genus, specie = word[0], word[1] if len(word) > 1 else ""
-    url = f'https://taxref.mnhn.fr/api/taxa/fuzzyMatch?term={genus}%20{specie}'
+    url = f'{TAXREF_API_URL}/taxa/fuzzyMatch?term={genus}%20{specie}'
 
     for attempt in range(5):
         try:
@@ -140,7 +143,7 @@ def fetch_taxref_data(CD_Ref, cache={}):
         return cache[CD_Ref]
 
     # URL de l'API avec cd_nom comme identifiant
-    url = f"https://taxref.mnhn.fr/api/taxa/{CD_Ref}"
+    url = f"{TAXREF_API_URL}/taxa/{CD_Ref}"
 
     # Définir les headers pour l'API
     headers = {"accept": "application/hal+json;version=1"}
@@ -228,7 +231,7 @@ process_data()
 
 # Fonction pour récupérer les données de statut par lots
 def fetch_status_data(batch: List[int]) -> List[dict]:
-    url_base = 'https://taxref.mnhn.fr/api/status/search/lines?locationId=INSEEC29241&page=1&size=10000'
+    url_base = f'{TAXREF_API_URL}/status/search/lines?locationId=INSEEC29241&page=1&size=10000'
     url_complete = url_base + ''.join([f'&taxrefId={elem}' for elem in batch])
 
     for attempt in range(3):  # Tentatives de requêtes
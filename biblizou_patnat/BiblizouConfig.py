@@ -0,0 +1,90 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : BiblizouConfig.py
+Groupe : Biblizou_PatNat
+Description : Paramètres communs aux modules Biblizou (adresses des services TaxRef et INPN, dossier de cache,
+    réglages des requêtes HTTP).
+Dépendances :
+    - Python 3.x
+    - os
+
+Utilisation :
+    Les adresses par défaut pointent vers les services en ligne du MNHN. Elles peuvent être redirigées
+    vers un serveur local (ex. : _bench/MockInpnServer.py) via les variables d'environnement
+    BIBLIZOU_TAXREF_URL et BIBLIZOU_INPN_URL, ou en modifiant les attributs du module avant le traitement :
+        import BiblizouConfig
+        BiblizouConfig.TAXREF_API_URL = "http://127.0.0.1:8765/api"
+
+    Le dossier de cache (cache négatif des fiches absentes, etc.) est ~/.biblizou par défaut, ou
+    BIBLIZOU_CACHE_DIR.
+"""
+
+import os
+
+TAXREF_API_URL = os.environ.get('BIBLIZOU_TAXREF_URL', 'https://taxref.mnhn.fr/api').rstrip('/')
+INPN_DOCS_URL = os.environ.get('BIBLIZOU_INPN_URL', 'https://inpn.mnhn.fr/docs').rstrip('/')
+# Fiches XML rangées dans une archive unique par dossier (XmlStore) ; '0' pour des fichiers isolés
+XML_ARCHIVE = os.environ.get('BIBLIZOU_XML_ARCHIVE', '1') != '0'
+# Moteur de lecture des fiches (XmlBackend) : 'auto' (lxml s'il est installé), 'lxml' ou 'etree'
+XML_BACKEND = os.environ.get('BIBLIZOU_XML_BACKEND', 'auto')
+# Dossier de travail local pour les dossiers réseau (BiblizouStaging) : 'auto', 'always' ou 'never'
+STAGING = os.environ.get('BIBLIZOU_STAGING', 'auto')
+SYNC_RETRIES = 3               # tentatives de recopie d'un livrable vers le dossier réseau
+# Exports en flux à mémoire bornée (lots régionaux) : 'auto' (à partir de STREAMING_MIN_FILES fiches),
+# 'always' ou 'never' ; plafond des synthèses en mémoire, au-delà déversées sur disque
+STREAMING = os.environ.get('BIBLIZOU_STREAMING', 'auto')
+STREAMING_MIN_FILES = 500
+STREAMING_MEMORY_MB = int(os.environ.get('BIBLIZOU_STREAMING_MEMORY_MB', '256'))
+# Présentation des classeurs XLSX : 'sheets' (un onglet par site, par défaut) ou 'long' (une table filtrable)
+XLSX_LAYOUT = os.environ.get('BIBLIZOU_XLSX_LAYOUT', 'sheets')
+# Formats de sortie des exports (OutputBackends) : liste parmi xlsx, csv, parquet, sqlite, gpkg, ods
+OUTPUT_FORMATS = os.environ.get('BIBLIZOU_OUTPUT_FORMATS', 'xlsx')
+# Réutilisation d'un livrable identique déjà produit (RunMemo) ; '1' pour tout régénérer
+FORCE_REBUILD = os.environ.get('BIBLIZOU_FORCE_REBUILD', '0') == '1'
+# Version du référentiel TaxRef servi par TAXREF_API_URL, à changer à chaque nouvelle version : les livrables
+# complétés par TaxRef produits avec une autre version ne sont pas réutilisés, et aucun ne l'est si elle est vide
+TAXREF_VERSION = os.environ.get('BIBLIZOU_TAXREF_VERSION', '')
+# Processus de construction des livrables en parallèle (XmlToDeliverables) : 0 = un par livrable dans la limite
+# des cœurs, 1 = construction séquentielle dans le processus QGIS
+DELIVERABLE_WORKERS = int(os.environ.get('BIBLIZOU_DELIVERABLE_WORKERS', '0'))
+# Profilage des traitements (BiblizouProfile) : 'off' (par défaut), 'sample' (échantillonnage des piles, pour
+# flame graph / speedscope) ou 'cprofile' (échantillonnage et profil cProfile .prof)
+PROFILE = os.environ.get('BIBLIZOU_PROFILE', 'off').lower()
+PROFILE_INTERVAL_MS = 5        # intervalle d'échantillonnage des piles
+CACHE_DIR = os.environ.get('BIBLIZOU_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.biblizou'))
+
+# Requêtes HTTP (BiblizouHttp)
+HTTP_TIMEOUT = 30              # secondes
+HTTP_RETRIES = 3               # tentatives pour les erreurs temporaires (5xx, 429, réseau)
+NEGATIVE_CACHE_DAYS = 7        # durée de mémorisation d'une fiche absente (404/410)
+BREAKER_THRESHOLD = 5          # échecs consécutifs avant ouverture du disjoncteur d'un hôte
+BREAKER_COOLDOWN = 60          # secondes avant de retenter un hôte en panne
+
+
+def snapshot():
+    """Valeurs courantes des réglages, y compris celles modifiées pendant la session QGIS, à transmettre aux
+    processus de travail (qui relisent sinon les valeurs par défaut et les variables d'environnement)."""
+    return {name: value for name, value in globals().items() if name.isupper()}
+
+
+def restore(values):
+    """Applique des réglages obtenus par snapshot()."""
+    globals().update(values)
+
+
+def taxon_url(cd_nom):
+    """URL de la fiche TaxRef d'un taxon."""
+    return f"{TAXREF_API_URL}/taxa/{cd_nom}"
+
+
+def znieff_xml_url(znieff_id):
+    """URL de la fiche XML d'une ZNIEFF sur l'INPN."""
+    return f"{INPN_DOCS_URL}/ZNIEFF/znieffxml/{znieff_id}.xml"
+
+
+def natura_xml_url(natura_id):
+    """URL du formulaire standard de données (XML) d'un site Natura 2000 sur l'INPN."""
+    return f"{INPN_DOCS_URL}/natura2000/fsdxml/{natura_id}.xml"
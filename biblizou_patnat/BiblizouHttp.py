@@ -0,0 +1,197 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : BiblizouHttp.py
+Groupe : Biblizou_PatNat
+Description : Requêtes HTTP communes aux modules Biblizou (fiches XML INPN, API TaxRef) : cache négatif
+    persistant des ressources absentes, pas de nouvelle tentative sur les erreurs client définitives et
+    disjoncteur par hôte pendant les pannes.
+Dépendances :
+    - Python 3.x
+    - QGIS (QgsMessageLog)
+    - requests, email.utils (dates HTTP)
+    - BiblizouConfig
+
+Utilisation :
+    from BiblizouHttp import fetch
+    response = fetch(url, metrics=self.metrics)
+    if response is not None:
+        ...
+
+    fetch() retourne la réponse (statut 2xx), ou None si la ressource est absente (404/410, mémorisé
+    NEGATIVE_CACHE_DAYS jours dans <CACHE_DIR>/negative_cache.json), refusée (autre 4xx), ou si l'hôte
+    est en panne. Seules les erreurs temporaires (5xx, 429, réseau) sont retentées, avec attente
+    exponentielle ou l'en-tête Retry-After (en secondes ou en date HTTP). Après BREAKER_THRESHOLD échecs
+    consécutifs, un hôte n'est plus interrogé pendant BREAKER_COOLDOWN secondes ; une seule requête d'essai
+    passe ensuite, les autres attendant son résultat.
+"""
+
+import os
+import json
+import time
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import requests
+from qgis.core import QgsMessageLog, Qgis
+import BiblizouConfig
+
+PERMANENT_MISSING = (404, 410)
+RETRYABLE = (429, 500, 502, 503, 504)
+
+
+class NegativeCache:
+    def __init__(self, path):
+        """Cache persistant des URL absentes : {url: {'status': 404, 'until': horodatage}}."""
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+            now = time.time()
+            self.entries = {url: e for url, e in self.entries.items() if e.get('until', 0) > now}
+        return self.entries
+
+    def get(self, url):
+        """Statut mémorisé de l'URL s'il n'a pas expiré, sinon None."""
+        with self.lock:
+            entry = self.load().get(url)
+            if entry is None:
+                return None
+            if entry['until'] <= time.time():
+                del self.entries[url]
+                return None
+            return entry['status']
+
+    def add(self, url, status):
+        with self.lock:
+            self.load()[url] = {'status': status, 'until': time.time() + BiblizouConfig.NEGATIVE_CACHE_DAYS * 86400}
+            self.save()
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            self.save()
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            QgsMessageLog.logMessage(f"Cache négatif non enregistré : {e}", "Biblizou", Qgis.Warning)
+
+
+class CircuitBreaker:
+    def __init__(self):
+        """Disjoncteur par hôte : {hôte: (échecs consécutifs, ouvert jusqu'à, requête d'essai en cours)}."""
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def allow(self, host):
+        """False tant que le disjoncteur de l'hôte est ouvert. Le délai écoulé, une seule requête d'essai
+        passe (demi-ouvert) : les autres sont refusées jusqu'à son succès ou son échec."""
+        with self.lock:
+            failures, open_until, probing = self.hosts.get(host, (0, 0.0, False))
+            if not open_until:
+                return True
+            if probing or open_until > time.time():
+                return False
+            self.hosts[host] = (failures, open_until, True)
+            return True
+
+    def success(self, host):
+        with self.lock:
+            self.hosts.pop(host, None)
+
+    def failure(self, host):
+        with self.lock:
+            failures, open_until, probing = self.hosts.get(host, (0, 0.0, False))
+            failures += 1
+            if probing or failures >= BiblizouConfig.BREAKER_THRESHOLD:
+                open_until = time.time() + BiblizouConfig.BREAKER_COOLDOWN  # essai en échec : réouverture
+                QgsMessageLog.logMessage(f"{host} ne répond plus : requêtes suspendues "
+                                         f"{BiblizouConfig.BREAKER_COOLDOWN} s.", "Biblizou", Qgis.Warning)
+            self.hosts[host] = (failures, open_until, False)
+
+
+negative_cache = NegativeCache(os.path.join(BiblizouConfig.CACHE_DIR, 'negative_cache.json'))
+breaker = CircuitBreaker()
+
+
+def _incr(metrics, name):
+    if metrics is not None:
+        metrics.incr(name)
+
+
+def _retry_delay(response, attempt):
+    """Attente avant la tentative suivante, entre 0 et 60 s : Retry-After s'il est fourni (secondes ou date
+    HTTP), sinon exponentielle."""
+    retry_after = response.headers.get('Retry-After', '').strip() if response is not None else ''
+    if retry_after:
+        try:
+            return max(0.0, min(float(retry_after), 60.0))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, min(parsedate_to_datetime(retry_after).timestamp() - time.time(), 60.0))
+        except (TypeError, ValueError, IndexError, OverflowError):
+            pass
+    return 2 ** attempt
+
+
+def fetch(url, headers=None, retries=None, metrics=None):
+    """GET avec cache négatif, classement des erreurs et disjoncteur par hôte. Voir l'en-tête du module."""
+    retries = BiblizouConfig.HTTP_RETRIES if retries is None else retries
+    status = negative_cache.get(url)
+    if status is not None:
+        _incr(metrics, 'cache.negative_hits')
+        QgsMessageLog.logMessage(f"Ressource absente ({status}, en cache) : {url}", "Biblizou", Qgis.Info)
+        return None
+
+    host = urlparse(url).netloc
+    for attempt in range(1, retries + 1):
+        if not breaker.allow(host):
+            _incr(metrics, 'http.short_circuited')
+            return None
+        response = None
+        try:
+            _incr(metrics, 'http.requests')
+            response = requests.get(url, headers=headers, timeout=BiblizouConfig.HTTP_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            QgsMessageLog.logMessage(f"Erreur réseau ({attempt}/{retries}) : {url} : {e}", "Biblizou", Qgis.Warning)
+        else:
+            if response.ok:
+                breaker.success(host)
+                return response
+            if response.status_code in PERMANENT_MISSING:
+                breaker.success(host)
+                _incr(metrics, 'http.errors')
+                negative_cache.add(url, response.status_code)
+                QgsMessageLog.logMessage(f"Ressource absente ({response.status_code}) : {url}", "Biblizou",
+                                         Qgis.Warning)
+                return None
+            if response.status_code not in RETRYABLE:
+                breaker.success(host)
+                _incr(metrics, 'http.errors')
+                QgsMessageLog.logMessage(f"Requête refusée ({response.status_code}) : {url}", "Biblizou",
+                                         Qgis.Warning)
+                return None
+        _incr(metrics, 'http.errors')
+        if response is not None and response.status_code == 429:
+            breaker.success(host)  # hôte joignable qui limite le débit : pas une panne (clôt un essai en cours)
+        else:
+            breaker.failure(host)
+        if attempt < retries:
+            time.sleep(_retry_delay(response, attempt))
+    return None
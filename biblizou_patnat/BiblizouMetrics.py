@@ -0,0 +1,83 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : BiblizouMetrics.py
+Groupe : Biblizou_PatNat
+Description : Mesures légères des traitements Biblizou : durée par étape (spans) et compteurs
+    (requêtes HTTP, cache, octets téléchargés, fichiers analysés, lignes écrites), avec rapport JSON.
+Dépendances :
+    - Python 3.x
+    - json, time, threading, contextlib
+
+Utilisation :
+    metrics = RunMetrics('ZnieffXmlToXlsxEsp')
+    with metrics.span('parse'):
+        ...
+    metrics.incr('files.parsed')
+    metrics.write_report(excel_file)   # -> <excel_file>.run.json
+
+    Noms de compteurs utilisés par les modules : http.requests, http.errors, http.short_circuited, cache.hits,
+    cache.misses, cache.negative_hits, bytes.downloaded, files.parsed, files.failed, rows.written,
+    synthese.spilled (blocs de synthèse déversés sur disque en mode flux), memo.reused (livrables recopiés
+    d'une exécution identique, RunMemo).
+"""
+
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class RunMetrics:
+    def __init__(self, tool):
+        """Initialisation des mesures d'une exécution d'un module."""
+        self.tool = tool
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.start = time.perf_counter()
+        self.counters = {}
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        """Mesure la durée du bloc et l'ajoute au cumul de l'étape `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                stage = self.spans.setdefault(name, {'count': 0, 'total_s': 0.0, 'max_s': 0.0})
+                stage['count'] += 1
+                stage['total_s'] += duration
+                stage['max_s'] = max(stage['max_s'], duration)
+
+    def incr(self, name, value=1):
+        """Incrémente le compteur `name`."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def elapsed(self):
+        """Durée écoulée depuis la création des mesures, en secondes."""
+        return time.perf_counter() - self.start
+
+    def report(self, **extra):
+        """Retourne le rapport de l'exécution sous forme de dictionnaire sérialisable en JSON."""
+        with self.lock:
+            spans = {name: {'count': s['count'], 'total_s': round(s['total_s'], 4), 'max_s': round(s['max_s'], 4)}
+                     for name, s in sorted(self.spans.items(), key=lambda item: -item[1]['total_s'])}
+            counters = dict(sorted(self.counters.items()))
+        report = {'tool': self.tool, 'started_at': self.started_at, 'wall_time_s': round(self.elapsed(), 4),
+                  'spans': spans, 'counters': counters}
+        report.update(extra)
+        return report
+
+    def write_report(self, output_path, **extra):
+        """Écrit le rapport à côté du livrable (<output_path>.run.json) et retourne son chemin."""
+        report_path = f"{output_path}.run.json"
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(output=output_path, **extra), f, indent=2, ensure_ascii=False)
+        return report_path
@@ -0,0 +1,205 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : BiblizouPipeline.py
+Groupe : Biblizou_PatNat
+Description : Chaîne de traitement en flux téléchargement -> analyse -> enrichissement TaxRef. Chaque fiche
+    XML est analysée dès la fin de son téléchargement, et les cd_nom nouvellement rencontrés sont envoyés à
+    TaxRef pendant que les autres fiches sont encore en cours de transfert.
+Dépendances :
+    - Python 3.x
+    - threading, queue
+
+Utilisation :
+    pipeline = StreamingPipeline(download=..., parse=..., enrich=..., task=task, metrics=metrics)
+    for record in pipeline.run(ids):
+        ...  # écriture du livrable, dans le fil appelant
+
+    - download(id) -> chemin du fichier téléchargé, ou None en cas d'échec
+    - parse(chemin) -> (enregistrement, clés à enrichir), ou None si la fiche est inexploitable
+    - enrich(clé) -> valeur, conservée dans pipeline.enriched[clé] ; en cas d'erreur la clé reste absente,
+      pour que le consommateur qui se sert de pipeline.enriched comme cache la redemande
+
+    Les files entre étapes sont bornées : un étage lent bloque l'étage précédent au lieu de laisser la
+    mémoire grossir. Un enregistrement n'est rendu qu'une fois toutes ses clés enrichies (ou en échec).
+    Si le consommateur abandonne l'itération (erreur d'écriture, close()), les fils de la chaîne s'arrêtent.
+"""
+
+import queue
+import threading
+
+_FIN = object()
+
+
+class StreamingPipeline:
+    def __init__(self, download, parse, enrich=None, download_workers=4, enrich_workers=4, queue_size=8,
+                 task=None, metrics=None):
+        """Initialisation de la chaîne (aucun fil n'est lancé avant run())."""
+        self.download = download
+        self.parse = parse
+        self.enrich = enrich
+        self.download_workers = download_workers
+        self.enrich_workers = enrich_workers if enrich else 0
+        self.queue_size = queue_size
+        self.task = task
+        self.metrics = metrics
+        self.enriched = {}
+        self.failed = set()  # clés dont l'enrichissement a échoué, absentes de enriched
+        self.errors = []
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+
+    def canceled(self):
+        if self.task is not None and self.task.isCanceled():
+            self.stop.set()
+        return self.stop.is_set()
+
+    def span(self, name):
+        return self.metrics.span(name) if self.metrics is not None else _NoSpan()
+
+    def put(self, q, item):
+        """put() bloquant mais interruptible par l'annulation."""
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                self.canceled()
+        return False
+
+    def download_worker(self, ids_q, parse_q):
+        while not self.canceled():
+            try:
+                item_id = ids_q.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                with self.span('pipeline.download'):
+                    path = self.download(item_id)
+                if path:
+                    self.put(parse_q, path)
+            except Exception as e:
+                self.errors.append((item_id, e))
+
+    def parse_worker(self, parse_q, enrich_q, out_q, nb_downloaders):
+        seen = set()
+        finished = 0
+        while finished < nb_downloaders and not self.canceled():
+            try:
+                path = parse_q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if path is _FIN:
+                finished += 1
+                continue
+            try:
+                with self.span('pipeline.parse'):
+                    parsed = self.parse(path)
+            except Exception as e:
+                self.errors.append((path, e))
+                continue
+            if parsed is None:
+                continue
+            record, keys = parsed
+            if enrich_q is not None:
+                for key in keys:
+                    if key not in seen:
+                        seen.add(key)
+                        self.put(enrich_q, key)
+            self.put(out_q, (record, set(keys) if enrich_q is not None else set()))
+        for _ in range(self.enrich_workers):
+            self.put(enrich_q, _FIN)
+        self.put(out_q, _FIN)
+
+    def enrich_worker(self, enrich_q):
+        while not self.canceled():
+            try:
+                key = enrich_q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if key is _FIN:
+                return
+            try:
+                with self.span('pipeline.enrich'):
+                    value = self.enrich(key)
+            except Exception as e:
+                self.errors.append((key, e))
+                with self.lock:
+                    self.failed.add(key)
+                continue
+            with self.lock:
+                self.enriched[key] = value
+
+    def ready(self, keys):
+        with self.lock:
+            return all(key in self.enriched or key in self.failed for key in keys)
+
+    def run(self, ids):
+        """Lance les étages et rend les enregistrements prêts (clés enrichies), dans le fil appelant."""
+        ids_q = queue.Queue()
+        for item_id in ids:
+            ids_q.put(item_id)
+        parse_q = queue.Queue(self.queue_size)
+        out_q = queue.Queue(self.queue_size)
+        enrich_q = queue.Queue(self.queue_size * 4) if self.enrich else None
+
+        downloaders = [threading.Thread(target=self.download_worker, args=(ids_q, parse_q), daemon=True)
+                       for _ in range(max(1, self.download_workers))]
+        enrichers = [threading.Thread(target=self.enrich_worker, args=(enrich_q,), daemon=True)
+                     for _ in range(self.enrich_workers)]
+        parser = threading.Thread(target=self.parse_worker, args=(parse_q, enrich_q, out_q, len(downloaders)),
+                                  daemon=True)
+        for thread in downloaders + enrichers + [parser]:
+            thread.start()
+
+        def close_downloads():
+            for thread in downloaders:
+                thread.join()
+            for _ in downloaders:
+                self.put(parse_q, _FIN)
+        threading.Thread(target=close_downloads, daemon=True).start()
+
+        pending = []
+        parsing_done = False
+        try:
+            while not self.canceled():
+                if not parsing_done:
+                    try:
+                        item = out_q.get(timeout=0.1)
+                        if item is _FIN:
+                            parsing_done = True
+                        else:
+                            pending.append(item)
+                    except queue.Empty:
+                        pass
+                still_pending = []
+                for record, keys in pending:
+                    if self.ready(keys):
+                        yield record
+                    else:
+                        still_pending.append((record, keys))
+                pending = still_pending
+                if parsing_done:
+                    if not pending:
+                        break
+                    if not any(thread.is_alive() for thread in enrichers):
+                        # Enrichissement interrompu : on rend ce qui reste, clés manquantes absentes de enriched
+                        for record, keys in pending:
+                            yield record
+                        break
+                    self.stop.wait(0.05)
+        finally:
+            # Fin normale, annulation ou abandon par le consommateur : les fils ne restent pas bloqués
+            self.stop.set()
+            for thread in enrichers:
+                thread.join(timeout=1)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
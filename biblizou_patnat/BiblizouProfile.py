@@ -0,0 +1,247 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : BiblizouProfile.py
+Groupe : Biblizou_PatNat
+Description : Profilage à la demande des traitements Biblizou. Pendant la tâche, un fil échantillonne à
+    intervalle régulier la pile d'appels du traitement et des fils qu'il lance (téléchargements, TaxRef) ;
+    le profil est écrit à côté des livrables au format speedscope (https://www.speedscope.app) et en piles
+    repliées (flamegraph.pl, inferno), pour voir si le temps part dans l'analyse XML, TaxRef, pandas ou la
+    mise en forme openpyxl. En mode 'cprofile', un profil cProfile (.prof : snakeviz, pstats) est ajouté.
+Dépendances :
+    - Python 3.x
+    - QGIS (QgsMessageLog)
+    - cProfile, json, os, re, sys, threading, time, datetime
+    - BiblizouConfig (PROFILE, PROFILE_INTERVAL_MS, CACHE_DIR)
+
+Utilisation :
+    BiblizouConfig.PROFILE (variable BIBLIZOU_PROFILE) : 'off' (par défaut), 'sample' ou 'cprofile'.
+    Toutes les tâches lancées par lancer_tache (donc le run() de chaque module) sont profilées :
+        session = start_profile(description)   # None si le profilage est désactivé
+        ...
+        stop_profile(session)                   # -> profil_<tâche>_<horodatage>.speedscope.json, .folded, .prof
+    Seuls le fil de la tâche et les fils qu'il démarre (directement ou non) sont échantillonnés, pas les autres
+    tâches ni l'interface. Pour les reconnaître, threading.Thread.start est remplacé tant qu'un profil est en
+    cours ; les fils démarrés avant le profil (réserves de fils partagées entre tâches) ne sont pas suivis. BiblizouStaging.staged signale le dossier de travail (note_output_folder) et y écrit
+    le profil à la fin du traitement (flush_profile) : il est recopié avec les livrables, la recopie elle-même
+    n'étant pas profilée. Hors staged, le profil est écrit dans <CACHE_DIR>/profils à la fin de la tâche.
+    Désactivé, le coût se limite à un test par tâche.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import cProfile
+import threading
+from datetime import datetime
+from qgis.core import QgsMessageLog, Qgis
+import BiblizouConfig
+
+_current = threading.local()  # session du fil de la tâche en cours
+_samplers = set()             # échantillonneurs actifs, informés des fils démarrés par les fils qu'ils suivent
+_samplers_lock = threading.Lock()
+_thread_start = threading.Thread.start
+
+
+def _start_tracked(thread, *args, **kwargs):
+    """Thread.start pendant un profilage : le nouveau fil est suivi si le fil qui le démarre l'est. Le fil
+    s'inscrit lui-même avant d'exécuter son code, donc avant de pouvoir démarrer à son tour d'autres fils."""
+    parent = threading.get_ident()
+    with _samplers_lock:
+        samplers = [sampler for sampler in _samplers if parent in sampler.threads]
+    if samplers and not isinstance(thread, Sampler):
+        run = thread.run
+
+        def tracked_run():
+            with _samplers_lock:
+                for sampler in samplers:
+                    sampler.threads.add(threading.get_ident())
+            run()
+        thread.run = tracked_run
+    _thread_start(thread, *args, **kwargs)
+
+
+def frame_label(code):
+    """Nom d'une fonction dans le profil : « fonction (fichier.py:ligne) »."""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        """Échantillonneur des piles du fil `thread_id` et des fils qu'il démarre pendant le profilage."""
+        super().__init__(name='Biblizou profilage', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.threads = {thread_id}  # fils suivis, complétés par _start_tracked
+        self.names = {}
+        self.frames = {}   # libellé : indice
+        self.stacks = {}   # (fil, (indices de la racine vers la feuille)) : [échantillons, secondes]
+        self.stop_event = threading.Event()
+        self.duration = 0.0
+
+    def run(self):
+        start = last = time.perf_counter()
+        while not self.stop_event.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, last = now - last, now  # durée réelle du pas, plus longue que l'intervalle sous charge
+            for ident, frame in sys._current_frames().items():
+                if ident not in self.threads:
+                    continue
+                stack = []
+                while frame is not None:
+                    label = frame_label(frame.f_code)
+                    stack.append(self.frames.setdefault(label, len(self.frames)))
+                    frame = frame.f_back
+                key = (self.thread_name(ident), tuple(reversed(stack)))
+                totals = self.stacks.setdefault(key, [0, 0.0])
+                totals[0] += 1
+                totals[1] += elapsed
+        self.duration = time.perf_counter() - start
+
+    def thread_name(self, ident):
+        if ident not in self.names:
+            self.names.update({thread.ident: thread.name for thread in threading.enumerate()})
+        return self.names.get(ident, str(ident))
+
+    def start(self):
+        with _samplers_lock:
+            if not _samplers:
+                threading.Thread.start = _start_tracked
+            _samplers.add(self)
+        try:
+            super().start()
+        except Exception:
+            self.stop_tracking()
+            raise
+
+    def stop_tracking(self):
+        """Retire l'échantillonneur des fils informés ; Thread.start est rétabli après le dernier."""
+        with _samplers_lock:
+            _samplers.discard(self)
+            if not _samplers:
+                threading.Thread.start = _thread_start
+
+    def stop(self):
+        self.stop_tracking()
+        self.stop_event.set()
+        self.join()
+
+    def folded(self):
+        """Piles repliées (« fil;f1;f2 nombre »), entrée de flamegraph.pl et inferno."""
+        labels = list(self.frames)
+        return ''.join(f"{';'.join([thread] + [labels[i] for i in stack])} {count}\n"
+                       for (thread, stack), (count, _) in sorted(self.stacks.items()))
+
+    def speedscope(self, name):
+        """Profil speedscope : un profil échantillonné par fil, poids en secondes."""
+        profiles = {}
+        for (thread, stack), (_, seconds) in self.stacks.items():
+            profile = profiles.setdefault(thread, {'type': 'sampled', 'name': thread, 'unit': 'seconds',
+                                                   'startValue': 0, 'endValue': 0, 'samples': [], 'weights': []})
+            profile['samples'].append(list(stack))
+            profile['weights'].append(round(seconds, 6))
+            profile['endValue'] += seconds
+        return {'$schema': 'https://www.speedscope.app/file-format-schema.json', 'name': name,
+                'exporter': 'Biblizou', 'activeProfileIndex': 0,
+                'shared': {'frames': [{'name': label} for label in self.frames]},
+                'profiles': sorted(profiles.values(), key=lambda profile: -profile['endValue'])}
+
+
+class ProfileSession:
+    def __init__(self, name, mode):
+        """Profil de la tâche `name`, lancé dans le fil appelant (celui de la tâche)."""
+        self.name = name
+        self.folder = None
+        self.paths = None  # fichiers écrits (None tant que le profil n'est pas arrêté)
+        self.sampler = Sampler(threading.get_ident(), BiblizouConfig.PROFILE_INTERVAL_MS / 1000)
+        self.cprofile = cProfile.Profile() if mode == 'cprofile' else None
+
+    def start(self):
+        """Démarre cProfile puis l'échantillonneur : si cProfile refuse (un seul profileur actif à la fois
+        depuis Python 3.12), aucun fil n'est lancé et Thread.start n'est pas modifié."""
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        try:
+            self.sampler.start()
+        except Exception:
+            if self.cprofile is not None:
+                self.cprofile.disable()
+            raise
+
+    def stop(self):
+        """Arrête le profilage et écrit les fichiers ; retourne leurs chemins (une seule écriture)."""
+        if self.paths is not None:
+            return self.paths
+        self.paths = []
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.sampler.stop()
+        folder = self.folder if self.folder and os.path.isdir(self.folder) else \
+            os.path.join(BiblizouConfig.CACHE_DIR, 'profils')
+        os.makedirs(folder, exist_ok=True)
+        slug = re.sub(r'\W+', '_', self.name.replace('Biblizou :', '')).strip('_')
+        stem = os.path.join(folder, f"profil_{slug}_{datetime.now().strftime('%Y%m%d%H%M%S')}")
+        paths = [f"{stem}.speedscope.json", f"{stem}.folded"]
+        with open(paths[0], 'w', encoding='utf-8') as f:
+            json.dump(self.sampler.speedscope(self.name), f, ensure_ascii=False)
+        with open(paths[1], 'w', encoding='utf-8') as f:
+            f.write(self.sampler.folded())
+        if self.cprofile is not None:
+            paths.append(f"{stem}.prof")
+            self.cprofile.dump_stats(paths[-1])
+        self.paths = paths
+        return paths
+
+
+def start_profile(name):
+    """Démarre le profilage de la tâche en cours si BiblizouConfig.PROFILE le demande ; sinon None."""
+    if BiblizouConfig.PROFILE in ('off', '0', ''):
+        return None
+    session = ProfileSession(name, BiblizouConfig.PROFILE)
+    try:
+        session.start()
+    except Exception as e:
+        QgsMessageLog.logMessage(f"Profilage de « {name} » impossible : {e}", "Biblizou", Qgis.Warning)
+        return None
+    _current.session = session
+    return session
+
+
+def stop_profile(session):
+    """Termine une session de start_profile (None accepté) et journalise les fichiers écrits."""
+    if session is None:
+        return []
+    _current.session = None
+    try:
+        paths = session.stop()
+    except Exception as e:
+        QgsMessageLog.logMessage(f"Profil de « {session.name} » non écrit : {e}", "Biblizou", Qgis.Warning)
+        return []
+    if not paths:
+        return []  # échec déjà signalé par flush_profile
+    QgsMessageLog.logMessage(f"Profil de « {session.name} » ({session.sampler.duration:.1f} s) : "
+                             f"{', '.join(paths)}", "Biblizou", Qgis.Info)
+    return paths
+
+
+def note_output_folder(folder_path):
+    """Indique le dossier de travail de la tâche en cours, où le profil sera écrit."""
+    session = getattr(_current, 'session', None)
+    if session is not None and session.folder is None:
+        session.folder = folder_path
+
+
+def flush_profile():
+    """Arrête le profil de la tâche en cours et l'écrit dans le dossier signalé par note_output_folder, avant
+    que ce dossier ne soit recopié ; stop_profile, à la fin de la tâche, ne fait plus que journaliser."""
+    session = getattr(_current, 'session', None)
+    if session is not None and session.folder is not None:
+        try:
+            session.stop()
+        except Exception as e:
+            session.paths = []
+            QgsMessageLog.logMessage(f"Profil de « {session.name} » non écrit : {e}", "Biblizou", Qgis.Warning)
@@ -0,0 +1,172 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : BiblizouStaging.py
+Groupe : Biblizou_PatNat
+Description : Dossier de travail local pour les traitements lancés sur un dossier réseau (partage SMB du NAS).
+    Les fiches XML sont copiées en une passe dans un dossier temporaire local, tout le traitement y a lieu,
+    puis seuls les fichiers produits ou modifiés (livrables, rapports, archive des fiches) sont recopiés
+    vers le dossier réseau en un transfert groupé, avec nouvelles tentatives.
+Dépendances :
+    - Python 3.x
+    - QGIS (QgsMessageLog)
+    - os, shutil, tempfile, time
+    - BiblizouConfig (STAGING, SYNC_RETRIES), XmlStore, BiblizouProfile
+
+Utilisation :
+    with Staging(folder_path) as work_folder:
+        ...  # lecture et écriture dans work_folder
+    # à la sortie sans erreur : livrables recopiés dans folder_path, dossier local supprimé
+
+    ou, pour une tâche de fond : staged(folder_path, lambda work_folder: traitement(work_folder, task))
+
+    BiblizouConfig.STAGING (variable BIBLIZOU_STAGING) : 'auto' (dossiers réseau seulement, par défaut),
+    'always' ou 'never'. Hors dossier réseau en mode 'auto', work_folder est folder_path lui-même.
+    source_folder(work_folder) retrouve le dossier d'origine (ex. livrables précédents réutilisés par RunMemo).
+"""
+
+import os
+import time
+import shutil
+import tempfile
+from qgis.core import QgsMessageLog, Qgis
+import BiblizouConfig
+from XmlStore import release_store
+from BiblizouProfile import note_output_folder, flush_profile
+
+INPUT_SUFFIXES = ('.xml', '.zip', '.json')
+_sources = {}  # dossier de travail local : dossier réseau d'origine
+
+
+def source_folder(work_folder):
+    """Dossier d'origine d'un dossier de travail local (work_folder lui-même hors dossier de travail)."""
+    return _sources.get(work_folder, work_folder)
+
+
+def is_network_path(path):
+    """True pour un chemin UNC (\\\\serveur\\partage) ou un lecteur réseau monté sous Windows."""
+    path = os.path.abspath(path)
+    if path.startswith('\\\\') or path.startswith('//'):
+        return True
+    if os.name == 'nt':
+        import ctypes
+        drive = os.path.splitdrive(path)[0]
+        return bool(drive) and ctypes.windll.kernel32.GetDriveTypeW(drive + '\\') == 4  # DRIVE_REMOTE
+    return False
+
+
+def copy_with_retries(source, destination, retries=None):
+    """Copie atomique (fichier .part puis renommage) avec attente exponentielle entre les tentatives."""
+    retries = BiblizouConfig.SYNC_RETRIES if retries is None else retries
+    partial = f"{destination}.part"
+    try:
+        for attempt in range(1, retries + 1):
+            try:
+                shutil.copyfile(source, partial)
+                os.replace(partial, destination)
+                return True
+            except OSError as e:
+                QgsMessageLog.logMessage(f"Copie {attempt}/{retries} échouée vers {destination} : {e}", "Biblizou",
+                                         Qgis.Warning)
+                if attempt < retries:
+                    time.sleep(2 ** (attempt - 1))
+        return False
+    finally:
+        # Pas de fichier .part abandonné sur le partage après un échec définitif
+        try:
+            if os.path.exists(partial):
+                os.remove(partial)
+        except OSError:
+            pass
+
+
+class Staging:
+    def __init__(self, folder_path, mode=None):
+        """Préparation du dossier de travail local pour `folder_path` (voir l'en-tête du module)."""
+        self.remote = folder_path
+        mode = mode or BiblizouConfig.STAGING
+        self.enabled = mode == 'always' or (mode == 'auto' and is_network_path(folder_path))
+        self.local = None
+        self.snapshot = {}
+        self.failed = []
+
+    def __enter__(self):
+        if not self.enabled or not os.path.isdir(self.remote):
+            self.enabled = False
+            return self.remote
+        self.local = tempfile.mkdtemp(prefix='biblizou_staging_')
+        start = time.perf_counter()
+        count = 0
+        with os.scandir(self.remote) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(INPUT_SUFFIXES):
+                    shutil.copy2(entry.path, os.path.join(self.local, entry.name))
+                    count += 1
+        self.snapshot = self.scan()
+        _sources[self.local] = self.remote
+        QgsMessageLog.logMessage(f"Dossier de travail local {self.local} : {count} fichier(s) copié(s) depuis "
+                                 f"{self.remote} en {time.perf_counter() - start:.2f} s.", "Biblizou")
+        return self.local
+
+    def scan(self):
+        """{nom: (taille, date de modification)} des fichiers du dossier local."""
+        with os.scandir(self.local) as entries:
+            return {entry.name: (entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries if entry.is_file()}
+
+    def changed_files(self):
+        """Fichiers créés ou modifiés pendant le traitement (livrables, rapports, archive des fiches)."""
+        return sorted(name for name, state in self.scan().items() if self.snapshot.get(name) != state)
+
+    def sync(self):
+        """Recopie groupée des fichiers produits vers le dossier réseau ; retourne la liste des échecs."""
+        start = time.perf_counter()
+        names = self.changed_files()
+        self.failed = [name for name in names
+                       if not copy_with_retries(os.path.join(self.local, name), os.path.join(self.remote, name))]
+        QgsMessageLog.logMessage(f"{len(names) - len(self.failed)} fichier(s) recopié(s) vers {self.remote} en "
+                                 f"{time.perf_counter() - start:.2f} s.", "Biblizou")
+        return self.failed
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return False
+        release_store(self.local)
+        _sources.pop(self.local, None)
+        if exc_type is not None:
+            # Traitement en échec : rien n'est recopié, mais rien n'est supprimé (fiches téléchargées, archive,
+            # livrables partiels)
+            QgsMessageLog.logMessage(f"Traitement interrompu ({exc}) : fichiers de travail conservés dans "
+                                     f"{self.local}.", "Biblizou", Qgis.Critical)
+            return False
+        try:
+            if self.sync():
+                # Les livrables non recopiés restent dans le dossier local pour ne pas être perdus
+                QgsMessageLog.logMessage(f"Fichiers non recopiés vers {self.remote} : {', '.join(self.failed)}. "
+                                         f"Ils restent disponibles dans {self.local}.", "Biblizou", Qgis.Critical)
+                return False
+        except Exception as e:
+            QgsMessageLog.logMessage(f"Recopie vers {self.remote} impossible : {e}. Fichiers conservés dans "
+                                     f"{self.local}.", "Biblizou", Qgis.Critical)
+            return False
+        shutil.rmtree(self.local, ignore_errors=True)
+        return False
+
+
+def staged(folder_path, function, reuse=None):
+    """Exécute function(dossier de travail) dans un Staging de folder_path et retourne son résultat.
+
+    Si le dossier doit être copié en local, reuse(folder_path) est d'abord appelé sur le dossier d'origine : un
+    résultat vrai (livrables d'une exécution identique recopiés, voir RunMemo) est retourné sans copie."""
+    staging = Staging(folder_path)
+    if reuse is not None and staging.enabled and os.path.isdir(folder_path):
+        reused = reuse(folder_path)
+        if reused:
+            return reused
+    with staging as work_folder:
+        note_output_folder(work_folder)  # profil éventuel écrit avec les livrables, puis recopié avec eux
+        try:
+            return function(work_folder)
+        finally:
+            flush_profile()
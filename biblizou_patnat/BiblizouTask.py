@@ -0,0 +1,109 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : BiblizouTask.py
+Groupe : Biblizou_PatNat
+Description : Module commun pour exécuter les traitements Biblizou en tâche de fond (QgsTask),
+    avec barre de progression et annulation entre deux fichiers.
+Dépendances :
+    - Python 3.x
+    - QGIS (QgsTask, QgsApplication, QgsMessageLog)
+    - BiblizouProfile (profilage à la demande)
+
+Utilisation :
+    Les modules Biblizou lancent leur traitement long via lancer_tache(). La fonction passée
+    reçoit la tâche en argument et doit appeler task.avancer() et task.isCanceled() entre
+    deux fichiers. Les messages destinés à la barre QGIS sont différés jusqu'à la fin de la
+    tâche, car l'interface ne doit être manipulée que depuis le fil principal.
+    Avec BIBLIZOU_PROFILE=sample ou cprofile, chaque tâche est profilée (BiblizouProfile).
+"""
+
+import time
+from qgis.core import QgsApplication, QgsMessageLog, QgsTask, Qgis
+from BiblizouProfile import start_profile, stop_profile
+
+LOG_INTERVAL = 5  # secondes minimum entre deux lignes de progression dans le journal
+
+# Références vers les tâches en cours, pour éviter leur destruction par le ramasse-miettes
+_taches_actives = set()
+
+
+class BiblizouTask(QgsTask):
+    def __init__(self, description, function, iface=None, on_finished=None):
+        """Initialisation de la tâche."""
+        super().__init__(description, QgsTask.CanCancel)
+        self.function = function
+        self.iface = iface
+        self.on_finished = on_finished
+        self.result = None
+        self.exception = None
+        self.messages = []
+        self.logged_at = 0.0  # dernière progression journalisée (time.monotonic)
+
+    def run(self):
+        """Exécute le traitement hors du fil principal (ne pas toucher à l'interface ici)."""
+        profile = None
+        try:
+            profile = start_profile(self.description())  # None sauf BIBLIZOU_PROFILE (BiblizouProfile)
+            self.result = self.function(self)
+            return not self.isCanceled()
+        except Exception as e:
+            self.exception = e
+            return False
+        finally:
+            stop_profile(profile)
+
+    def avancer(self, etape, fait, total):
+        """Met à jour la progression (ex. : 'Fichiers analysés', 3, 12). La barre suit chaque appel ; le
+        journal n'en garde qu'une ligne toutes les LOG_INTERVAL secondes, plus la dernière étape."""
+        if total:
+            self.setProgress(100.0 * fait / total)
+        now = time.monotonic()
+        if fait == total or now - self.logged_at >= LOG_INTERVAL:
+            self.logged_at = now
+            QgsMessageLog.logMessage(f"{self.description()} - {etape} : {fait}/{total}", "Biblizou", Qgis.Info)
+
+    def push_message(self, title, text, level=Qgis.Info):
+        """Mémorise un message à afficher dans la barre QGIS à la fin de la tâche."""
+        self.messages.append((title, text, level))
+
+    def finished(self, result):
+        """Appelée dans le fil principal une fois la tâche terminée ou annulée."""
+        _taches_actives.discard(self)
+        if self.iface is not None:
+            bar = self.iface.messageBar()
+            for title, text, level in self.messages:
+                bar.pushMessage(title, text, level=level)
+            if self.isCanceled():
+                bar.pushMessage("Annulation", f"{self.description()} : traitement annulé.", level=Qgis.Warning)
+            elif self.exception is not None:
+                bar.pushMessage("Erreur", f"{self.description()} : {self.exception}", level=Qgis.Critical)
+        if self.exception is not None:
+            QgsMessageLog.logMessage(f"{self.description()} : {self.exception}", "Biblizou", Qgis.Critical)
+        if self.on_finished:
+            self.on_finished(result, self)
+
+
+def lancer_tache(description, function, iface=None, on_finished=None):
+    """Crée une BiblizouTask et la confie au gestionnaire de tâches de QGIS."""
+    task = BiblizouTask(description, function, iface, on_finished)
+    _taches_actives.add(task)
+    QgsApplication.taskManager().addTask(task)
+    return task
+
+
+def tache_annulee(task):
+    """Indique si la tâche (éventuellement absente) a été annulée par l'utilisateur."""
+    return task is not None and task.isCanceled()
+
+
+def pousser_message(iface, task, title, text, level=Qgis.Info):
+    """Affiche un message dans la barre QGIS, ou le diffère si l'appel vient d'une tâche de fond."""
+    if task is not None:
+        task.push_message(title, text, level)
+    elif iface is not None:
+        iface.messageBar().pushMessage(title, text, level=level)
+    else:
+        QgsMessageLog.logMessage(f"{title} : {text}", "Biblizou", level)
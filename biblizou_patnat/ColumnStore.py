@@ -0,0 +1,149 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : ColumnStore.py
+Groupe : Biblizou_PatNat
+Description : Accumulateur en colonnes pour les synthèses multi-sites. Les lignes de chaque site sont ajoutées
+    par blocs de tableaux (une liste de tableaux par colonne, sans dictionnaire par ligne) ; les colonnes
+    texte très répétées (règne, groupe, site...) sont codées par dictionnaire : chaque valeur distincte est
+    stockée une fois et les lignes ne portent qu'un code entier. Le DataFrame est construit une seule fois à
+    la fin, avec ces colonnes en pandas.Categorical (catégories triées) : le codage est conservé jusqu'à
+    l'export, contrairement à pd.concat qui repasse en texte des catégoriels aux catégories différentes.
+    Avec un plafond mémoire, les blocs sont déversés dans un dossier temporaire dès qu'il est dépassé ; seuls
+    les dictionnaires (valeurs distinctes) restent en mémoire, et iter_frames relit le tout par blocs.
+Dépendances :
+    - Python 3.x
+    - numpy, pandas
+    - os, shutil, tempfile
+
+Utilisation :
+    synthese = ColumnAccumulator(['REGNE', 'GROUPE', 'CD_NOM', 'NOM_COMPLET'], encoded=['REGNE', 'GROUPE'])
+    for df in frames:
+        synthese.append(df)
+    df = synthese.finalize()
+    for regne, lignes in df.groupby('REGNE', observed=True): ...
+
+    Mode flux (mémoire bornée) :
+        synthese = ColumnAccumulator(colonnes, encoded=colonnes, memory_limit=256 * 2**20)
+        ...
+        for bloc in synthese.iter_frames():
+            ...
+        synthese.close()  # supprime les blocs déversés
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+OBJECT_BYTES = 64  # estimation de la taille d'une valeur texte non codée (objet Python + pointeur)
+
+
+def chunk_bytes(values):
+    """Taille d'un bloc de colonne (estimée pour un tableau d'objets)."""
+    return values.nbytes if values.dtype != object else values.size * OBJECT_BYTES
+
+
+class ColumnAccumulator:
+    def __init__(self, columns, encoded=(), memory_limit=None):
+        """Accumulateur des `columns` ; les colonnes `encoded` sont codées par dictionnaire. Au-delà de
+        `memory_limit` octets de blocs en mémoire, les blocs sont déversés sur disque."""
+        self.columns = list(columns)
+        self.encoded = set(encoded)
+        self.memory_limit = memory_limit
+        self.chunks = {column: [] for column in self.columns}
+        self.dictionaries = {column: {} for column in self.encoded}
+        self.rows = 0
+        self.buffered = 0  # octets des blocs en mémoire, tenu à jour à chaque ajout
+        self.spill_dir = None
+        self.spilled = []  # chemins des blocs déversés, dans l'ordre d'ajout
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, df, **constants):
+        """Ajoute les lignes de `df` ; `constants` donne la valeur commune d'une colonne absente de `df`
+        (ex. SITE=...)."""
+        if df.empty:
+            return
+        for column in self.columns:
+            if column in constants:
+                values = np.full(len(df), constants[column], dtype=object)
+            elif column in self.encoded and isinstance(df[column].dtype, pd.CategoricalDtype):
+                values = df[column].array
+            else:
+                values = df[column].to_numpy(dtype=object)
+            if column in self.encoded:
+                values = self.encode(column, values)
+            self.chunks[column].append(values)
+            self.buffered += chunk_bytes(values)
+        self.rows += len(df)
+        if self.memory_limit is not None and self.buffered > self.memory_limit:
+            self.spill()
+
+    def nbytes(self):
+        """Taille (estimée pour les colonnes texte non codées) des blocs en mémoire."""
+        return self.buffered
+
+    def spill(self):
+        """Écrit les blocs en mémoire dans un fichier du dossier temporaire et les libère."""
+        if not self.chunks[self.columns[0]]:
+            return
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='biblizou_columns_')
+        path = os.path.join(self.spill_dir, f"{len(self.spilled):05d}.npz")
+        # Colonnes codées : entiers seulement ; colonnes texte éventuelles : objets (pickle)
+        np.savez(path, **{f"c{i}": np.concatenate(self.chunks[column]) for i, column in enumerate(self.columns)})
+        self.spilled.append(path)
+        self.chunks = {column: [] for column in self.columns}
+        self.buffered = 0
+
+    def iter_frames(self):
+        """DataFrames successifs (blocs déversés puis blocs en mémoire), sans tout recharger à la fois."""
+        for path in self.spilled:
+            with np.load(path, allow_pickle=True) as arrays:
+                yield self.frame([arrays[f"c{i}"] for i in range(len(self.columns))])
+        if self.chunks[self.columns[0]]:
+            yield self.frame([np.concatenate(self.chunks[column]) for column in self.columns])
+
+    def close(self):
+        """Supprime les blocs déversés sur disque."""
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+        self.spill_dir, self.spilled = None, []
+
+    def encode(self, column, values):
+        """Codes entiers des valeurs, le dictionnaire de la colonne étant complété au besoin."""
+        if isinstance(values, pd.Categorical) and not (values.codes < 0).any():
+            local_codes, uniques = values.codes, values.categories  # déjà codées : seules les catégories sont lues
+        else:
+            local_codes, uniques = pd.factorize(pd.Series(np.asarray(values, dtype=object)).fillna(''))
+        dictionary = self.dictionaries[column]
+        remap = np.array([dictionary.setdefault(value, len(dictionary)) for value in uniques], dtype=np.int32)
+        return remap[local_codes]
+
+    def categories(self, column):
+        """Valeurs distinctes d'une colonne codée, dans l'ordre des codes."""
+        return list(self.dictionaries[column])
+
+    def frame(self, arrays):
+        """DataFrame d'un bloc (une colonne par tableau), colonnes codées en Categorical."""
+        data = {}
+        for column, values in zip(self.columns, arrays):
+            if column in self.encoded:
+                categories = self.categories(column)
+                data[column] = pd.Categorical.from_codes(values, categories).reorder_categories(sorted(categories))
+            else:
+                data[column] = values
+        return pd.DataFrame(data, columns=self.columns)
+
+    def finalize(self):
+        """DataFrame de toutes les lignes accumulées (colonnes codées en Categorical)."""
+        frames = list(self.iter_frames())
+        if not frames:
+            return self.frame([np.empty(0, dtype=np.int32 if column in self.encoded else object)
+                               for column in self.columns])
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
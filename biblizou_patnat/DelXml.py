@@ -9,6 +9,7 @@ Description : Module pour supprimer tous les xml après traitements.
 Dépendances :
     - Python 3.x
     - QGIS (QgsMessageBar, QgsMessageLog)
+    - XmlStore (archive biblizou_xml.zip), XmlCatalog (fiches ZNIEFF / Natura 2000 reconnues par leur contenu)
 
 Utilisation :
     Ce module doit être appelé depuis une extension QGIS. Il prend en entrée un
@@ -17,28 +18,48 @@ Utilisation :
 
 
 import os
-from qgis.core import QgsMessageLog
+from qgis.core import QgsMessageLog, Qgis
+from qgis.utils import iface
 from PyQt5.QtWidgets import QInputDialog, QMessageBox
+from BiblizouTask import lancer_tache, tache_annulee, pousser_message
+from XmlStore import get_store
+from XmlCatalog import catalog, MANIFEST_NAME
 
 class DelXml:
     def __init__(self, main_window):
         """Initialisation de la classe."""
         self.main_window = main_window  # Référence à la fenêtre principale contenant la case à cocher delXml
 
-    def delete_files_in_directory(self, folder_path):
-        """Supprime les fichiers XML et TXT inutiles dans le dossier spécifié."""
+    def delete_files_in_directory(self, folder_path, task=None):
+        """Supprime les fiches XML isolées, l'archive des fiches (XmlStore) et le catalogue du dossier spécifié.
+
+        Seules les fiches reconnues comme ZNIEFF ou Natura 2000 par XmlCatalog sont supprimées : les autres
+        fichiers XML du dossier sont laissés en place."""
         try:
-            xml_files = [f for f in os.listdir(folder_path) if f.endswith('.xml')]
+            xml_files = sorted(name for name, entry in catalog(folder_path).items()
+                               if entry['source'] == 'file' and entry['kind'] is not None)
 
-            for file in xml_files :
+            for idx, file in enumerate(xml_files, start=1):
+                if tache_annulee(task):
+                    return False
+                if task is not None:
+                    task.avancer("Fichiers supprimés", idx, len(xml_files))
                 file_path = os.path.join(folder_path, file)
                 if os.path.exists(file_path):
                     os.remove(file_path)
                     QgsMessageLog.logMessage(f"Fichier supprimé : {file_path}", "Biblizou")
                 else:
                     QgsMessageLog.logMessage(f"Fichier non trouvé : {file_path}", "Biblizou")
+            archived = get_store(folder_path).delete()
+            if archived:
+                QgsMessageLog.logMessage(f"Archive supprimée ({archived} fiches) : {folder_path}", "Biblizou")
+            manifest = os.path.join(folder_path, MANIFEST_NAME)
+            if os.path.isfile(manifest):
+                os.remove(manifest)
+            return True
         except Exception as e:
-            QMessageBox.critical(None, "Erreur", f"Erreur lors de la suppression des fichiers : {e}")
+            pousser_message(iface, task, "Erreur", f"Erreur lors de la suppression des fichiers : {e}", Qgis.Critical)
+            return False
 
     def run(self):
         """Exécute la suppression si la case à cocher est activée."""
@@ -51,8 +72,12 @@ class DelXml:
             QMessageBox.warning(None, "Erreur", "Dossier invalide ou non sélectionné.")
             return
 
-        self.delete_files_in_directory(folder_path)
-        QMessageBox.information(None, "Succès", "Suppression des fichiers terminée.")
+        def fin(result, task):
+            if result and task.result:
+                QMessageBox.information(None, "Succès", "Suppression des fichiers terminée.")
+
+        lancer_tache("Biblizou : suppression des XML",
+                     lambda task: self.delete_files_in_directory(folder_path, task), iface, fin)
 
 # Exemple d'utilisation dans l'extension :
 def run_module(main_window):
@@ -0,0 +1,77 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : DocxBuilder.py
+Groupe : Biblizou_PatNat
+Description : Construction en une passe des documents DOCX de descriptions de sites (ZNIEFF, Natura 2000).
+    La mise en forme est portée par deux styles nommés du document au lieu d'être répétée sur chaque run.
+Dépendances :
+    - Python 3.x
+    - python-docx
+
+Utilisation :
+    builder = DocxBuilder()
+    builder.add_site("Lande de ... - 530000001", ["Paragraphe 1", "Paragraphe 2"])
+    builder.save(docx_file)
+
+    Les textes doivent être normalisés à l'extraction (normalize_text), ce qui remplace l'ancien
+    passage clean_document sur tout le document.
+"""
+
+from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
+from docx.shared import Pt, RGBColor
+
+TITLE_STYLE = 'Biblizou Titre site'
+TEXT_STYLE = 'Biblizou Texte'
+
+
+def normalize_text(text):
+    """Réduit les espaces, tabulations et retours à la ligne à un seul espace."""
+    return ' '.join(text.split()) if text else ''
+
+
+class DocxBuilder:
+    def __init__(self):
+        """Crée le document et ses styles nommés."""
+        self.doc = Document()
+        self.body = self.doc.element.body
+        self.title_style_id = self.add_style(TITLE_STYLE, bold=True, underline=True, color=RGBColor(0, 153, 153))
+        self.text_style_id = self.add_style(TEXT_STYLE, color=RGBColor(0, 0, 0), left_indent=Pt(28))
+        self.paragraph_count = 0
+
+    def add_style(self, name, bold=False, underline=False, color=None, left_indent=None):
+        """Déclare un style de paragraphe Calibri 11 et retourne son identifiant."""
+        style = self.doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+        style.base_style = self.doc.styles['Normal']
+        style.font.name = 'Calibri'
+        style.font.size = Pt(11)
+        style.font.bold = bold
+        style.font.underline = underline
+        if color is not None:
+            style.font.color.rgb = color
+        if left_indent is not None:
+            style.paragraph_format.left_indent = left_indent
+        return style.style_id
+
+    def add_paragraph(self, text, style_id=None):
+        """Ajoute un paragraphe directement dans le XML du corps (sans objet Paragraph intermédiaire)."""
+        p = self.body.add_p()
+        if style_id is not None:
+            p.style = style_id
+        if text:
+            p.add_r().text = text
+        self.paragraph_count += 1
+
+    def add_site(self, title, paragraphs):
+        """Ajoute le titre d'un site, ses paragraphes de description et une ligne vide de séparation."""
+        self.add_paragraph(title, self.title_style_id)
+        for text in paragraphs:
+            if text:
+                self.add_paragraph(text, self.text_style_id)
+        self.add_paragraph('')
+
+    def save(self, docx_file):
+        self.doc.save(docx_file)
@@ -0,0 +1,104 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : GeometryCache.py
+Groupe : Biblizou_PatNat
+Description : Cache de la géométrie de l'aire d'étude (fusionnée, reprojetée et préparée) partagé par les
+    sélecteurs de zonages (ZNIEFF1, ZNIEFF2, SIC, ZPS), au sein d'un même outil et d'un outil à l'autre.
+Dépendances :
+    - Python 3.x
+    - QGIS (QgsGeometry, QgsCoordinateTransform)
+
+Utilisation :
+    from GeometryCache import study_area
+    area = study_area(self.ae_eloignee, couche_source.crs())
+    if area is not None:
+        request = QgsFeatureRequest().setFilterRect(area.bbox)
+        ... area.intersects(feature.geometry())
+
+    La clé est (id de la couche, état de la couche, SCR cible). L'état change dès que la couche est
+    éditée, filtrée ou que son fichier est modifié : la fusion est alors recalculée.
+"""
+
+import os
+import threading
+from qgis.core import QgsGeometry, QgsCoordinateTransform, QgsProject, QgsMessageLog
+
+_lock = threading.RLock()
+_dissolved = {}     # (id de couche, état) -> QgsGeometry dans le SCR de la couche
+_projected = {}     # (id de couche, état, SCR cible) -> StudyArea
+_versions = {}      # id de couche -> nombre de modifications signalées
+
+
+class StudyArea:
+    def __init__(self, geometry):
+        """Géométrie fusionnée et reprojetée, avec son moteur GEOS préparé pour les tests répétés."""
+        self.geometry = geometry
+        self.bbox = geometry.boundingBox()
+        self.engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+        self.engine.prepareGeometry()
+
+    def intersects(self, geometry):
+        return self.engine.intersects(geometry.constGet())
+
+
+def _watch(layer):
+    """Incrémente la version de la couche à chaque modification signalée par QGIS."""
+    if layer.id() in _versions:
+        return
+    _versions[layer.id()] = 0
+
+    def bump(*args):
+        with _lock:
+            _versions[layer.id()] = _versions.get(layer.id(), 0) + 1
+
+    for signal in ('dataChanged', 'subsetStringChanged', 'crsChanged'):
+        if hasattr(layer, signal):
+            getattr(layer, signal).connect(bump)
+    layer.willBeDeleted.connect(lambda: invalidate(layer.id(), forget=True))
+
+
+def layer_state(layer):
+    """État de modification de la couche : version signalée, filtre, édition en cours, date du fichier."""
+    path = layer.source().split('|')[0]
+    mtime = os.path.getmtime(path) if os.path.isfile(path) else None
+    return (_versions.get(layer.id(), 0), layer.subsetString(), layer.isModified(), layer.crs().authid(), mtime)
+
+
+def study_area(layer, target_crs):
+    """Retourne la StudyArea de `layer` dans `target_crs`, ou None si la couche n'a aucune géométrie."""
+    with _lock:
+        _watch(layer)
+        state = layer_state(layer)
+        key = (layer.id(), state, target_crs.authid())
+        if key in _projected:
+            return _projected[key]
+
+        dissolved = _dissolved.get((layer.id(), state))
+        if dissolved is None:
+            geometries = [f.geometry() for f in layer.getFeatures() if f.hasGeometry()]
+            invalidate(layer.id())  # les entrées d'un état précédent ne resserviront plus
+            if not geometries:
+                QgsMessageLog.logMessage(f"Aucune géométrie trouvée dans {layer.name()}.", "Biblizou")
+                return None
+            dissolved = QgsGeometry.unaryUnion(geometries)
+            _dissolved[(layer.id(), state)] = dissolved
+
+        geometry = QgsGeometry(dissolved)
+        if layer.crs() != target_crs:
+            geometry.transform(QgsCoordinateTransform(layer.crs(), target_crs, QgsProject.instance()))
+        area = StudyArea(geometry)
+        _projected[key] = area
+        return area
+
+
+def invalidate(layer_id=None, forget=False):
+    """Vide le cache d'une couche, ou tout le cache si layer_id est None (forget : couche supprimée)."""
+    with _lock:
+        for cache in (_dissolved, _projected):
+            for key in [k for k in cache if layer_id is None or k[0] == layer_id]:
+                del cache[key]
+        if forget:
+            _versions.pop(layer_id, None)
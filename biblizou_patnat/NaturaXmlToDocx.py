@@ -9,10 +9,12 @@ Description : Module pour extraire les descriptions des sites ZNIEFF des fichier
     Il est conçu pour être utilisé dans une extension QGIS
 Dépendances :
     - Python 3.x
-    - QGIS (QgsMessageBar, QgsMessageLog)
+    - QGIS (QgsMessageLog)
     - xml.etree.ElementTree
-    - python-docx
+    - python-docx (via DocxBuilder)
     - os, datetime, PyQt5.QtWidgets
+    - BiblizouMetrics (rapport <fichier>.docx.run.json)
+    - XmlStore (fiches isolées ou archivées dans biblizou_xml.zip), XmlCatalog (type de fiche selon son contenu)
 
 Utilisation :
     Ce module doit être appelé depuis une extension QGIS. Il prend en entrée un
@@ -20,88 +22,105 @@ Utilisation :
 """
 
 import xml.etree.ElementTree as ET
-from docx import Document
-from docx.shared import Pt, RGBColor
+from DocxBuilder import DocxBuilder, normalize_text
 from datetime import datetime
 import os
 from PyQt5.QtWidgets import QFileDialog, QMessageBox
-from qgis.core import QgsMessageBar, QgsProject
+from qgis.core import Qgis, QgsProject
+from qgis.utils import iface
+from BiblizouMetrics import RunMetrics
+from XmlStore import parse_xml
+from XmlCatalog import catalog_files, N2000
+from BiblizouStaging import staged
+from BiblizouTask import lancer_tache, tache_annulee, pousser_message
+
+
+def site_descriptions(root):
+    """(titre, paragraphes normalisés) de chaque site Natura 2000 du formulaire (qualité, vulnérabilité)."""
+    for n2000_elem in root.iter('BIOTOP'):
+        site_name = normalize_text(n2000_elem.findtext('SITE_NAME', ''))
+        sitecode = normalize_text(n2000_elem.findtext('SITECODE', ''))
+        paragraphs = []
+        commentaire_elem = n2000_elem.find('COMMENTAIRE')
+        if commentaire_elem is not None:
+            for commentaire_row_elem in commentaire_elem.iter('COMMENTAIRE_ROW'):
+                for tag in ['QUALITY', 'VULNAR']:
+                    paragraphs.append(normalize_text(commentaire_row_elem.findtext(tag, '')))
+        yield f"{site_name} - {sitecode}", paragraphs
+
 
 class NaturaXmlToDocx:
     def __init__(self, iface):
         self.iface = iface
+        self.task = None
+        self.metrics = RunMetrics('NaturaXmlToDocx')
+
+    def push_message(self, title, text, level):
+        """Affiche un message dans la barre QGIS (différé si le traitement tourne en tâche de fond)."""
+        pousser_message(self.iface, self.task, title, text, level)
 
     def obtain_folder_path(self):
         """ Ouvre une boîte de dialogue pour sélectionner un dossier """
         folder_path = QFileDialog.getExistingDirectory(None, "Sélectionner un dossier contenant les fichiers XML")
         if not folder_path:
-            self.iface.messageBar().pushMessage("Annulation", "Aucun dossier sélectionné", level=QgsMessageBar.WARNING)
+            self.iface.messageBar().pushMessage("Annulation", "Aucun dossier sélectionné", level=Qgis.Warning)
         return folder_path
 
-    def xml_to_docx(self, xml_file, doc):
+    def xml_to_docx(self, xml_file, builder):
         try:
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-            for n2000_elem in root.iter('BIOTOP'):
-                sitecode_elem = n2000_elem.find('SITECODE')
-                site_name_elem = n2000_elem.find('SITE_NAME')
-                site_name = site_name_elem.text if site_name_elem is not None else ''
-                sitecode = sitecode_elem.text if sitecode_elem is not None else ''
-                combined_text = f"{site_name} - {sitecode}"
-                para = doc.add_paragraph()
-                run = para.add_run(combined_text)
-                run.bold = True
-                run.underline = True
-                run.font.color.rgb = RGBColor(0, 153, 153)
-                run.font.name = 'Calibri'
-                run.font.size = Pt(11)
-                commentaire_elem = n2000_elem.find('COMMENTAIRE')
-                if commentaire_elem is not None:
-                    for commentaire_row_elem in commentaire_elem.iter('COMMENTAIRE_ROW'):
-                        for tag in ['QUALITY', 'VULNAR']:
-                            elem = commentaire_row_elem.find(tag)
-                            if elem is not None and elem.text:
-                                para = doc.add_paragraph(elem.text.strip())
-                                para.paragraph_format.left_indent = Pt(28)
-                                run = para.runs[0]
-                                run.font.name = 'Calibri'
-                                run.font.size = Pt(11)
-                                run.font.color.rgb = RGBColor(0, 0, 0)
-                doc.add_paragraph('')
+            tree = parse_xml(xml_file)
+            for title, paragraphs in site_descriptions(tree.getroot()):
+                builder.add_site(title, paragraphs)
         except ET.ParseError as e:
-            self.iface.messageBar().pushMessage("Erreur XML", f"Erreur de parsing dans {xml_file}: {e}", level=QgsMessageBar.CRITICAL)
+            self.metrics.incr('files.failed')
+            self.push_message("Erreur XML", f"Erreur de parsing dans {xml_file}: {e}", Qgis.Critical)
         except Exception as e:
-            self.iface.messageBar().pushMessage("Erreur", f"Erreur inattendue avec {xml_file}: {e}", level=QgsMessageBar.CRITICAL)
+            self.metrics.incr('files.failed')
+            self.push_message("Erreur", f"Erreur inattendue avec {xml_file}: {e}", Qgis.Critical)
 
-    def clean_document(self, doc):
-        for para in doc.paragraphs:
-            for run in para.runs:
-                run.text = ' '.join(run.text.split())
-            if para.text.strip() == '':
-                para.clear()
-
-    def process_xml_files_in_folder(self, folder_path):
+    def process_xml_files_in_folder(self, folder_path, task=None):
+        self.task = task
+        self.metrics = RunMetrics('NaturaXmlToDocx')
         if not os.path.isdir(folder_path):
-            self.iface.messageBar().pushMessage("Erreur", f"Le chemin {folder_path} n'est pas un répertoire valide.", level=QgsMessageBar.CRITICAL)
+            self.push_message("Erreur", f"Le chemin {folder_path} n'est pas un répertoire valide.", Qgis.Critical)
             return
-        xml_files = [f for f in os.listdir(folder_path) if f.startswith('FR') and f.endswith('.xml') and len(f) == 13]
+        xml_files = catalog_files(folder_path, N2000)
         if not xml_files:
-            self.iface.messageBar().pushMessage("Information", "Aucun fichier XML trouvé dans le dossier.", level=QgsMessageBar.WARNING)
+            self.push_message("Information", "Aucun fichier XML trouvé dans le dossier.", Qgis.Warning)
             return
         current_time = datetime.now().strftime("%Y%m%d%H%M%S")
         docx_file = os.path.join(folder_path, f'N2000_Descriptions_des_sites_{current_time}.docx')
-        doc = Document()
-        for xml_file in xml_files:
+        builder = DocxBuilder()
+        for idx, xml_file in enumerate(xml_files, start=1):
+            if tache_annulee(task):
+                return
             full_path = os.path.join(folder_path, xml_file)
-            self.xml_to_docx(full_path, doc)
-        self.clean_document(doc)
+            with self.metrics.span('parse'):
+                self.xml_to_docx(full_path, builder)
+            self.metrics.incr('files.parsed')
+            if task is not None:
+                task.avancer("Fichiers analysés", idx, len(xml_files))
+        self.metrics.incr('rows.written', builder.paragraph_count)
         try:
-            doc.save(docx_file)
-            self.iface.messageBar().pushMessage("Succès", f"Document créé : {docx_file}", level=QgsMessageBar.INFO)
+            with self.metrics.span('save'):
+                builder.save(docx_file)
+            self.metrics.write_report(docx_file, folder=folder_path)
+            self.push_message("Succès", f"Document créé : {docx_file}", Qgis.Success)
         except Exception as e:
-            self.iface.messageBar().pushMessage("Erreur", f"Erreur lors de l'enregistrement du document: {e}", level=QgsMessageBar.CRITICAL)
+            self.push_message("Erreur", f"Erreur lors de l'enregistrement du document: {e}", Qgis.Critical)
 
     def run(self):
         folder_path = self.obtain_folder_path()
         if folder_path:
-            self.process_xml_files_in_folder(folder_path)
\ No newline at end of file
+            lancer_tache("Biblizou : descriptions Natura 2000 (DOCX)",
+                         lambda task: staged(folder_path, lambda work_folder:
+                                             self.process_xml_files_in_folder(work_folder, task)),
+                         self.iface)
+
+# Pour exécuter le module dans QGIS
+def run_module(iface):
+    module = NaturaXmlToDocx(iface)
+    module.run()
+
+if __name__ in ('__main__', '__console__'):
+    run_module(iface)
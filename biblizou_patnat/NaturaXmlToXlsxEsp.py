@@ -9,10 +9,16 @@ Description : Module pour extraire des données d'espèces directive à partir d
 Dépendances :
     - Python 3.x
     - QGIS (QgsMessageLog)
-    - xml.etree.ElementTree
+    - XmlBackend, XmlSchema (extraction déclarative : schéma N2000_ESPECES)
     - pandas
     - openpyxl
     - os, datetime
+    - BiblizouMetrics (rapport <fichier>.xlsx.run.json)
+    - XmlStore (fiches isolées ou archivées dans biblizou_xml.zip), XmlCatalog (type de fiche selon son contenu)
+    - BiblizouHttp (requêtes TaxRef)
+    - XlsxStream (présentation longue, BiblizouConfig.XLSX_LAYOUT = 'long')
+    - OutputBackends (CSV, Parquet, SQLite, GeoPackage, ODS selon BiblizouConfig.OUTPUT_FORMATS)
+    - RunMemo (réutilisation des livrables d'une exécution identique, BIBLIZOU_FORCE_REBUILD=1 pour tout refaire)
 
 Utilisation :
     Ce module doit être appelé depuis une extension QGIS.
@@ -20,24 +26,42 @@ Utilisation :
 
 from PyQt5.QtWidgets import QFileDialog
 from qgis.core import QgsMessageLog, Qgis
-import xml.etree.ElementTree as ET
-import requests
+from qgis.utils import iface
 import pandas as pd
 import os
 from datetime import datetime
 from openpyxl import load_workbook
 from openpyxl.styles import Alignment, Border, Side, PatternFill, Font
-import time
 from collections import defaultdict
+import BiblizouConfig
+from BiblizouHttp import fetch
+from BiblizouMetrics import RunMetrics
+from XmlBackend import parse_root, PARSE_ERRORS
+from XmlSchema import N2000_ESPECES
+from XmlCatalog import catalog_files, N2000
+from XlsxStream import export_long, unique_title
+from OutputBackends import DataOutputs
+from RunMemo import fingerprint, reuse_outputs
+from BiblizouStaging import staged
+from BiblizouTask import lancer_tache, tache_annulee, pousser_message
 
 class NaturaXmlToXlsxEsp:
     def __init__(self, iface):
         self.iface = iface
+        self.task = None
+        self.metrics = RunMetrics('NaturaXmlToXlsxEsp')
+
+    def push_message(self, title, text, level):
+        pousser_message(self.iface, self.task, title, text, level)
 
     def run(self):
         folder_path = self.obtain_folder_path()
         if folder_path:
-            self.process_xml_files_in_folder(folder_path)
+            lancer_tache("Biblizou : espèces Natura 2000 (XLSX)",
+                         lambda task: staged(folder_path, lambda work_folder:
+                                             self.process_xml_files_in_folder(work_folder, task),
+                                             reuse=self.reuse_previous),
+                         self.iface)
 
     def obtain_folder_path(self):
         folder_path = QFileDialog.getExistingDirectory(None, "Sélectionner un dossier contenant les fichiers XML")
@@ -51,107 +75,174 @@ class NaturaXmlToXlsxEsp:
 
     def get_taxref_data(self, cd_nom, cache={}):
         if cd_nom in cache:
+            self.metrics.incr('cache.hits')
             return cache[cd_nom]
+        self.metrics.incr('cache.misses')
 
-        url = f"https://taxref.mnhn.fr/api/taxa/{cd_nom}"
+        url = BiblizouConfig.taxon_url(cd_nom)
         headers = {"accept": "application/hal+json;version=1"}
 
+        with self.metrics.span('taxref'):
+            response = fetch(url, headers=headers, metrics=self.metrics)
+        if response is None:
+            return {'REGNE': '', 'GROUPE': '', 'NOM_COMPLET': '', 'NOM_VERN': ''}
         try:
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                data = response.json()
-                result = {
-                    'REGNE': data.get('kingdomName', ''),
-                    'GROUPE': data.get('vernacularGroup2', ''),
-                    'NOM_COMPLET': data.get('fullName', ''),
-                    'NOM_VERN': data.get('frenchVernacularName', '')
-                }
-                cache[cd_nom] = result
-                return result
-            else:
-                QgsMessageLog.logMessage(f"Erreur API pour {cd_nom}: {response.status_code}", "Biblizou", Qgis.Warning)
-                return {'REGNE': '', 'GROUPE': '', 'NOM_COMPLET': '', 'NOM_VERN': ''}
+            data = response.json()
+            result = {
+                'REGNE': data.get('kingdomName', ''),
+                'GROUPE': data.get('vernacularGroup2', ''),
+                'NOM_COMPLET': data.get('fullName', ''),
+                'NOM_VERN': data.get('frenchVernacularName', '')
+            }
+            cache[cd_nom] = result
+            return result
         except Exception as e:
-            QgsMessageLog.logMessage(f"Erreur API: {e}", "Biblizou", Qgis.Critical)
+            self.metrics.incr('http.errors')
+            QgsMessageLog.logMessage(f"Erreur API pour {cd_nom}: {e}", "Biblizou", Qgis.Critical)
             return {'REGNE': '', 'GROUPE': '', 'NOM_COMPLET': '', 'NOM_VERN': ''}
 
-    def process_xml_files_in_folder(self, folder_path):
+    def output_file(self, folder_path):
+        current_time = datetime.now().strftime("%Y%m%d%H%M%S")
+        return os.path.join(folder_path, f'N2000_Synthèse_des_espèces_AnxI-II_{current_time}.xlsx')
+
+    def reuse_previous(self, folder_path):
+        """Réutilisation vérifiée dans le dossier d'origine, avant sa copie en local (staged) : fichiers
+        recopiés, liste vide s'il faut lancer le traitement."""
+        self.metrics = RunMetrics('NaturaXmlToXlsxEsp')
+        key = fingerprint('NaturaXmlToXlsxEsp', folder_path, catalog_files(folder_path, N2000), taxref=True)
+        reused = reuse_outputs(folder_path, key, self.output_file(folder_path), self.metrics)
+        if reused:
+            self.push_message("Succès", f"Données inchangées, livrables réutilisés : {', '.join(reused)}",
+                              Qgis.Success)
+        return reused
+
+    def process_xml_files_in_folder(self, folder_path, task=None):
+        self.task = task
+        self.metrics = RunMetrics('NaturaXmlToXlsxEsp')
         if not os.path.isdir(folder_path):
-            self.iface.messageBar().pushMessage("Erreur", f"Le chemin {folder_path} n'est pas un dossier valide.",
-                                                level=Qgis.Critical)
+            self.push_message("Erreur", f"Le chemin {folder_path} n'est pas un dossier valide.", Qgis.Critical)
             return
 
-        xml_files = [f for f in os.listdir(folder_path) if f.startswith('FR') and f.endswith('.xml') and len(f) == 13]
+        xml_files = catalog_files(folder_path, N2000)
         if not xml_files:
-            self.iface.messageBar().pushMessage("Information", "Aucun fichier XML trouvé dans le dossier.",
-                                                level=Qgis.Info)
+            self.push_message("Information", "Aucun fichier XML trouvé dans le dossier.", Qgis.Info)
             return
 
         cache = {}
-        current_time = datetime.now().strftime("%Y%m%d%H%M%S")
-        excel_file = os.path.join(folder_path, f'N2000_Synthèse_des_espèces_AnxI-II_{current_time}.xlsx')
+        excel_file = self.output_file(folder_path)
+        # Exécution identique déjà faite (fiches, options, version de TaxRef déclarée) : livrables recopiés
+        key = fingerprint('NaturaXmlToXlsxEsp', folder_path, xml_files, taxref=True)
+        reused = reuse_outputs(folder_path, key, excel_file, self.metrics)
+        if reused:
+            self.push_message("Succès", f"Données inchangées, livrables réutilisés : {', '.join(reused)}",
+                              Qgis.Success)
+            return
+
+        def sites():
+            for xml_file in xml_files:
+                with self.metrics.span('parse'):
+                    df, sitecode, site_name = self.xml_to_dataframe(os.path.join(folder_path, xml_file), cache)
+                self.metrics.incr('files.parsed')
+                yield df, sitecode, site_name
+
+        if self.export_sites(sites(), excel_file, task, len(xml_files)):
+            processing_time = self.metrics.elapsed()
+            self.metrics.write_report(excel_file, folder=folder_path, fingerprint=key)
+            self.push_message("Succès", f"Traitement terminé en {processing_time:.2f} secondes.", Qgis.Success)
 
+    def export_sites(self, sites, excel_file, task=None, total=None):
+        """Exporte un itérable de (df, sitecode, site_name), consommé au fil de l'eau, dans les formats demandés
+        (BiblizouConfig.OUTPUT_FORMATS) : classeur XLSX (export_xlsx) et/ou tables de données (OutputBackends).
+
+        Utilisé par process_xml_files_in_folder et par la chaîne téléchargement -> export (NaturaDwlXml)."""
+        try:
+            with DataOutputs(excel_file, 'especes_directive', self.metrics) as outputs:
+                sites = outputs.mirror(sites, lambda df, sitecode, site_name: (
+                    df.drop(columns=['NOM'], errors='ignore'), {'SITECODE': sitecode, 'SITE_NAME': site_name}))
+                if outputs.xlsx:
+                    done = self.export_xlsx(sites, excel_file, task, total)
+                else:
+                    done = outputs.drain(sites, task, total)
+                if not done:
+                    outputs.discard()
+                return done
+        except Exception as e:
+            self.push_message("Erreur", f"Problème lors de l'écriture des tables : {e}", Qgis.Critical)
+            return False
+
+    def export_xlsx(self, sites, excel_file, task=None, total=None):
+        """Écrit un onglet par site à partir d'un itérable de (df, sitecode, site_name), consommé au fil de l'eau.
+
+        Avec BiblizouConfig.XLSX_LAYOUT = 'long', une seule table filtrable est écrite (XlsxStream.export_long)."""
         try:
-            start_time = time.time()
+            if BiblizouConfig.XLSX_LAYOUT == 'long':
+                rows = ((df.drop(columns=['NOM'], errors='ignore'), {'SITECODE': sitecode, 'SITE_NAME': site_name})
+                        for df, sitecode, site_name in sites)
+                with self.metrics.span('write'):
+                    return export_long(rows, excel_file, task, total, self.metrics)
+            titles = set()  # un onglet par fiche, sans écraser un site au nom tronqué identique
             with pd.ExcelWriter(excel_file, engine='openpyxl') as writer:
-                for xml_file in xml_files:
-                    full_path = os.path.join(folder_path, xml_file)
-                    df, sitecode, site_name = self.xml_to_dataframe(full_path, cache)
+                for idx, (df, sitecode, site_name) in enumerate(sites, start=1):
+                    if tache_annulee(task):
+                        break
+                    if task is not None and total:
+                        task.avancer("Fichiers analysés", idx, total)
 
                     if not df.empty:
-                        sheet_name = self.truncate_sheet_name(f"{sitecode}-{site_name}")
-                        df.drop(columns=['NOM'], inplace=True)
-                        df.to_excel(writer, sheet_name=sheet_name, index=False)
-                        QgsMessageLog.logMessage(f"Fichier traité: {xml_file} ajouté sous {sheet_name}.", "Biblizou",
-                                                 Qgis.Info)
-
-            processing_time = time.time() - start_time
-            self.iface.messageBar().pushMessage("Succès", f"Traitement terminé en {processing_time:.2f} secondes.",
-                                                level=Qgis.Success)
+                        sheet_name = unique_title(f"{sitecode}-{site_name}", titles)
+                        df = df.drop(columns=['NOM'])
+                        with self.metrics.span('write'):
+                            df.to_excel(writer, sheet_name=sheet_name, index=False)
+                        self.metrics.incr('rows.written', len(df))
+                        QgsMessageLog.logMessage(f"Site {sitecode} ajouté sous {sheet_name}.", "Biblizou", Qgis.Info)
+
+            if tache_annulee(task):
+                os.remove(excel_file)
+                return False
+            return True
         except Exception as e:
-            self.iface.messageBar().pushMessage("Erreur", f"Problème lors du traitement: {e}", level=Qgis.Critical)
+            self.push_message("Erreur", f"Problème lors du traitement: {e}", Qgis.Critical)
+            return False
 
     def xml_to_dataframe(self, xml_file, cache):
+        species, sitecode, site_name = self.extract_species(xml_file)
+        return self.species_to_dataframe(species, cache), sitecode, site_name
+
+    def extract_species(self, xml_file):
+        """Lecture de la fiche seule, sans appel TaxRef : ([(cd_nom, nom)], sitecode, site_name)."""
         try:
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-            regnes, groupes, cd_noms, noms, nom_complets, nom_vern, sitecode, site_name = [], [], [], [], [], [], "", ""
-
-            for biotop_elem in root.iter('BIOTOP'):
-                sitecode_elem = biotop_elem.find('SITECODE')
-                site_name_elem = biotop_elem.find('SITE_NAME')
-                sitecode = sitecode_elem.text.strip() if sitecode_elem is not None and sitecode_elem.text else ""
-                site_name = site_name_elem.text.strip() if site_name_elem is not None and site_name_elem.text else ""
-
-                for species_elem in biotop_elem.iter('SPECIES'):
-                    for species_row_elem in species_elem.iter('SPECIES_ROW'):
-                        nom_elem = species_row_elem.find('NOM')
-                        cd_nom_elem = species_row_elem.find('CD_NOM')
-                        if cd_nom_elem is not None:
-                            cd_nom = cd_nom_elem.text
-                            nom = nom_elem.text if nom_elem is not None else ""
-                            taxon_info = self.get_taxref_data(cd_nom, cache)
-                            regnes.append(taxon_info['REGNE'])
-                            groupes.append(taxon_info['GROUPE'])
-                            cd_noms.append(cd_nom)
-                            noms.append(nom)
-                            nom_complets.append(taxon_info['NOM_COMPLET'])
-                            nom_vern.append(taxon_info['NOM_VERN'])
-
-            data = {'REGNE': regnes, 'GROUPE': groupes, 'CD_NOM': cd_noms, 'NOM': noms, 'NOM_COMPLET': nom_complets,
-                    'NOM_VERN': nom_vern}
-            df = pd.DataFrame(data)
-            return df, sitecode, site_name
-        except ET.ParseError as e:
+            columns, site = N2000_ESPECES.compile().extract(parse_root(xml_file))
+            species = list(zip(columns['CD_NOM'], columns['NOM']))
+            return species, site['SITECODE'], site['SITE_NAME']
+        except PARSE_ERRORS as e:
+            self.metrics.incr('files.failed')
             QgsMessageLog.logMessage(f"Erreur parsing XML: {e}", "Biblizou", Qgis.Critical)
-            return pd.DataFrame(columns=['REGNE', 'GROUPE', 'CD_NOM', 'NOM', 'NOM_COMPLET', 'NOM_VERN']), "", ""
+            return [], "", ""
         except Exception as e:
+            self.metrics.incr('files.failed')
             QgsMessageLog.logMessage(f"Erreur inattendue: {e}", "Biblizou", Qgis.Critical)
-            return pd.DataFrame(columns=['REGNE', 'GROUPE', 'CD_NOM', 'NOM', 'NOM_COMPLET', 'NOM_VERN']), "", ""
+            return [], "", ""
+
+    def species_to_dataframe(self, species, cache):
+        """Complète les espèces extraites avec TaxRef (via le cache) et retourne le DataFrame du site."""
+        regnes, groupes, cd_noms, noms, nom_complets, nom_vern = [], [], [], [], [], []
+        for cd_nom, nom in species:
+            taxon_info = self.get_taxref_data(cd_nom, cache)
+            regnes.append(taxon_info['REGNE'])
+            groupes.append(taxon_info['GROUPE'])
+            cd_noms.append(cd_nom)
+            noms.append(nom)
+            nom_complets.append(taxon_info['NOM_COMPLET'])
+            nom_vern.append(taxon_info['NOM_VERN'])
+
+        data = {'REGNE': pd.Categorical(regnes), 'GROUPE': pd.Categorical(groupes), 'CD_NOM': cd_noms, 'NOM': noms,
+                'NOM_COMPLET': nom_complets, 'NOM_VERN': nom_vern}
+        return pd.DataFrame(data)
 
 # Pour exécuter le module dans QGIS
 def run_module(iface):
     module = NaturaXmlToXlsxEsp(iface)
     module.run()
 
-run_module(iface)
+if __name__ in ('__main__', '__console__'):
+    run_module(iface)
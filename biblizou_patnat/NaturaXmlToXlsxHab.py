@@ -9,16 +9,20 @@ Description : Module pour extraire des données d'habitats directive à partir d
 Dépendances :
     - Python 3.x
     - QGIS (QgsMessageLog, QgsMessageBar)
-    - xml.etree.ElementTree
+    - XmlBackend, XmlSchema (extraction déclarative : schéma N2000_HABITATS)
     - pandas
     - openpyxl
     - os, datetime
+    - BiblizouMetrics (rapport <fichier>.xlsx.run.json)
+    - XlsxStream (écriture en flux aux limites d'Excel ; présentation longue, BiblizouConfig.XLSX_LAYOUT = 'long')
+    - OutputBackends (CSV, Parquet, SQLite, GeoPackage, ODS selon BiblizouConfig.OUTPUT_FORMATS)
+    - RunMemo (réutilisation des livrables d'une exécution identique, BIBLIZOU_FORCE_REBUILD=1 pour tout refaire)
+    - XmlStore (fiches isolées ou archivées dans biblizou_xml.zip), XmlCatalog (type de fiche selon son contenu)
 
 Utilisation :
     Ce module doit être appelé depuis une extension QGIS.
 """
 
-import xml.etree.ElementTree as ET
 import pandas as pd
 import os
 from openpyxl.styles import Alignment, Border, Side, PatternFill, Font
@@ -27,19 +31,40 @@ from datetime import datetime
 from qgis.PyQt.QtWidgets import QFileDialog, QMessageBox
 from qgis.utils import iface
 from qgis.core import QgsMessageLog, Qgis
+from BiblizouMetrics import RunMetrics
+from XmlBackend import parse_root, PARSE_ERRORS
+from XmlSchema import N2000_HABITATS
+from XmlCatalog import catalog_files, N2000
+from XlsxStream import StreamingWorkbook, export_long, unique_title
+from OutputBackends import DataOutputs
+from RunMemo import fingerprint, reuse_outputs, deliverables
+import BiblizouConfig
+from BiblizouStaging import staged
+from BiblizouTask import lancer_tache, tache_annulee, pousser_message
 
 class NaturaXmlToXlsxHab:
-    def __init__(self):
+    def __init__(self, iface):
+        self.iface = iface
         self.folder_path = ""
+        self.task = None
+        self.metrics = RunMetrics('NaturaXmlToXlsxHab')
+
+    def push_message(self, title, text, level):
+        """ Affiche un message dans la barre QGIS (différé si le traitement tourne en tâche de fond). """
+        pousser_message(self.iface, self.task, title, text, level)
 
     def run(self):
         """ Exécute le module en demandant un dossier et en traitant les fichiers XML."""
         self.folder_path = QFileDialog.getExistingDirectory(None, "Sélectionner le dossier contenant les fichiers XML")
         if not self.folder_path:
-            iface.messageBar().pushMessage("Annulation", "Aucun dossier sélectionné.", level=Qgis.Warning, duration=5)
+            self.iface.messageBar().pushMessage("Annulation", "Aucun dossier sélectionné.", level=Qgis.Warning, duration=5)
             return
 
-        self.process_xml_files_in_folder()
+        lancer_tache("Biblizou : habitats Natura 2000 (XLSX)",
+                     lambda task: staged(self.folder_path, lambda work_folder:
+                                         self.process_xml_files_in_folder(task, work_folder),
+                                         reuse=self.reuse_previous),
+                     self.iface)
 
     def truncate_sheet_name(self, sheet_name):
         """ Tronque le nom de la feuille à 31 caractères, limite d'Excel. """
@@ -48,73 +73,128 @@ class NaturaXmlToXlsxHab:
     def xml_to_dataframe(self, xml_file):
         """ Analyse un fichier XML et retourne un DataFrame avec les données extraites."""
         try:
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-            cd_habs, lb_habdh_frs = [], []
-            site_name, sitecode = "", ""
-
-            for n2000_elem in root.iter('BIOTOP'):
-                sitecode_elem = n2000_elem.find('SITECODE')
-                site_name_elem = n2000_elem.find('SITE_NAME')
-                if sitecode_elem is not None:
-                    sitecode = sitecode_elem.text
-                if site_name_elem is not None:
-                    site_name = site_name_elem.text
-                for typo_info_row_elem in n2000_elem.iter('HABIT1_ROW'):
-                    cd_hab_elem = typo_info_row_elem.find('CD_UE')
-                    lb_habdh_fr_elem = typo_info_row_elem.find('LB_HABDH_FR')
-                    if cd_hab_elem is not None and lb_habdh_fr_elem is not None:
-                        cd_habs.append(cd_hab_elem.text)
-                        lb_habdh_frs.append(lb_habdh_fr_elem.text)
-
-            df = pd.DataFrame({'CD_UE': cd_habs, 'LB_HABDH_FR': lb_habdh_frs})
-            return df, site_name, sitecode
-        except ET.ParseError as e:
+            df, site = N2000_HABITATS.compile().frame(parse_root(xml_file))
+            return df, site['SITE_NAME'], site['SITECODE']
+        except PARSE_ERRORS as e:
+            self.metrics.incr('files.failed')
             QgsMessageLog.logMessage(f"Erreur d'analyse XML : {e}", "Biblizou_PatNat", Qgis.Warning)
-            return pd.DataFrame(columns=['CD_UE', 'LB_HABDH_FR']), "", ""
+            return N2000_HABITATS.empty(), "", ""
         except Exception as e:
+            self.metrics.incr('files.failed')
             QgsMessageLog.logMessage(f"Erreur inattendue : {e}", "Biblizou_PatNat", Qgis.Critical)
-            return pd.DataFrame(columns=['CD_UE', 'LB_HABDH_FR']), "", ""
+            return N2000_HABITATS.empty(), "", ""
+
+    def parsed_sites(self, folder_path, xml_files):
+        """ (df, {'SITECODE', 'SITE_NAME'}) de chaque fiche, pour la présentation longue."""
+        for xml_file in xml_files:
+            with self.metrics.span('parse'):
+                df, site_name, sitecode = self.xml_to_dataframe(os.path.join(folder_path, xml_file))
+            self.metrics.incr('files.parsed')
+            yield df, {'SITECODE': sitecode, 'SITE_NAME': site_name}
+
+    def output_file(self, folder_path):
+        current_time = datetime.now().strftime("%Y%m%d%H%M%S")
+        return os.path.join(folder_path, f'N2000_Synthèse_habitats_{current_time}.xlsx')
+
+    def reuse_previous(self, folder_path):
+        """Réutilisation vérifiée dans le dossier d'origine, avant sa copie en local (staged) : fichiers
+        recopiés, liste vide s'il faut lancer le traitement."""
+        self.metrics = RunMetrics('NaturaXmlToXlsxHab')
+        key = fingerprint('NaturaXmlToXlsxHab', folder_path, catalog_files(folder_path, N2000))
+        reused = reuse_outputs(folder_path, key, self.output_file(folder_path), self.metrics)
+        if reused:
+            self.push_message("Succès", f"Données inchangées, fichier(s) réutilisé(s) : {', '.join(reused)}",
+                              Qgis.Success)
+        return reused
 
-    def process_xml_files_in_folder(self):
-        """ Traite tous les fichiers XML du dossier et génère un fichier Excel."""
-        if not os.path.isdir(self.folder_path):
-            iface.messageBar().pushMessage("Erreur", "Chemin de dossier invalide.", level=Qgis.Critical, duration=5)
+    def process_xml_files_in_folder(self, task=None, folder_path=None):
+        """ Traite tous les fichiers XML du dossier (self.folder_path par défaut) et génère un fichier Excel."""
+        folder_path = folder_path or self.folder_path
+        self.task = task
+        self.metrics = RunMetrics('NaturaXmlToXlsxHab')
+        if not os.path.isdir(folder_path):
+            self.push_message("Erreur", "Chemin de dossier invalide.", Qgis.Critical)
             return
 
-        xml_files = [f for f in os.listdir(self.folder_path) if f.endswith('.xml') and f.startswith('FR') and len(f) == 13]
+        xml_files = catalog_files(folder_path, N2000)
         if not xml_files:
-            iface.messageBar().pushMessage("Information", "Aucun fichier XML trouvé.", level=Qgis.Info, duration=5)
+            self.push_message("Information", "Aucun fichier XML trouvé.", Qgis.Info)
             return
 
-        unique_cd_ues, unique_lb_habdh_frs = set(), set()
-        hab_presence = {}
-        current_time = datetime.now().strftime("%Y%m%d%H%M%S")
-        excel_file = os.path.join(self.folder_path, f'N2000_Synthèse_habitats_{current_time}.xlsx')
+        excel_file = self.output_file(folder_path)
 
         try:
-            with pd.ExcelWriter(excel_file, engine='openpyxl') as writer:
-                for xml_file in xml_files:
-                    full_path = os.path.join(self.folder_path, xml_file)
-                    df, site_name, sitecode = self.xml_to_dataframe(full_path)
-                    if not df.empty:
-                        unique_cd_ues.update(df['CD_UE'].unique())
-                        unique_lb_habdh_frs.update(df['LB_HABDH_FR'].unique())
-                        sheet_name = self.truncate_sheet_name(f"{sitecode} - {site_name}")
-                        hab_presence[sheet_name] = set(df['LB_HABDH_FR'])
-                        df.to_excel(writer, sheet_name=sheet_name, index=False)
-                summary_data = {'CD_UE': list(unique_cd_ues), 'LB_HABDH_FR': list(unique_lb_habdh_frs)}
-                for sheet_name in hab_presence:
-                    summary_data[sheet_name] = ['X' if hab in hab_presence[sheet_name] else '' for hab in unique_lb_habdh_frs]
-                summary_df = pd.DataFrame(summary_data)
-                summary_df.to_excel(writer, sheet_name='Synthèse', index=False)
-            iface.messageBar().pushMessage("Succès", f"Fichier Excel généré : {excel_file}", level=Qgis.Success, duration=10)
+            # Exécution identique déjà faite (mêmes fiches, mêmes options) : livrables recopiés
+            key = fingerprint('NaturaXmlToXlsxHab', folder_path, xml_files)
+            reused = reuse_outputs(folder_path, key, excel_file, self.metrics)
+            if reused:
+                self.push_message("Succès", f"Données inchangées, fichier(s) réutilisé(s) : {', '.join(reused)}",
+                                  Qgis.Success)
+                return
+            # Formats demandés (BiblizouConfig.OUTPUT_FORMATS) : tables de données écrites pendant la lecture
+            if not self.export_sites(self.parsed_sites(folder_path, xml_files), excel_file, task, len(xml_files)):
+                return
+            self.metrics.write_report(excel_file, folder=folder_path, fingerprint=key)
+            self.push_message("Succès", f"Fichier(s) généré(s) : {', '.join(deliverables(excel_file))}",
+                              Qgis.Success)
         except Exception as e:
-            iface.messageBar().pushMessage("Erreur", f"Impossible d'écrire le fichier Excel : {e}", level=Qgis.Critical, duration=10)
+            self.push_message("Erreur", f"Impossible d'écrire les fichiers : {e}", Qgis.Critical)
+
+    def export_sites(self, sites, excel_file, task=None, total=None):
+        """Exporte un itérable de (df, {colonne du site: valeur}), consommé au fil de l'eau, dans les formats
+        demandés (BiblizouConfig.OUTPUT_FORMATS) : classeur XLSX (export_xlsx) et/ou tables de données
+        (OutputBackends). Utilisé par process_xml_files_in_folder et par XmlToDeliverables."""
+        with DataOutputs(excel_file, 'habitats_directive', self.metrics) as outputs:
+            sites = outputs.mirror(sites)
+            if outputs.xlsx:
+                done = self.export_xlsx(sites, excel_file, task, total)
+            else:
+                done = outputs.drain(sites, task, total)
+            if not done:
+                outputs.discard()
+            return done
+
+    def export_xlsx(self, sites, excel_file, task=None, total=None):
+        """ Classeur (un onglet par site et synthèse, ou table longue) à partir d'un itérable de
+        (df, {'SITECODE', 'SITE_NAME'}) ; False si la tâche a été annulée."""
+        if BiblizouConfig.XLSX_LAYOUT == 'long':
+            return export_long(sites, excel_file, task, total, self.metrics)
+        habitats = set()     # couples (CD_UE, LB_HABDH_FR) rencontrés
+        hab_presence = {}    # onglet : couples présents sur le site
+        titles = {'synthèse'}  # un onglet par fiche, sans fusionner deux sites au nom tronqué identique
+        with StreamingWorkbook(excel_file) as workbook:
+            for idx, (df, site) in enumerate(sites, start=1):
+                if tache_annulee(task):
+                    break
+                if task is not None:
+                    task.avancer("Fichiers analysés", idx, total)
+                if not df.empty:
+                    pairs = set(df[['CD_UE', 'LB_HABDH_FR']].drop_duplicates().itertuples(index=False, name=None))
+                    habitats.update(pairs)
+                    sheet_name = unique_title(f"{site['SITECODE']} - {site['SITE_NAME']}", titles)
+                    hab_presence[sheet_name] = pairs
+                    with self.metrics.span('write'):
+                        workbook.append_frame(sheet_name, df)
+                    self.metrics.incr('rows.written', len(df))
+            # Code et libellé restent appariés : une ligne par couple, présence lue sur le couple
+            habitats = sorted(habitats)
+            summary_data = {'CD_UE': [code for code, _ in habitats], 'LB_HABDH_FR': [hab for _, hab in habitats]}
+            for sheet_name, present in hab_presence.items():
+                summary_data[sheet_name] = ['X' if pair in present else '' for pair in habitats]
+            with self.metrics.span('synthese'):
+                summary_df = pd.DataFrame(summary_data)
+                # Une colonne par site : transposée ou répartie au-delà de 16 384 colonnes (XlsxStream)
+                workbook.append_wide('Synthèse', summary_df, key_columns=2)
+            self.metrics.incr('rows.written', len(summary_df))
+        if tache_annulee(task):
+            os.remove(excel_file)
+            return False
+        return True
 
 # Pour exécuter le module dans QGIS
 def run_module(iface):
     module = NaturaXmlToXlsxHab(iface)
     module.run()
 
-run_module(iface)
+if __name__ in ('__main__', '__console__'):
+    run_module(iface)
@@ -0,0 +1,255 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : OutputBackends.py
+Groupe : Biblizou_PatNat
+Description : Formats de sortie des exports de données, choisis pour chaque traitement : CSV, Parquet, SQLite,
+    GeoPackage (table attributaire) et ODS, en plus du classeur XLSX mis en forme qui n'est produit que s'il est
+    demandé. Chaque format reçoit la table au format long (colonnes du site puis colonnes extraites), site par
+    site, pendant la lecture des fiches : une seule analyse XML quel que soit le nombre de formats.
+Dépendances :
+    - Python 3.x
+    - pandas, sqlite3
+    - pyarrow (Parquet, facultatif), odfpy (ODS, facultatif ; table écrite en une fois à la fermeture)
+    - BiblizouConfig (OUTPUT_FORMATS), BiblizouTask
+
+Utilisation :
+    with DataOutputs(excel_file, 'habitats_determinants', self.metrics) as outputs:
+        sites = outputs.mirror(self.parsed_sites(folder_path, xml_files))   # (df, {colonne du site: valeur})
+        if not outputs.xlsx:
+            return outputs.drain(sites, task, total)
+        ...  # export XLSX habituel, qui consomme `sites`
+
+    BiblizouConfig.OUTPUT_FORMATS (variable BIBLIZOU_OUTPUT_FORMATS) : liste séparée par des virgules parmi
+    xlsx, csv, parquet, sqlite, gpkg, ods (par défaut 'xlsx'). Les fichiers prennent le nom du classeur avec
+    l'extension du format (<nom>.csv, <nom>.parquet, <nom>.sqlite, <nom>.gpkg, <nom>.ods). Un format dont la
+    bibliothèque manque est ignoré avec un avertissement dans le journal.
+"""
+
+import os
+import sqlite3
+import pandas as pd
+from qgis.core import QgsMessageLog, Qgis
+import BiblizouConfig
+from BiblizouTask import tache_annulee
+
+
+def plain(df):
+    """Copie de df sans colonnes catégorielles (texte), pour les formats qui ne les connaissent pas."""
+    categorical = [column for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)]
+    return df.astype({column: object for column in categorical}) if categorical else df
+
+
+class CsvOutput:
+    extension = '.csv'
+
+    def __init__(self, path, table):
+        self.path = path
+        self.header = True
+
+    def write(self, df):
+        # Séparateur ';' et BOM UTF-8 (en tête de fichier seulement) : ouverture directe dans Excel/LibreOffice
+        df.to_csv(self.path, mode='w' if self.header else 'a', header=self.header, index=False, sep=';',
+                  encoding='utf-8-sig' if self.header else 'utf-8')
+        self.header = False
+
+    def close(self):
+        pass
+
+
+class ParquetOutput:
+    extension = '.parquet'
+
+    def __init__(self, path, table):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.path = path
+        self.writer = None
+
+    def write(self, df):
+        table = self.pa.Table.from_pandas(plain(df), preserve_index=False)
+        if self.writer is None:
+            # Colonnes texte vides au premier site : typées en chaîne pour accepter les sites suivants
+            schema = self.pa.schema([self.pa.field(f.name, self.pa.string()) if self.pa.types.is_null(f.type) else f
+                                     for f in table.schema])
+            self.writer = self.pq.ParquetWriter(self.path, schema.remove_metadata())
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class SqliteOutput:
+    extension = '.sqlite'
+    SQL_TYPES = {'i': 'INTEGER', 'u': 'INTEGER', 'b': 'INTEGER', 'f': 'REAL'}
+
+    def __init__(self, path, table):
+        self.path = path
+        self.table = table
+        self.connection = sqlite3.connect(path)
+        self.insert = None
+
+    def create(self, df):
+        quoted = f'"{self.table}"'
+        names = [f'"{column}"' for column in df.columns]
+        types = [self.SQL_TYPES.get(df[column].dtype.kind, 'TEXT') for column in df.columns]
+        self.connection.execute(f'DROP TABLE IF EXISTS {quoted}')
+        # Clé entière explicite : exigée pour les tables attributaires GeoPackage, utile à QGIS dans tous les cas
+        self.connection.execute(f'CREATE TABLE {quoted} (fid INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                f'{", ".join(f"{name} {type_}" for name, type_ in zip(names, types))})')
+        self.insert = f'INSERT INTO {quoted} ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})'
+
+    def write(self, df):
+        df = plain(df)
+        if self.insert is None:
+            self.create(df)
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        self.connection.executemany(self.insert, rows)
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+class GpkgOutput(SqliteOutput):
+    extension = '.gpkg'
+
+    def create(self, df):
+        """Table attributaire GeoPackage (sans géométrie) : en-tête du fichier et métadonnées minimales."""
+        self.connection.executescript("""
+            PRAGMA application_id = 1196444487;
+            PRAGMA user_version = 10200;
+            CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+                srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+                organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+            INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES
+                ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', NULL),
+                ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', NULL),
+                ('WGS 84 geodetic', 4326, 'EPSG', 4326, 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",'
+                 || '6378137,298.257223563]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]', NULL);
+            CREATE TABLE IF NOT EXISTS gpkg_contents (
+                table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+                description TEXT DEFAULT '',
+                last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+                min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+                CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id));
+        """)
+        super().create(df)
+        self.connection.execute("INSERT OR REPLACE INTO gpkg_contents (table_name, data_type, identifier) "
+                                "VALUES (?, 'attributes', ?)", (self.table, self.table))
+
+
+class OdsOutput:
+    extension = '.ods'
+
+    def __init__(self, path, table):
+        import odf  # ImportError si odfpy n'est pas installé
+        self.path = path
+        self.sheet_name = table[:31]
+        self.frames = []
+
+    def write(self, df):
+        # Le moteur odf ne sait pas compléter un onglet (startrow laisse des lignes vides) : écriture unique
+        self.frames.append(plain(df))
+
+    def close(self):
+        table = pd.concat(self.frames, ignore_index=True) if self.frames else pd.DataFrame()
+        self.frames = []
+        with pd.ExcelWriter(self.path, engine='odf') as writer:
+            table.to_excel(writer, sheet_name=self.sheet_name, index=False)
+
+    def discard(self):
+        # Traitement abandonné : le fichier n'est pas encore écrit, rien à produire
+        self.frames = []
+
+
+FORMATS = {'csv': CsvOutput, 'parquet': ParquetOutput, 'sqlite': SqliteOutput, 'gpkg': GpkgOutput,
+           'ods': OdsOutput}
+
+
+def output_formats():
+    """Formats demandés pour ce traitement (BiblizouConfig.OUTPUT_FORMATS), dans l'ordre, sans doublon."""
+    formats = [name.strip().lower() for name in BiblizouConfig.OUTPUT_FORMATS.split(',') if name.strip()]
+    return list(dict.fromkeys(formats)) or ['xlsx']
+
+
+class DataOutputs:
+    def __init__(self, excel_file, table, metrics=None, formats=None):
+        """Sorties de données d'un traitement dont le classeur XLSX serait excel_file ; `table` nomme la table
+        dans les formats qui en ont (SQLite, GeoPackage, onglet ODS)."""
+        formats = formats or output_formats()
+        self.xlsx = 'xlsx' in formats
+        self.metrics = metrics
+        self.outputs = {}
+        stem = os.path.splitext(excel_file)[0]
+        for name in formats:
+            if name == 'xlsx':
+                continue
+            if name not in FORMATS:
+                QgsMessageLog.logMessage(f"Format de sortie inconnu ignoré : {name}", "Biblizou", Qgis.Warning)
+                continue
+            path = stem + FORMATS[name].extension
+            try:
+                self.outputs[name] = (FORMATS[name](path, table), path)
+            except ImportError as e:
+                QgsMessageLog.logMessage(f"Format {name} indisponible ({e}) : ignoré.", "Biblizou", Qgis.Warning)
+
+    @property
+    def paths(self):
+        return [path for _, path in self.outputs.values()]
+
+    def write(self, df, site):
+        if df.empty:
+            return
+        df = df.assign(**site)[list(site) + list(df.columns)]
+        for name, (output, _) in self.outputs.items():
+            if self.metrics is not None:
+                with self.metrics.span(f'write.{name}'):
+                    output.write(df)
+            else:
+                output.write(df)
+
+    def mirror(self, sites, split=None):
+        """Renvoie les éléments de `sites` inchangés après avoir écrit leur table dans chaque format.
+        split(élément) -> (df, {colonne du site: valeur}) ; par défaut l'élément est déjà ce couple."""
+        for item in sites:
+            df, site = split(*item) if split else item
+            self.write(df, site)
+            yield item
+
+    def drain(self, sites, task=None, total=None):
+        """Consomme `sites` (déjà passé par mirror) sans classeur XLSX ; False si la tâche a été annulée."""
+        for idx, _ in enumerate(sites, start=1):
+            if tache_annulee(task):
+                return False
+            if task is not None and total:
+                task.avancer("Fichiers analysés", idx, total)
+        return not tache_annulee(task)
+
+    def discard(self):
+        """Ferme et supprime les fichiers produits (traitement annulé ou en échec) ; les formats écrits en une
+        fois à la fermeture (ODS) abandonnent leur table sans l'écrire."""
+        for output, _ in self.outputs.values():
+            getattr(output, 'discard', output.close)()
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self.outputs = {}
+
+    def close(self):
+        for output, _ in self.outputs.values():
+            output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.discard()
+        else:
+            self.close()
+        return False
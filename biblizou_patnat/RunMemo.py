@@ -0,0 +1,115 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : RunMemo.py
+Groupe : Biblizou_PatNat
+Description : Réutilisation des livrables d'une exécution précédente identique. L'empreinte d'une exécution
+    combine le module, le contenu des fiches XML (SHA-256, conservé dans le manifeste XmlCatalog), les options
+    d'export (présentation XLSX, formats de sortie) et, pour les modules complétés par TaxRef, l'adresse et la
+    version du référentiel. Elle est inscrite dans le rapport <livrable>.run.json : si un rapport du dossier
+    porte la même empreinte et que ses livrables existent encore, ils sont recopiés sous le nouveau nom
+    horodaté au lieu d'être recalculés. Les livrables complétés par TaxRef ne sont réutilisés que si la version
+    du référentiel est déclarée (BiblizouConfig.TAXREF_VERSION) : sans elle, rien ne dit que l'API n'a pas
+    changé depuis.
+Dépendances :
+    - Python 3.x
+    - QGIS (QgsMessageLog)
+    - os, json, hashlib
+    - BiblizouConfig (FORCE_REBUILD, XLSX_LAYOUT, OUTPUT_FORMATS), XmlCatalog, BiblizouStaging, OutputBackends
+
+Utilisation :
+    key = fingerprint('ZnieffXmlToXlsxEsp', folder_path, xml_files)
+    if reuse_outputs(folder_path, key, excel_file, self.metrics):
+        return  # livrables copiés, rapport écrit
+    ...  # traitement habituel
+    self.metrics.write_report(excel_file, folder=folder_path, fingerprint=key)
+
+    BiblizouConfig.FORCE_REBUILD (variable BIBLIZOU_FORCE_REBUILD=1) désactive la réutilisation. Les
+    livrables sont copiés et non liés : un classeur modifié à la main ne modifie pas l'autre.
+    Dossier réseau : staged(dossier, traitement, reuse=...) cherche l'exécution identique dans le dossier
+    d'origine avant de le copier en local (BiblizouStaging).
+"""
+
+import os
+import json
+import hashlib
+from qgis.core import QgsMessageLog, Qgis
+import BiblizouConfig
+from XmlCatalog import content_hashes
+from BiblizouStaging import source_folder, copy_with_retries
+from OutputBackends import FORMATS
+
+MEMO_VERSION = 1  # à incrémenter quand le contenu des livrables change à entrées identiques
+EXTENSIONS = ['.xlsx', '.docx'] + [output.extension for output in FORMATS.values()]
+
+
+def fingerprint(tool, folder_path, xml_files, taxref=False, **options):
+    """Empreinte (SHA-256 hexadécimal) d'une exécution de `tool` sur les fiches `xml_files` du dossier ;
+    `options` complète les options communes. taxref=True pour les livrables complétés par l'API TaxRef :
+    sans BiblizouConfig.TAXREF_VERSION, l'exécution n'a pas d'empreinte (None) et n'est jamais réutilisée."""
+    if taxref:
+        if not BiblizouConfig.TAXREF_VERSION:
+            return None
+        options['taxref'] = (BiblizouConfig.TAXREF_API_URL, BiblizouConfig.TAXREF_VERSION)
+    options.update(layout=BiblizouConfig.XLSX_LAYOUT, formats=BiblizouConfig.OUTPUT_FORMATS)
+    payload = {'memo': MEMO_VERSION, 'tool': tool, 'options': options,
+               'files': content_hashes(folder_path, xml_files)}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def deliverables(output_path):
+    """Fichiers existants d'une exécution : le classeur et les tables de même nom (OutputBackends)."""
+    stem = os.path.splitext(output_path)[0]
+    return [stem + extension for extension in EXTENSIONS if os.path.isfile(stem + extension)]
+
+
+def find_previous(folder_path, key):
+    """Chemin du livrable (classeur) de l'exécution la plus récente d'empreinte `key`, ou None."""
+    reports = []
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith('.run.json'):
+                reports.append((entry.stat().st_mtime_ns, entry.path))
+    for _, report_path in sorted(reports, reverse=True):
+        try:
+            with open(report_path, encoding='utf-8') as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        output_path = report_path[:-len('.run.json')]
+        if report.get('fingerprint') == key and deliverables(output_path):
+            return output_path
+    return None
+
+
+def reuse_outputs(folder_path, key, output_path, metrics=None, force=None):
+    """Recopie sous le nom de output_path les livrables d'une exécution précédente identique (dossier de
+    travail, puis dossier d'origine s'il est différent) et écrit le rapport de la nouvelle exécution.
+
+    Retourne la liste des fichiers produits, vide si rien n'a été réutilisé (à recalculer)."""
+    if key is None or (BiblizouConfig.FORCE_REBUILD if force is None else force):
+        return []
+    for folder in dict.fromkeys([folder_path, source_folder(folder_path)]):
+        previous = find_previous(folder, key)
+        if previous is None:
+            continue
+        old_stem, new_stem = os.path.splitext(previous)[0], os.path.splitext(output_path)[0]
+        produced = []
+        for path in deliverables(previous):
+            target = new_stem + path[len(old_stem):]
+            if os.path.abspath(path) != os.path.abspath(target) and not copy_with_retries(path, target):
+                break
+            produced.append(target)
+        else:
+            QgsMessageLog.logMessage(f"Entrées identiques à {previous} : livrables réutilisés sans recalcul.",
+                                     "Biblizou", Qgis.Info)
+            if metrics is not None:
+                metrics.incr('memo.reused', len(produced))
+                metrics.write_report(output_path, folder=folder_path, fingerprint=key, reused_from=previous)
+            return produced
+        for target in produced:  # copie incomplète : recalcul complet
+            if os.path.abspath(target) != os.path.abspath(old_stem + target[len(new_stem):]):
+                os.remove(target)
+    return []
@@ -0,0 +1,198 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : XlsxStream.py
+Groupe : Biblizou_PatNat
+Description : Écriture d'un classeur XLSX en flux (openpyxl en mode write_only) : chaque ligne ajoutée part
+    aussitôt dans un fichier temporaire par onglet au lieu de rester en mémoire jusqu'à l'enregistrement,
+    comme avec pd.ExcelWriter. Utilisé par le mode flux des exports régionaux (plusieurs milliers de fiches)
+    et par la présentation « longue » des exports (une seule table filtrable au lieu d'un onglet par site).
+Dépendances :
+    - Python 3.x
+    - openpyxl
+    - os, BiblizouTask
+
+Utilisation :
+    with StreamingWorkbook(excel_file) as workbook:
+        workbook.append_frame("Site 1", df)       # onglet créé avec l'en-tête au premier ajout
+        workbook.append_frame("Site 1", df_suite)  # lignes ajoutées à la suite
+    # enregistré à la sortie sans erreur ; abandonné (fichier non créé) sinon
+
+    Les onglets apparaissent dans l'ordre de création et ne peuvent plus être relus : la mise en forme se fait
+    pendant l'écriture, cellule par cellule (style) et onglet par onglet (hide), sans recharger le classeur :
+        StreamingWorkbook(excel_file, style=lambda cell, header: ..., hide=lambda nom: ...)
+
+    Présentation longue (BiblizouConfig.XLSX_LAYOUT = 'long', variable BIBLIZOU_XLSX_LAYOUT) :
+        export_long(((df, {'ID_MNHN': id, 'NOM_SITE': nom}) for ...), excel_file, task, total, metrics)
+    écrit en une passe un onglet « Données » (colonnes du site puis colonnes de df), en-tête figé et filtre
+    automatique, au lieu d'un onglet par site (noms tronqués à 31 caractères, classeurs lents à ouvrir).
+
+    Limites d'Excel (1 048 576 lignes, 16 384 colonnes par onglet) : suivies pendant l'écriture, sans
+    matérialiser la table entière. Un onglet plein continue dans « <nom> (2) », « <nom> (3) »... avec le même
+    en-tête ; une matrice trop large (une colonne par site) passe par append_wide, qui la transpose si elle
+    tient ainsi, et sinon la répartit en onglets de continuation répétant les colonnes clés. Avec
+    pd.ExcelWriter, to_excel_rows applique le même découpage en lignes.
+"""
+
+import os
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+from BiblizouTask import tache_annulee
+
+LONG_SHEET = 'Données'
+MAX_ROWS = 1048576      # lignes par onglet, en-tête compris
+MAX_COLUMNS = 16384     # colonnes par onglet
+MAX_TITLE = 31          # caractères d'un nom d'onglet
+
+
+def continuation_title(sheet_name, part):
+    """Nom du part-ième onglet d'une table répartie (« Synthèse Plantae (2) »), tronqué à MAX_TITLE."""
+    if part == 1:
+        return sheet_name[:MAX_TITLE]
+    suffix = f" ({part})"
+    return sheet_name[:MAX_TITLE - len(suffix)].rstrip() + suffix
+
+
+def unique_title(sheet_name, used):
+    """Nom d'onglet d'au plus MAX_TITLE caractères absent de `used` (« Site (2) » si « Site » est pris) ; le
+    nom retenu est ajouté à `used`, comparé sans la casse comme dans Excel."""
+    part = 1
+    while continuation_title(sheet_name, part).casefold() in used:
+        part += 1
+    title = continuation_title(sheet_name, part)
+    used.add(title.casefold())
+    return title
+
+
+def to_excel_rows(df, writer, sheet_name, **kwargs):
+    """df.to_excel réparti sur des onglets de continuation au-delà de MAX_ROWS lignes (pd.ExcelWriter)."""
+    step = MAX_ROWS - 1
+    for part, start in enumerate(range(0, max(len(df), 1), step), start=1):
+        df.iloc[start:start + step].to_excel(writer, sheet_name=continuation_title(sheet_name, part), **kwargs)
+
+
+class StreamingWorkbook:
+    def __init__(self, path, freeze_header=False, autofilter=False, style=None, hide=None):
+        """Classeur en flux ; freeze_header fige la ligne d'en-tête et autofilter pose un filtre automatique
+        sur chaque onglet. style(cellule, en_tête) met en forme chaque cellule avant son écriture et
+        hide(onglet logique) indique les onglets à masquer."""
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.freeze_header = freeze_header
+        self.autofilter = autofilter
+        self.style = style
+        self.hide = hide
+        self.sheets = {}   # onglet logique : [onglets physiques] (continuations au-delà de MAX_ROWS)
+        self.headers = {}  # onglet logique : en-tête, répété sur chaque continuation
+        self.shapes = {}   # onglet physique : [lignes écrites, colonnes]
+        self.titles = set()  # noms des onglets physiques, sans la casse
+        self.rows = 0
+
+    def new_sheet(self, sheet_name):
+        """Onglet physique suivant de sheet_name, en-tête écrit."""
+        parts = self.sheets.setdefault(sheet_name, [])
+        sheet = self.workbook.create_sheet(title=unique_title(sheet_name, self.titles))
+        if self.freeze_header:
+            sheet.freeze_panes = 'A2'  # à poser avant la première ligne en mode write_only
+        if self.hide is not None and self.hide(sheet_name):
+            sheet.sheet_state = 'hidden'
+        sheet.append(self.styled(sheet, self.headers[sheet_name], True))
+        parts.append(sheet)
+        self.shapes[sheet] = [1, len(self.headers[sheet_name])]
+        return sheet
+
+    def append_rows(self, sheet_name, header, rows):
+        """Ajoute des lignes (tuples) à l'onglet sheet_name, créé avec `header` s'il n'existe pas ; un onglet
+        plein continue dans un onglet suivant. Lève ValueError au-delà de MAX_COLUMNS (voir append_wide)."""
+        if len(header) > MAX_COLUMNS:
+            raise ValueError(f"{sheet_name} : {len(header)} colonnes, au-delà de la limite d'Excel ({MAX_COLUMNS})")
+        if sheet_name not in self.sheets:
+            self.headers[sheet_name] = [str(column) for column in header]
+            self.new_sheet(sheet_name)
+        sheet = self.sheets[sheet_name][-1]
+        shape = self.shapes[sheet]
+        count = 0
+        for row in rows:
+            if shape[0] >= MAX_ROWS:
+                sheet = self.new_sheet(sheet_name)
+                shape = self.shapes[sheet]
+            sheet.append(self.styled(sheet, row, False))
+            shape[0] += 1
+            count += 1
+        self.rows += count
+        return count
+
+    def styled(self, sheet, row, header):
+        """Ligne telle qu'écrite : valeurs brutes, ou cellules mises en forme par self.style."""
+        if self.style is None:
+            return row
+        cells = []
+        for value in row:
+            cell = WriteOnlyCell(sheet, value=value)
+            self.style(cell, header)
+            cells.append(cell)
+        return cells
+
+    def append_frame(self, sheet_name, df):
+        """Ajoute les lignes de df à l'onglet sheet_name (créé avec l'en-tête de df s'il n'existe pas)."""
+        values = df.astype(object).where(df.notna(), None)
+        self.append_rows(sheet_name, list(df.columns), values.itertuples(index=False, name=None))
+
+    def append_wide(self, sheet_name, df, key_columns=1):
+        """Écrit une matrice dont les `key_columns` premières colonnes identifient la ligne (ex. LB_CODE,
+        LB_HAB) et les suivantes sont des valeurs (ex. une colonne par site). Au-delà de MAX_COLUMNS, la
+        matrice est transposée (une ligne par colonne de valeurs) si elle tient ainsi, sinon répartie en
+        onglets de continuation de MAX_COLUMNS colonnes répétant les colonnes clés."""
+        keys, values = list(df.columns[:key_columns]), list(df.columns[key_columns:])
+        if len(df.columns) <= MAX_COLUMNS:
+            self.append_frame(sheet_name, df)
+        elif len(df) + 1 <= MAX_COLUMNS:
+            # Transposée : les colonnes clés deviennent les lignes d'en-tête, chaque colonne de valeurs une ligne
+            table = df.astype(object).where(df.notna(), None)
+            rows = [[key] + table[key].tolist() for key in keys[1:]]
+            rows += ([column] + table[column].tolist() for column in values)
+            self.append_rows(sheet_name, [keys[0]] + table[keys[0]].tolist(), rows)
+        else:
+            step = MAX_COLUMNS - len(keys)
+            for part, start in enumerate(range(0, len(values), step), start=1):
+                self.append_frame(continuation_title(sheet_name, part), df[keys + values[start:start + step]])
+
+    def save(self):
+        if self.autofilter:
+            for sheet, (rows, columns) in self.shapes.items():
+                sheet.auto_filter.ref = f"A1:{get_column_letter(columns)}{rows}"
+        if not self.sheets:
+            self.workbook.create_sheet(title="Vide")  # un classeur XLSX doit contenir au moins un onglet
+        self.workbook.save(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.save()
+        return False
+
+
+def export_long(sites, excel_file, task=None, total=None, metrics=None, sheet_name=LONG_SHEET):
+    """Table unique au format long à partir d'un itérable de (df, {colonne: valeur propre au site}).
+
+    Retourne False (et supprime le fichier) si la tâche a été annulée."""
+    with StreamingWorkbook(excel_file, freeze_header=True, autofilter=True) as workbook:
+        for idx, (df, site) in enumerate(sites, start=1):
+            if tache_annulee(task):
+                break
+            if task is not None and total:
+                task.avancer("Fichiers analysés", idx, total)
+            if df.empty:
+                continue
+            workbook.append_frame(sheet_name, df.assign(**site)[list(site) + list(df.columns)])
+            if metrics is not None:
+                metrics.incr('rows.written', len(df))
+    if tache_annulee(task):
+        os.remove(excel_file)
+        return False
+    return True
@@ -0,0 +1,126 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : XmlBackend.py
+Groupe : Biblizou_PatNat
+Description : Moteur de lecture des fiches XML. Avec lxml, les requêtes sont des expressions XPath compilées une
+    seule fois qui extraient une colonne entière (toutes les valeurs d'un champ) en un appel, au lieu de
+    plusieurs find/findtext par ligne. Sans lxml, repli automatique sur xml.etree.ElementTree.
+Dépendances :
+    - Python 3.x
+    - lxml (facultatif)
+    - xml.etree.ElementTree, threading
+    - BiblizouConfig (XML_BACKEND), XmlStore (read_xml)
+
+Utilisation :
+    ESPECES = RowQuery('ESPECE_ROW', ['REGNE', 'GROUPE', 'CD_NOM'], where={'FG_ESP': 'D'})  # au chargement
+    root = parse_root(xml_file)
+    columns = ESPECES.columns(root)        # {'REGNE': [...], 'GROUPE': [...], 'CD_NOM': [...]}, alignées
+    nm_sffzn = site_text(root, 'ZNIEFF', 'NM_SFFZN')
+
+    BiblizouConfig.XML_BACKEND (variable BIBLIZOU_XML_BACKEND) : 'auto' (lxml s'il est installé, par défaut),
+    'lxml' ou 'etree'. Les erreurs de lecture des deux moteurs sont regroupées dans PARSE_ERRORS.
+"""
+
+import threading
+import xml.etree.ElementTree as ET
+import BiblizouConfig
+from XmlStore import read_xml
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+PARSE_ERRORS = (ET.ParseError,) if etree is None else (ET.ParseError, etree.XMLSyntaxError)
+
+
+def backend():
+    """Moteur utilisé : 'lxml' ou 'etree' (repli si lxml n'est pas installé)."""
+    if etree is None or BiblizouConfig.XML_BACKEND == 'etree':
+        return 'etree'
+    return 'lxml'
+
+
+_local = threading.local()  # un analyseur lxml par fil : ils ne se partagent pas entre fils
+
+
+def parse_root(xml_file):
+    """Élément racine d'une fiche (fichier isolé ou archivé), lu avec le moteur courant."""
+    data = read_xml(xml_file)
+    if backend() == 'etree':
+        return ET.fromstring(data)
+    parser = getattr(_local, 'parser', None)
+    if parser is None:
+        # Fiches INPN : pas d'entités externes ni d'accès réseau pendant la lecture
+        parser = _local.parser = etree.XMLParser(resolve_entities=False, no_network=True, remove_comments=True)
+    return etree.fromstring(data, parser)
+
+
+def site_text(root, parent_tag, tag):
+    """Texte du champ `tag` du dernier élément `parent_tag` de la fiche ('' s'il manque), comme les boucles
+    d'origine qui conservaient la valeur du dernier site lu."""
+    value = ""
+    for parent in root.iter(parent_tag):
+        elem = parent.find(tag)
+        value = elem.text if elem is not None and elem.text else ""
+    return value
+
+
+def xpath_literal(value):
+    """Chaîne XPath 1.0 pour `value` (guillemets simples ou doubles selon le contenu)."""
+    return f"'{value}'" if "'" not in value else f'"{value}"'
+
+
+class RowQuery:
+    def __init__(self, row_tag, paths, where=None, required=()):
+        """Requête compilée : pour chaque élément `row_tag` (à toute profondeur) retenu par `where`
+        ({chemin: valeur ou tuple de valeurs admises}) et possédant tous les chemins `required`, le texte de
+        chacun des `paths` ('' si absent)."""
+        self.row_tag = row_tag
+        self.paths = list(paths)
+        self.where = {path: (value,) if isinstance(value, str) else tuple(value)
+                      for path, value in (where or {}).items()}
+        self.required = tuple(required)
+        if etree is not None:
+            predicates = ''.join("[" + " or ".join(f"{path}={xpath_literal(v)}" for v in values) + "]"
+                                 for path, values in self.where.items())
+            predicates += ''.join(f"[{path}]" for path in self.required)
+            rows = f"descendant-or-self::{row_tag}{predicates}"
+            self.count_rows = etree.XPath(f"count({rows})")
+            self.rows_path = etree.XPath(rows)
+            # TAG[1] : au plus une valeur par ligne, donc colonne alignée si elle compte autant de valeurs
+            # que de lignes. Les chemins imbriqués (A/B) sont toujours lus ligne par ligne.
+            self.column_paths = {path: etree.XPath(f"{rows}/{path}[1]") for path in self.paths if '/' not in path}
+
+    def columns(self, root):
+        """{chemin: [textes]} avec une valeur par ligne retenue, dans l'ordre du document."""
+        if isinstance(root, ET.Element):
+            return self._columns_etree(root)
+        count = int(self.count_rows(root))
+        result = {}
+        rows = None
+        for path in self.paths:
+            if path in self.column_paths:
+                values = self.column_paths[path](root)
+                if len(values) == count:
+                    result[path] = [elem.text or "" for elem in values]
+                    continue
+            # Champ absent de certaines lignes : lecture ligne par ligne pour garder l'alignement
+            if rows is None:
+                rows = self.rows_path(root)
+            result[path] = [row.findtext(path, "") for row in rows]
+        return result
+
+    def _columns_etree(self, root):
+        result = {path: [] for path in self.paths}
+        for row in root.iter(self.row_tag):
+            if any(row.findtext(path) not in values for path, values in self.where.items()):
+                continue
+            if any(row.find(path) is None for path in self.required):
+                continue
+            for path in self.paths:
+                result[path].append(row.findtext(path, ""))
+        return result
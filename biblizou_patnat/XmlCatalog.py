@@ -0,0 +1,136 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : XmlCatalog.py
+Groupe : Biblizou_PatNat
+Description : Catalogue des fiches XML d'un dossier de travail, classées d'après leur contenu (fiche ZNIEFF ou
+    formulaire Natura 2000) et non plus d'après la forme du nom de fichier. Le classement est conservé avec
+    la taille et la date de chaque fiche dans un manifeste (biblizou_catalog.json) : seules les fiches
+    nouvelles ou modifiées sont relues. L'empreinte SHA-256 du contenu, calculée à la demande (RunMemo), y
+    est conservée de la même façon.
+Dépendances :
+    - Python 3.x
+    - os, re, json, hashlib
+    - XmlStore (fiches archivées)
+
+Utilisation :
+    from XmlCatalog import catalog_files
+    for name in catalog_files(folder_path, ZNIEFF):
+        df = self.xml_to_dataframe(os.path.join(folder_path, name))
+
+    Le classement lit seulement les premiers octets de chaque fiche : le premier élément ZNIEFF(S) désigne une
+    fiche ZNIEFF, BIOTOP(S) un formulaire Natura 2000. Les autres XML (exports divers, fichiers mal formés)
+    sont de type None et ignorés par les modules d'export comme par DelXml.
+"""
+
+import os
+import re
+import json
+import hashlib
+from XmlStore import get_store
+
+ZNIEFF = 'ZNIEFF'
+N2000 = 'N2000'
+MANIFEST_NAME = 'biblizou_catalog.json'
+SNIFF_SIZE = 4096
+ROOT_TAGS = {'ZNIEFF': ZNIEFF, 'ZNIEFFS': ZNIEFF, 'BIOTOP': N2000, 'BIOTOPS': N2000}
+
+_TAG = re.compile(rb'<([A-Za-z_][\w.-]*)')
+
+
+def sniff(head):
+    """Type de la fiche d'après ses premiers éléments (ZNIEFF, N2000 ou None)."""
+    for match in _TAG.finditer(head):
+        tag = match.group(1).decode('ascii', 'ignore').split(':')[-1].upper()
+        if tag in ROOT_TAGS:
+            return ROOT_TAGS[tag]
+    return None
+
+
+def load_manifest(folder_path):
+    try:
+        with open(os.path.join(folder_path, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(folder_path, manifest):
+    path = os.path.join(folder_path, MANIFEST_NAME)
+    try:
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+    except OSError:
+        pass  # dossier en lecture seule : le classement sera refait au prochain appel
+
+
+def catalog(folder_path):
+    """{nom: {'kind', 'size', 'stamp', 'source'}} des fiches XML du dossier, en un seul passage os.scandir.
+
+    Un fichier isolé est prioritaire sur la fiche archivée du même nom (comme XmlStore.parse_xml)."""
+    manifest = load_manifest(folder_path)
+    entries = {}
+
+    store = get_store(folder_path)
+    for name, info in store.infos().items():
+        if name.endswith('.xml'):
+            entries[name] = ('archive', info.file_size, f"crc:{info.CRC:08x}")
+    with os.scandir(folder_path) as scan:
+        for entry in scan:
+            if entry.name.endswith('.xml') and entry.is_file():
+                stat = entry.stat()
+                entries[entry.name] = ('file', stat.st_size, f"mtime:{stat.st_mtime_ns}")
+
+    result, changed = {}, False
+    for name, (source, size, stamp) in entries.items():
+        known = manifest.get(name)
+        if known and known['source'] == source and known['size'] == size and known['stamp'] == stamp:
+            result[name] = known
+            continue
+        try:
+            if source == 'file':
+                with open(os.path.join(folder_path, name), 'rb') as f:
+                    head = f.read(SNIFF_SIZE)
+            else:
+                head = store.head(name, SNIFF_SIZE)
+            kind = sniff(head)
+        except (OSError, KeyError):
+            kind = None
+        result[name] = {'kind': kind, 'size': size, 'stamp': stamp, 'source': source}
+        changed = True
+
+    if changed or set(manifest) != set(result):
+        save_manifest(folder_path, result)
+    return result
+
+
+def catalog_files(folder_path, kind):
+    """Noms triés des fiches du type demandé (ZNIEFF ou N2000)."""
+    return sorted(name for name, entry in catalog(folder_path).items() if entry['kind'] == kind)
+
+
+def content_hashes(folder_path, names):
+    """{nom: empreinte SHA-256 du contenu} des fiches `names` ; seules les fiches nouvelles ou modifiées depuis
+    le dernier calcul sont relues."""
+    entries = catalog(folder_path)
+    store = get_store(folder_path)
+    hashes, changed = {}, False
+    for name in names:
+        entry = entries[name]
+        if 'sha256' not in entry:
+            digest = hashlib.sha256()
+            if entry['source'] == 'file':
+                with open(os.path.join(folder_path, name), 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(block)
+            else:
+                digest.update(store.read(name))
+            entry['sha256'] = digest.hexdigest()
+            changed = True
+        hashes[name] = entry['sha256']
+    if changed:
+        save_manifest(folder_path, entries)
+    return hashes
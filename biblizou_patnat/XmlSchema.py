@@ -0,0 +1,124 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : XmlSchema.py
+Groupe : Biblizou_PatNat
+Description : Schémas déclaratifs des tableaux extraits des fiches XML (élément ligne, champs, filtres, types)
+    et leur compilation en extracteurs. Toutes les colonnes d'un schéma sont lues ligne à ligne ensemble, donc
+    toujours alignées, et rangées directement dans des tableaux NumPy typés. Un nouveau rapport se décrit par un
+    schéma, sans nouveau code de parcours XML. Les champs très répétés (règne, groupe) sont catégoriels dès la
+    lecture.
+Dépendances :
+    - Python 3.x
+    - numpy, pandas
+    - XmlBackend (lxml et XPath compilés, ou xml.etree.ElementTree)
+
+Utilisation :
+    df, site = ZNIEFF_ESPECES.compile().frame(parse_root(xml_file))
+    site['NM_SFFZN'], site['LB_ZN']
+
+    Exemple de schéma :
+        Schema('ESPECE_ROW',
+               [Field('CD_NOM'), Field('NOM_COMPLET'), Field('EFFECTIF', dtype='int')],
+               where={'FG_ESP': 'D'},          # filtres : valeur ou tuple de valeurs admises
+               site=('ZNIEFF', ['NM_SFFZN', 'LB_ZN']))
+
+    Types : 'str' (objet, '' si absent), 'category' (pandas.Categorical, catégories triées), 'int' (int64,
+    default si absent ou invalide), 'float' (NaN si absent). Pour garder les catégories après regroupement,
+    utiliser groupby(..., observed=True) et ColumnStore.ColumnAccumulator plutôt que pd.concat.
+    required : champs (ou sous-éléments) sans lesquels la ligne est ignorée (par défaut aucun).
+"""
+
+import numpy as np
+import pandas as pd
+from XmlBackend import RowQuery, site_text
+
+DTYPES = {'str': object, 'category': 'category', 'int': np.int64, 'float': np.float64}
+
+
+class Field:
+    def __init__(self, name, path=None, dtype='str', default=None):
+        """Colonne `name` lue dans le sous-élément `path` de la ligne (par défaut le même nom)."""
+        if dtype not in DTYPES:
+            raise ValueError(f"Type de champ inconnu : {dtype}")
+        self.name = name
+        self.path = path or name
+        self.dtype = dtype
+        self.default = default if default is not None else {'int': 0, 'float': np.nan}.get(dtype, "")
+
+
+class Schema:
+    def __init__(self, row_tag, fields, where=None, required=(), site=None):
+        """Tableau d'une ligne par élément `row_tag` ; `site` = (élément du site, [champs d'en-tête])."""
+        self.row_tag = row_tag
+        self.fields = list(fields)
+        self.where = where
+        self.required = tuple(required)
+        self.site = site
+        self._extractor = None
+
+    @property
+    def columns(self):
+        return [field.name for field in self.fields]
+
+    def compile(self):
+        """Extracteur du schéma, compilé une seule fois."""
+        if self._extractor is None:
+            self._extractor = Extractor(self)
+        return self._extractor
+
+    def empty(self):
+        """DataFrame vide aux colonnes du schéma (fiche illisible)."""
+        return pd.DataFrame({field.name: pd.Series(dtype=DTYPES[field.dtype]) for field in self.fields})
+
+
+class Extractor:
+    def __init__(self, schema):
+        self.schema = schema
+        paths = {field.name: field.path for field in schema.fields}
+        self.query = RowQuery(schema.row_tag, list(paths.values()), where=schema.where,
+                              required=[paths.get(name, name) for name in schema.required])
+
+    def extract(self, root):
+        """({nom: tableau NumPy typé ou Categorical}, {champ d'en-tête: texte}) pour l'élément racine d'une fiche."""
+        texts = self.query.columns(root)
+        columns = {field.name: to_array(texts[field.path], field) for field in self.schema.fields}
+        site = {}
+        if self.schema.site:
+            site_tag, site_fields = self.schema.site
+            site = {name: (site_text(root, site_tag, name) or "").strip() for name in site_fields}
+        return columns, site
+
+    def frame(self, root):
+        """(DataFrame, {champ d'en-tête: texte})."""
+        columns, site = self.extract(root)
+        return pd.DataFrame(columns, columns=self.schema.columns), site
+
+
+def to_array(values, field):
+    if field.dtype in ('str', 'category'):
+        array = np.empty(len(values), dtype=object)
+        array[:] = [value or field.default for value in values]
+        return pd.Categorical(array) if field.dtype == 'category' else array
+    array = np.full(len(values), field.default, dtype=DTYPES[field.dtype])
+    convert = int if field.dtype == 'int' else float
+    for i, value in enumerate(values):
+        try:
+            array[i] = convert(value.strip().replace(',', '.') if field.dtype == 'float' else value.strip())
+        except ValueError:
+            pass
+    return array
+
+
+ZNIEFF_ESPECES = Schema('ESPECE_ROW',
+                        [Field('REGNE', dtype='category'), Field('GROUPE', dtype='category'), Field('CD_NOM'),
+                         Field('NOM_COMPLET'), Field('NOM_VERN')],
+                        where={'FG_ESP': 'D'}, site=('ZNIEFF', ['NM_SFFZN', 'LB_ZN']))
+ZNIEFF_HABITATS = Schema('TYPO_INFO_ROW', [Field('LB_CODE'), Field('LB_HAB')],
+                         where={'FG_TYPO': 'D'}, site=('ZNIEFF', ['NM_SFFZN', 'LB_ZN']))
+N2000_ESPECES = Schema('SPECIES_ROW', [Field('CD_NOM'), Field('NOM')], required=['CD_NOM'],
+                       site=('BIOTOP', ['SITECODE', 'SITE_NAME']))
+N2000_HABITATS = Schema('HABIT1_ROW', [Field('CD_UE'), Field('LB_HABDH_FR')], required=['CD_UE', 'LB_HABDH_FR'],
+                        site=('BIOTOP', ['SITECODE', 'SITE_NAME']))
@@ -0,0 +1,229 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : XmlStore.py
+Groupe : Biblizou_PatNat
+Description : Stockage des fiches XML INPN dans une archive compressée unique par dossier de travail
+    (biblizou_xml.zip) au lieu de centaines de fichiers isolés sur le partage réseau. Chaque fiche est
+    retrouvée par son nom (<id>.xml) grâce au répertoire central de l'archive, sans tout décompresser.
+Dépendances :
+    - Python 3.x
+    - zipfile, threading, shutil
+    - BiblizouConfig (XML_ARCHIVE)
+
+Utilisation :
+    Téléchargeurs :      store_xml(os.path.join(dossier, f"{id}.xml"), contenu)
+    Modules d'analyse :  for nom in list_xml(dossier): tree = parse_xml(os.path.join(dossier, nom))
+
+    list_xml() et parse_xml() voient indifféremment les fichiers isolés (anciens dossiers, fiches déposées à
+    la main) et les fiches de l'archive ; un fichier isolé est prioritaire sur la fiche archivée du même nom.
+    Les fiches ajoutées sont gardées en mémoire (déjà lisibles) puis écrites par lots : l'archive est réécrite
+    dans un fichier temporaire qui remplace l'ancienne d'un seul coup (os.replace), sans entrée en double.
+    Fin de téléchargement : flush_xml(dossier) (fait aussi par release_store).
+    BIBLIZOU_XML_ARCHIVE=0 rétablit l'écriture en fichiers isolés.
+"""
+
+import io
+import os
+import shutil
+import zipfile
+import threading
+import xml.etree.ElementTree as ET
+import BiblizouConfig
+
+ARCHIVE_NAME = 'biblizou_xml.zip'
+PENDING_FILES = 200               # fiches gardées en mémoire avant réécriture de l'archive
+PENDING_BYTES = 64 * 1024 * 1024  # ... ou volume équivalent
+
+
+class XmlStore:
+    def __init__(self, folder_path):
+        """Archive des fiches XML du dossier (créée au premier ajout)."""
+        self.folder_path = folder_path
+        self.path = os.path.join(folder_path, ARCHIVE_NAME)
+        self.lock = threading.Lock()
+        self.reader = None
+        self.index = None
+        self.mtime = None
+        self.pending = {}  # nom : contenu des fiches ajoutées, pas encore écrites dans l'archive
+
+    def refresh(self):
+        """(Ré)ouvre l'archive en lecture si elle a changé sur le disque depuis la dernière lecture."""
+        mtime = os.path.getmtime(self.path) if os.path.isfile(self.path) else None
+        if self.index is not None and mtime == self.mtime:
+            return
+        self.close_reader()
+        self.mtime = mtime
+        if mtime is None:
+            self.index = {}
+            return
+        self.reader = zipfile.ZipFile(self.path, 'r')
+        self.index = {info.filename: info for info in self.reader.infolist()}
+
+    def close_reader(self):
+        if self.reader is not None:
+            self.reader.close()
+        self.reader, self.index = None, None
+
+    def names(self):
+        with self.lock:
+            self.refresh()
+            return list(dict.fromkeys([*self.index, *self.pending]))
+
+    def __contains__(self, name):
+        with self.lock:
+            self.refresh()
+            return name in self.pending or name in self.index
+
+    def infos(self):
+        """{nom: ZipInfo} des fiches archivées (taille, CRC, date), fiches en attente comprises."""
+        with self.lock:
+            self.refresh()
+            infos = dict(self.index)
+            for name, data in self.pending.items():
+                info = zipfile.ZipInfo(name)
+                info.file_size, info.CRC = len(data), zipfile.crc32(data)
+                infos[name] = info
+            return infos
+
+    def head(self, name, size):
+        """Premiers octets de la fiche `name`, sans décompresser le reste."""
+        with self.lock:
+            if name in self.pending:
+                return self.pending[name][:size]
+            self.refresh()
+            if self.reader is None:
+                raise KeyError(name)
+            with self.reader.open(self.index[name]) as member:
+                return member.read(size)
+
+    def read(self, name):
+        """Contenu (octets) de la fiche `name` ; KeyError si elle n'est pas dans l'archive."""
+        with self.lock:
+            if name in self.pending:
+                return self.pending[name]
+            self.refresh()
+            if self.reader is None:
+                raise KeyError(name)
+            return self.reader.read(self.index[name])
+
+    def add(self, name, data):
+        """Ajoute ou remplace la fiche `name`. Une fiche identique déjà archivée n'est pas réécrite."""
+        with self.lock:
+            self.refresh()
+            info = self.index.get(name)
+            if info is not None and info.file_size == len(data) and info.CRC == zipfile.crc32(data):
+                self.pending.pop(name, None)
+                return
+            self.pending[name] = data
+            if len(self.pending) >= PENDING_FILES or sum(map(len, self.pending.values())) >= PENDING_BYTES:
+                self.write_pending()
+
+    def flush(self):
+        """Écrit dans l'archive les fiches en attente."""
+        with self.lock:
+            self.write_pending()
+
+    def write_pending(self):
+        """Réécrit l'archive (fiches conservées + fiches en attente) dans un fichier temporaire qui remplace
+        l'ancienne d'un seul coup : pas de doublon, et l'archive reste intacte si l'écriture échoue."""
+        if not self.pending:
+            return
+        self.refresh()
+        partial = f"{self.path}.tmp"
+        try:
+            with zipfile.ZipFile(partial, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+                for name, info in self.index.items():
+                    if name not in self.pending:
+                        # Copie membre par membre, sans charger l'archive en mémoire
+                        member = zipfile.ZipInfo(name, info.date_time)
+                        member.compress_type = zipfile.ZIP_DEFLATED
+                        with self.reader.open(info) as source, archive.open(member, 'w') as target:
+                            shutil.copyfileobj(source, target, 1 << 20)
+                for name, data in self.pending.items():
+                    archive.writestr(name, data)
+            self.close_reader()
+            os.replace(partial, self.path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self.pending = {}
+
+    def delete(self):
+        """Supprime l'archive ; retourne le nombre de fiches qu'elle contenait."""
+        with self.lock:
+            self.refresh()
+            count = len(set(self.index) | set(self.pending))
+            self.pending = {}
+            self.close_reader()
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+            return count
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(folder_path):
+    """Archive partagée du dossier (une seule instance par dossier, utilisable depuis plusieurs fils)."""
+    key = os.path.normcase(os.path.abspath(folder_path))
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = XmlStore(folder_path)
+        return _stores[key]
+
+
+def release_store(folder_path):
+    """Écrit les fiches en attente, ferme l'archive du dossier et l'oublie (avant copie ou suppression du dossier)."""
+    key = os.path.normcase(os.path.abspath(folder_path))
+    with _stores_lock:
+        store = _stores.pop(key, None)
+    if store is not None:
+        with store.lock:
+            store.write_pending()
+            store.close_reader()
+
+
+def flush_xml(folder_path):
+    """Écrit dans l'archive du dossier les fiches téléchargées gardées en mémoire."""
+    get_store(folder_path).flush()
+
+
+def list_xml(folder_path):
+    """Noms des fiches XML du dossier : fichiers isolés et fiches de l'archive, sans doublon, triés."""
+    loose = {f for f in os.listdir(folder_path) if f.endswith('.xml')}
+    return sorted(loose.union(name for name in get_store(folder_path).names() if name.endswith('.xml')))
+
+
+def xml_exists(xml_file):
+    return os.path.isfile(xml_file) or os.path.basename(xml_file) in get_store(os.path.dirname(xml_file))
+
+
+def read_xml(xml_file):
+    """Contenu (octets) d'une fiche, fichier isolé ou membre de l'archive du dossier."""
+    if os.path.isfile(xml_file):
+        with open(xml_file, 'rb') as f:
+            return f.read()
+    try:
+        return get_store(os.path.dirname(xml_file)).read(os.path.basename(xml_file))
+    except KeyError:
+        raise FileNotFoundError(xml_file)
+
+
+def parse_xml(xml_file):
+    """Équivalent de ET.parse(xml_file) qui lit aussi les fiches archivées."""
+    if os.path.isfile(xml_file):
+        return ET.parse(xml_file)
+    return ET.parse(io.BytesIO(read_xml(xml_file)))
+
+
+def store_xml(save_path, data):
+    """Enregistre une fiche téléchargée : dans l'archive du dossier, ou en fichier isolé si XML_ARCHIVE est faux."""
+    if BiblizouConfig.XML_ARCHIVE:
+        get_store(os.path.dirname(save_path)).add(os.path.basename(save_path), data)
+    else:
+        with open(save_path, 'wb') as f:
+            f.write(data)
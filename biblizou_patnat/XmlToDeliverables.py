@@ -0,0 +1,337 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : XmlToDeliverables.py
+Groupe : Biblizou_PatNat
+Description : Mode « tous les livrables » : les fiches XML du dossier sont lues une seule fois, puis les
+    classeurs d'espèces et d'habitats et le document des descriptions de sites sont construits en même temps,
+    chacun dans un processus de travail. Chaque livrable est identique à celui du module correspondant
+    (ZnieffXmlToXlsxEsp, ZnieffXmlToXlsxHab, ZnieffXmlToDocx et leurs équivalents Natura 2000) ; la durée
+    totale est celle de l'analyse plus celle du livrable le plus long, au lieu de la somme des traitements.
+Dépendances :
+    - Python 3.x
+    - QGIS (QgsMessageLog)
+    - multiprocessing, concurrent.futures, os, sys, datetime
+    - XmlBackend, XmlSchema, XmlCatalog (lecture unique des fiches)
+    - modules d'export XLSX et DocxBuilder (construction des livrables)
+    - BiblizouConfig (DELIVERABLE_WORKERS, OUTPUT_FORMATS), BiblizouMetrics, RunMemo, BiblizouStaging, BiblizouTask
+
+Utilisation :
+    Ce module doit être appelé depuis une extension QGIS. Les livrables sont produits pour chaque type de
+    fiche présent dans le dossier (ZNIEFF et/ou Natura 2000), avec un horodatage commun.
+
+    Les processus de travail sont démarrés en mode « spawn ». Dans QGIS, sys.executable désigne l'application
+    (qgis-bin.exe) : l'interpréteur Python fourni avec QGIS est désigné par set_executable, et les processus
+    héritent de l'environnement de QGIS comme un script PyQGIS autonome. L'annulation de la tâche est
+    transmise aux processus par un événement partagé, avec les réglages courants de BiblizouConfig (formats de
+    sortie, présentation...) ; leurs messages sont affichés à la fin de la tâche. Un livrable déjà produit par
+    une exécution identique (RunMemo) est recopié sans être reconstruit ; si un processus s'arrête
+    brutalement, seuls les livrables qui n'ont pas abouti sont reconstruits dans le processus QGIS.
+    BiblizouConfig.DELIVERABLE_WORKERS (variable BIBLIZOU_DELIVERABLE_WORKERS) : 0 (par défaut) = un processus
+    par livrable dans la limite des cœurs, 1 = construction séquentielle dans le processus QGIS (repli
+    automatique si les processus ne peuvent pas démarrer).
+"""
+
+import os
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from qgis.core import QgsMessageLog, Qgis
+from qgis.utils import iface
+from PyQt5.QtWidgets import QFileDialog
+import BiblizouConfig
+from BiblizouMetrics import RunMetrics
+from XmlBackend import parse_root, PARSE_ERRORS
+from XmlSchema import ZNIEFF_ESPECES, ZNIEFF_HABITATS, N2000_ESPECES, N2000_HABITATS
+from XmlCatalog import catalog_files, ZNIEFF, N2000
+from DocxBuilder import DocxBuilder
+import ZnieffXmlToDocx
+import NaturaXmlToDocx
+from ZnieffXmlToXlsxEsp import ZnieffXmlToXlsxEsp
+from ZnieffXmlToXlsxHab import ZnieffXmlToXlsxHab
+from NaturaXmlToXlsxEsp import NaturaXmlToXlsxEsp
+from NaturaXmlToXlsxHab import NaturaXmlToXlsxHab
+from RunMemo import fingerprint, reuse_outputs, deliverables
+from BiblizouStaging import staged
+from BiblizouTask import lancer_tache, tache_annulee, pousser_message
+
+# Livrables de chaque type de fiche : (module de construction, nom du fichier), dans l'ordre des données
+# rendues par XmlToDeliverables.parse (espèces, habitats, descriptions)
+DELIVERABLES = {
+    ZNIEFF: [('ZnieffXmlToXlsxEsp', 'ZNIEFF_synthèse_des_esp_déterminantes_{}.xlsx'),
+             ('ZnieffXmlToXlsxHab', 'ZNIEFF_synthèse_des_habitats_déterminants_{}.xlsx'),
+             ('ZnieffXmlToDocx', 'ZNIEFF_Descriptions_des_sites_{}.docx')],
+    N2000: [('NaturaXmlToXlsxEsp', 'N2000_Synthèse_des_espèces_AnxI-II_{}.xlsx'),
+            ('NaturaXmlToXlsxHab', 'N2000_Synthèse_habitats_{}.xlsx'),
+            ('NaturaXmlToDocx', 'N2000_Descriptions_des_sites_{}.docx')],
+}
+# Module d'export et sa méthode d'écriture dans tous les formats demandés (BiblizouConfig.OUTPUT_FORMATS)
+EXPORTERS = {'ZnieffXmlToXlsxEsp': (ZnieffXmlToXlsxEsp, 'export_frames'),
+             'ZnieffXmlToXlsxHab': (ZnieffXmlToXlsxHab, 'export_sites'),
+             'NaturaXmlToXlsxEsp': (NaturaXmlToXlsxEsp, 'export_sites'),
+             'NaturaXmlToXlsxHab': (NaturaXmlToXlsxHab, 'export_sites')}
+TAXREF_TOOLS = {'NaturaXmlToXlsxEsp'}  # livrables complétés par TaxRef (empreinte RunMemo)
+DESCRIPTIONS = {ZNIEFF: ZnieffXmlToDocx.site_descriptions, N2000: NaturaXmlToDocx.site_descriptions}
+LEVELS = {int(level): level for level in (Qgis.Info, Qgis.Warning, Qgis.Critical, Qgis.Success)}
+
+_cancel = None  # événement d'annulation partagé, dans un processus de travail
+
+
+def init_worker(cancel, config):
+    """Initialisation d'un processus de travail : annulation partagée et réglages de la session QGIS."""
+    global _cancel
+    _cancel = cancel
+    BiblizouConfig.restore(config)
+
+
+class WorkerTask:
+    def __init__(self, canceled=None):
+        """Tâche vue par un module d'export hors de la tâche QGIS : annulation lue par `canceled()` (par défaut
+        l'événement partagé du processus), messages conservés pour être affichés par la tâche QGIS."""
+        self.canceled = canceled or (lambda: _cancel is not None and _cancel.is_set())
+        self.messages = []
+
+    def isCanceled(self):
+        return self.canceled()
+
+    def avancer(self, etape, fait, total):
+        pass  # la progression est suivie livrable par livrable par la tâche QGIS
+
+    def push_message(self, title, text, level=Qgis.Info):
+        self.messages.append((title, text, int(level)))
+
+
+def build_deliverable(tool, folder_path, output_path, items, key=None, canceled=None):
+    """Construit un livrable à partir des données déjà lues ; exécuté dans un processus de travail. `key` est
+    l'empreinte RunMemo inscrite dans le rapport.
+
+    Retourne (chemin, construit, messages, erreur)."""
+    task = WorkerTask(canceled)
+    try:
+        if tool in EXPORTERS:
+            exporter_class, method = EXPORTERS[tool]
+            exporter = exporter_class(None)
+            exporter.task = task
+            metrics = exporter.metrics
+            done = getattr(exporter, method)(iter(items), output_path, task, len(items))
+        else:
+            metrics = RunMetrics(tool)
+            builder = DocxBuilder()
+            for title, paragraphs in items:
+                if tache_annulee(task):
+                    return output_path, False, task.messages, None
+                builder.add_site(title, paragraphs)
+            metrics.incr('rows.written', builder.paragraph_count)
+            with metrics.span('save'):
+                builder.save(output_path)
+            done = True
+        if done:
+            metrics.write_report(output_path, folder=folder_path, fingerprint=key, parsed_by='XmlToDeliverables')
+        return output_path, done, task.messages, None
+    except Exception as e:
+        for path in deliverables(output_path):
+            os.remove(path)
+        return output_path, False, task.messages, str(e)
+
+
+def process_context():
+    """Contexte multiprocessing « spawn » démarrant un interpréteur Python, y compris depuis QGIS."""
+    context = multiprocessing.get_context('spawn')
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return context
+    for folder in (sys.exec_prefix, os.path.join(sys.exec_prefix, 'bin')):
+        for name in ('pythonw.exe', 'python.exe', 'python3'):
+            candidate = os.path.join(folder, name)
+            if os.path.isfile(candidate):
+                context.set_executable(candidate)
+                return context
+    raise OSError(f"interpréteur Python introuvable dans {sys.exec_prefix}")
+
+
+class XmlToDeliverables:
+    def __init__(self, iface):
+        self.iface = iface
+        self.task = None
+        self.metrics = RunMetrics('XmlToDeliverables')
+
+    def push_message(self, title, text, level):
+        """Affiche un message dans la barre QGIS (différé si le traitement tourne en tâche de fond)."""
+        pousser_message(self.iface, self.task, title, text, level)
+
+    def run(self):
+        folder_path = QFileDialog.getExistingDirectory(None, "Sélectionner le dossier contenant les fichiers XML")
+        if not folder_path:
+            self.iface.messageBar().pushMessage("Annulation", "Aucun dossier sélectionné.", level=Qgis.Warning)
+            return
+        lancer_tache("Biblizou : tous les livrables (XLSX et DOCX)",
+                     lambda task: staged(folder_path, lambda work_folder:
+                                         self.process_xml_files_in_folder(work_folder, task)),
+                     self.iface)
+
+    def parse(self, folder_path, kind, xml_files, task=None, done=0, total=None, with_species=True):
+        """Lecture unique des fiches d'un type : [espèces, habitats, descriptions], chacune dans la forme
+        attendue par le module d'export correspondant ; None si la tâche a été annulée. with_species=False
+        évite les requêtes TaxRef quand le livrable des espèces n'est pas à reconstruire."""
+        species, habitats, descriptions = [], [], []
+        taxref, cache = (NaturaXmlToXlsxEsp(self.iface), {}) if kind == N2000 and with_species else (None, None)
+        if taxref is not None:
+            taxref.metrics = self.metrics  # requêtes TaxRef comptées dans le rapport du traitement
+        for xml_file in xml_files:
+            if tache_annulee(task):
+                return None
+            try:
+                with self.metrics.span('parse'):
+                    root = parse_root(os.path.join(folder_path, xml_file))
+                    if kind == ZNIEFF:
+                        df, site = ZNIEFF_ESPECES.compile().frame(root)
+                        species.append((df, site['LB_ZN'], site['NM_SFFZN']))
+                        df, site = ZNIEFF_HABITATS.compile().frame(root)
+                        habitats.append((df, {'ID_MNHN': site['NM_SFFZN'], 'NOM_SITE': site['LB_ZN']}))
+                    else:
+                        columns, site = N2000_ESPECES.compile().extract(root)
+                        taxa = list(zip(columns['CD_NOM'], columns['NOM']))
+                        df, _ = N2000_HABITATS.compile().frame(root)
+                        habitats.append((df, {'SITECODE': site['SITECODE'], 'SITE_NAME': site['SITE_NAME']}))
+                    descriptions.extend(DESCRIPTIONS[kind](root))
+                if taxref is not None:
+                    # Complément TaxRef dans le processus QGIS (cache partagé entre les fiches)
+                    species.append((taxref.species_to_dataframe(taxa, cache), site['SITECODE'], site['SITE_NAME']))
+                self.metrics.incr('files.parsed')
+            except PARSE_ERRORS as e:
+                self.metrics.incr('files.failed')
+                QgsMessageLog.logMessage(f"Erreur d'analyse XML dans {xml_file} : {e}", "Biblizou", Qgis.Warning)
+            except Exception as e:
+                self.metrics.incr('files.failed')
+                QgsMessageLog.logMessage(f"Erreur inattendue avec {xml_file} : {e}", "Biblizou", Qgis.Critical)
+            done += 1
+            if task is not None:
+                task.avancer("Fichiers analysés", done, total)
+        return [species, habitats, descriptions]
+
+    def build_all(self, folder_path, jobs, task=None):
+        """Construit les livrables (tool, chemin, données, empreinte) ; en processus parallèles si possible, les
+        livrables dont le processus a échoué étant reconstruits ensuite dans le processus QGIS."""
+        workers = BiblizouConfig.DELIVERABLE_WORKERS or min(len(jobs), os.cpu_count() or 1)
+        results = []
+        if workers > 1:
+            try:
+                results = self.build_in_processes(folder_path, jobs, task, workers)
+            except OSError as e:
+                QgsMessageLog.logMessage(f"Processus de construction indisponibles ({e}) : construction "
+                                         f"séquentielle.", "Biblizou", Qgis.Warning)
+        built = {output_path for output_path, _, _, _ in results}
+        remaining = [job for job in jobs if job[1] not in built]
+        if workers > 1 and remaining and not tache_annulee(task):
+            QgsMessageLog.logMessage(f"{len(remaining)}/{len(jobs)} livrable(s) non construit(s) par les processus "
+                                     f"de travail : construction dans QGIS.", "Biblizou", Qgis.Warning)
+        for tool, output_path, items, key in remaining:
+            if tache_annulee(task):
+                break
+            results.append(build_deliverable(tool, folder_path, output_path, items, key,
+                                             lambda: tache_annulee(task)))
+            if task is not None:
+                task.avancer("Livrables construits", len(results), len(jobs))
+        return results
+
+    def build_in_processes(self, folder_path, jobs, task, workers):
+        """Résultats des livrables construits en processus parallèles ; un livrable dont le processus s'est
+        arrêté brutalement (BrokenProcessPool) ou n'a pu être transmis est absent des résultats."""
+        context = process_context()
+        cancel = context.Event()
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                 initargs=(cancel, BiblizouConfig.snapshot())) as executor:
+            pending = set()
+            try:
+                for tool, output_path, items, key in jobs:
+                    pending.add(executor.submit(build_deliverable, tool, folder_path, output_path, items, key))
+            except BrokenProcessPool:
+                pass  # livrables non soumis : reconstruits par build_all
+            while pending:
+                finished, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    try:
+                        results.append(future.result())
+                    except Exception as e:  # BrokenProcessPool, données non transmissibles...
+                        QgsMessageLog.logMessage(f"Processus de construction en échec : {e}", "Biblizou",
+                                                 Qgis.Warning)
+                        continue
+                    if task is not None:
+                        task.avancer("Livrables construits", len(results), len(jobs))
+                if tache_annulee(task):
+                    cancel.set()  # chaque module d'export s'arrête au prochain site et supprime son fichier
+        return results
+
+    def process_xml_files_in_folder(self, folder_path, task=None):
+        self.task = task
+        self.metrics = RunMetrics('XmlToDeliverables')
+        if not os.path.isdir(folder_path):
+            self.push_message("Erreur", f"Le chemin {folder_path} n'est pas un dossier valide.", Qgis.Critical)
+            return
+
+        files = {kind: catalog_files(folder_path, kind) for kind in DELIVERABLES}
+        total = sum(len(xml_files) for xml_files in files.values())
+        if not total:
+            self.push_message("Information", "Aucun fichier XML trouvé dans le dossier.", Qgis.Info)
+            return
+
+        current_time = datetime.now().strftime("%Y%m%d%H%M%S")
+        jobs, reused, done = [], [], 0
+        for kind, xml_files in files.items():
+            if not xml_files:
+                continue
+            # Livrables d'une exécution identique (RunMemo) recopiés ; seuls les autres sont construits
+            wanted = []
+            for tool, name in DELIVERABLES[kind]:
+                output_path = os.path.join(folder_path, name.format(current_time))
+                key = fingerprint(tool, folder_path, xml_files, taxref=tool in TAXREF_TOOLS)
+                copies = reuse_outputs(folder_path, key, output_path, RunMetrics(tool))
+                reused.extend(copies)
+                wanted.append(None if copies else (tool, output_path, key))
+            if not any(wanted):
+                done += len(xml_files)
+                continue
+            data = self.parse(folder_path, kind, xml_files, task, done, total, with_species=wanted[0] is not None)
+            if data is None:
+                return
+            done += len(xml_files)
+            for job, items in zip(wanted, data):
+                if job is not None:
+                    tool, output_path, key = job
+                    jobs.append((tool, output_path, items, key))
+
+        with self.metrics.span('build'):
+            results = self.build_all(folder_path, jobs, task) if jobs else []
+
+        for output_path, built, messages, error in results:
+            for title, text, level in messages:
+                self.push_message(title, text, LEVELS.get(level, Qgis.Info))
+            if error is not None:
+                self.push_message("Erreur", f"{os.path.basename(output_path)} : {error}", Qgis.Critical)
+        built = [output_path for output_path, built, _, _ in results if built]
+        if tache_annulee(task):
+            for output_path in built:
+                for path in deliverables(output_path) + [f"{output_path}.run.json"]:
+                    if os.path.exists(path):
+                        os.remove(path)
+            return
+        produced = reused + [path for output_path in built for path in deliverables(output_path)]
+        self.metrics.incr('memo.reused', len(reused))
+        self.metrics.write_report(os.path.join(folder_path, f'Biblizou_livrables_{current_time}'),
+                                  folder=folder_path, deliverables=produced)
+        self.push_message("Succès", f"{len(built)}/{len(jobs)} livrable(s) construit(s) en "
+                                    f"{self.metrics.elapsed():.1f} s, {len(reused)} fichier(s) réutilisé(s) : "
+                                    f"{', '.join(produced)}", Qgis.Success)
+
+
+# Pour exécuter le module dans QGIS
+def run_module(iface):
+    module = XmlToDeliverables(iface)
+    module.run()
+
+if __name__ in ('__main__', '__console__'):
+    run_module(iface)
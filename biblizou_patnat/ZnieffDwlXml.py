@@ -9,15 +9,18 @@ Description : Module pour télécharger les xml des zonages natura2000 dans un p
 Dépendances :
     - Python 3.x
     - QGIS (QgsMessageBar, QgsMessageLog)
+    - BiblizouHttp (cache négatif, disjoncteur)
+    - XmlStore (archive biblizou_xml.zip du dossier)
 
 Utilisation :
     Ce module doit être appelé depuis une extension QGIS. Il prend en entrée un
     dossier et y télécharge tous les fichiers XML.
+    run_module(rings=True) : sélection par aires d'étude emboîtées (immédiate / rapprochée / éloignée)
+    en une seule exécution, avec le tableau <type>_aires_étude_<date>.xlsx.
 """
 
 import os
-import requests
-import time
+from datetime import datetime
 import logging
 from qgis.core import (
     QgsProject,
@@ -29,7 +32,18 @@ from qgis.core import (
     QgsGeometry
 )
 from qgis.gui import QgsMapLayerComboBox
+from qgis.utils import iface
 from PyQt5.QtWidgets import QInputDialog, QMessageBox
+import BiblizouConfig
+from BiblizouHttp import fetch
+from GeometryCache import study_area
+from XmlStore import store_xml, flush_xml
+from BiblizouStaging import staged
+from ZonagesTable import ask_rings, extract_sites, ring_table
+from BiblizouMetrics import RunMetrics
+from BiblizouTask import lancer_tache, tache_annulee
+from BiblizouPipeline import StreamingPipeline
+from ZnieffXmlToXlsxEsp import ZnieffXmlToXlsxEsp
 
 class ZnieffDwlXml:
     def __init__(self):
@@ -39,6 +53,7 @@ class ZnieffDwlXml:
         self.id_mnhn_zn1 = []
         self.id_mnhn_zn2 = []
         self.ae_eloignee = None
+        self.metrics = RunMetrics('ZnieffDwlXml')
 
     def select_layer(self):
         """Demande à l'utilisateur de sélectionner une couche vectorielle dans le projet."""
@@ -52,31 +67,24 @@ class ZnieffDwlXml:
             QMessageBox.warning(None, "Avertissement", "Aucune couche sélectionnée.")
 
     def selectionner_et_stocker(self, couche_source, liste_stockage):
-        """Sélectionne les entités intersectant AE_eloignee et stocke leurs ID, en optimisant la reprojection."""
+        """Sélectionne les entités intersectant AE_eloignee et stocke leurs ID (aire d'étude mise en cache)."""
         if not couche_source or not self.ae_eloignee:
             QgsMessageLog.logMessage(f"La couche {couche_source.name()} ou AE_eloignee est introuvable.", "Biblizou")
             return
 
-        # Définir la transformation de coordonnées
-        transform = QgsCoordinateTransform(self.ae_eloignee.crs(), couche_source.crs(), QgsProject.instance())
-
-        # Fusionner toutes les géométries de AE_eloignee en une seule
-        geometries = [f.geometry() for f in self.ae_eloignee.getFeatures()]
-        if not geometries:
-            QgsMessageLog.logMessage(f"Aucune géométrie trouvée dans AE_eloignee.", "Biblizou")
+        # Aire d'étude fusionnée, reprojetée et préparée, partagée entre couches et outils (GeometryCache)
+        area = study_area(self.ae_eloignee, couche_source.crs())
+        if area is None:
             return
 
-        geom_ref = QgsGeometry.unaryUnion(geometries)
-        geom_ref.transform(transform)  # Transformer une seule géométrie fusionnée
-
         couche_source.removeSelection()
         ids_selectionnes = []
 
         # Effectuer une sélection spatiale avec une boîte englobante pour optimiser
-        request = QgsFeatureRequest().setFilterRect(geom_ref.boundingBox())
+        request = QgsFeatureRequest().setFilterRect(area.bbox)
 
         for feature in couche_source.getFeatures(request):
-            if feature.geometry().intersects(geom_ref):
+            if area.intersects(feature.geometry()):
                 ids_selectionnes.append(feature.id())
                 liste_stockage.append(feature["id_mnhn"])
 
@@ -88,57 +96,159 @@ class ZnieffDwlXml:
             QgsMessageLog.logMessage(f"Aucune entité sélectionnée dans {couche_source.name()}.", "Biblizou")
 
     def download_file(self, url, save_path, retries=3):
-        """Télécharge un fichier XML avec gestion des erreurs."""
-        attempt = 0
-        while attempt < retries:
-            try:
-                response = requests.get(url)
-                response.raise_for_status()
-
-                with open(save_path, 'wb') as f:
-                    f.write(response.content)
-                QgsMessageLog.logMessage(f"Fichier téléchargé avec succès : {save_path}", "Biblizou")
-                return True
-            except requests.exceptions.RequestException:
-                attempt += 1
-                time.sleep(2 ** attempt)
-        QgsMessageLog.logMessage(f"Échec du téléchargement après {retries} tentatives : {url}", "Biblizou", level=2)
-        return False
-
-    def construct_url_and_download(self, znieff_ids, download_folder):
+        """Télécharge un fichier XML (fiches absentes mémorisées, erreurs temporaires retentées, voir BiblizouHttp)."""
+        with self.metrics.span('download'):
+            response = fetch(url, retries=retries, metrics=self.metrics)
+        if response is None:
+            self.metrics.incr('files.failed')
+            QgsMessageLog.logMessage(f"Échec du téléchargement : {url}", "Biblizou", level=2)
+            return False
+
+        with self.metrics.span('write'):
+            store_xml(save_path, response.content)
+        self.metrics.incr('bytes.downloaded', len(response.content))
+        self.metrics.incr('files.downloaded')
+        QgsMessageLog.logMessage(f"Fichier téléchargé avec succès : {save_path}", "Biblizou")
+        return True
+
+    def download_site(self, site_id, download_folder):
+        """Télécharge la fiche XML d'un site et retourne son chemin, ou None en cas d'échec."""
+        save_path = os.path.join(download_folder, f"{site_id}.xml")
+        if self.download_file(BiblizouConfig.znieff_xml_url(site_id), save_path):
+            return save_path
+        return None
+
+    def construct_url_and_download(self, znieff_ids, download_folder, task=None, metrics=None):
         """Construit les URLs et télécharge les fichiers XML correspondants."""
         if not znieff_ids:
             QgsMessageLog.logMessage("Aucun identifiant ZNIEFF trouvé.", "Biblizou")
             return
 
-        for znieff_id in znieff_ids:
-            url = f"https://inpn.mnhn.fr/docs/ZNIEFF/znieffxml/{znieff_id}.xml"
-            save_path = os.path.join(download_folder, f"{znieff_id}.xml")
-            self.download_file(url, save_path)
-
-    def run(self):
-        """Point d'entrée principal du module."""
-        self.select_layer()
-        if not self.ae_eloignee:
-            QMessageBox.warning(None, "Erreur", "Aucune couche de référence sélectionnée.")
+        self.metrics = metrics or RunMetrics('ZnieffDwlXml')
+        current_time = datetime.now().strftime("%Y%m%d%H%M%S")
+        report_file = os.path.join(download_folder, f'ZNIEFF_téléchargement_{current_time}')
+        for idx, znieff_id in enumerate(znieff_ids, start=1):
+            if tache_annulee(task):
+                QgsMessageLog.logMessage("Téléchargement annulé par l'utilisateur.", "Biblizou", level=1)
+                break
+            self.download_site(znieff_id, download_folder)
+            if task is not None:
+                task.avancer("Fichiers téléchargés", idx, len(znieff_ids))
+        with self.metrics.span('write'):
+            flush_xml(download_folder)
+        self.metrics.write_report(report_file, ids=len(znieff_ids))
+
+    def download_and_export(self, znieff_ids, download_folder, task=None):
+        """Télécharge les fiches et les exporte en XLSX au fil de l'eau (ZnieffXmlToXlsxEsp).
+
+        Chaque fiche est analysée dès la fin de son téléchargement pendant que les suivantes sont en cours."""
+        if not znieff_ids:
+            QgsMessageLog.logMessage("Aucun identifiant ZNIEFF trouvé.", "Biblizou")
             return
 
+        self.metrics = RunMetrics('ZnieffDwlXml')
+        exporter = ZnieffXmlToXlsxEsp(iface)
+        exporter.task, exporter.metrics = task, self.metrics
+
+        def parse(path):
+            with self.metrics.span('parse'):
+                parsed = exporter.xml_to_dataframe(path)
+            self.metrics.incr('files.parsed')
+            return parsed, ()
+
+        pipeline = StreamingPipeline(download=lambda znieff_id: self.download_site(znieff_id, download_folder),
+                                     parse=parse, task=task, metrics=self.metrics)
+        current_time = datetime.now().strftime("%Y%m%d%H%M%S")
+        excel_file = os.path.join(download_folder, f'ZNIEFF_synthèse_des_esp_déterminantes_{current_time}.xlsx')
+        try:
+            exported = exporter.export_frames(pipeline.run(znieff_ids), excel_file, task, len(znieff_ids))
+        finally:
+            flush_xml(download_folder)  # fiches encore en mémoire écrites dans l'archive, même en cas d'erreur
+        if exported:
+            self.metrics.write_report(excel_file, ids=len(znieff_ids), folder=download_folder)
+        for item, error in pipeline.errors:
+            QgsMessageLog.logMessage(f"Chaîne ZNIEFF, {item} : {error}", "Biblizou", level=2)
+
+    def ask_download_folder(self):
+        """Demande le dossier de travail ; retourne None si la saisie est annulée ou invalide."""
         download_folder, ok = QInputDialog.getText(None, "Chemin vers le dossier de travail", "Copier/coller le chemin")
         if not ok:
             QgsMessageLog.logMessage("L'utilisateur a annulé la saisie du chemin.", "Biblizou", level=2)
-            return
+            return None
 
         if not os.path.isdir(download_folder):
             QMessageBox.warning(None, "Erreur", f"Le dossier {download_folder} n'existe pas.")
+            return None
+        return download_folder
+
+    def run_rings(self):
+        """Sélection par aires d'étude emboîtées : chaque zonage est affecté à l'aire la plus intérieure qu'il
+        touche, en un seul passage sur les couches de zonages, puis toutes les fiches sont téléchargées une fois."""
+        rings = ask_rings()
+        if rings is None:
+            QMessageBox.warning(None, "Erreur", "Aires d'étude non définies.")
+            return
+        download_folder = self.ask_download_folder()
+        if not download_folder:
+            return
+
+        # Lecture des couches dans le fil principal ; affectation aux aires et téléchargements en tâche de fond
+        metrics = RunMetrics('ZnieffDwlXml')
+        layers = [('ZNIEFF1', self.patrinat_zn1), ('ZNIEFF2', self.patrinat_zn2)]
+        with metrics.span('extract'):
+            sites = extract_sites(layers, rings.crs, rings.bbox)
+        lancer_tache("Biblizou : téléchargement des XML ZNIEFF (aires d'étude)",
+                     lambda task: staged(download_folder, lambda work_folder:
+                                         self.download_rings(sites, rings, work_folder, task, metrics)), iface)
+
+    def download_rings(self, sites, rings, download_folder, task=None, metrics=None):
+        """Corps de la tâche de run_rings : affectation des zonages déjà extraits (extract_sites) aux aires,
+        tableau des aires puis téléchargement des fiches."""
+        metrics = metrics or RunMetrics('ZnieffDwlXml')
+        with metrics.span('selection'):
+            table = ring_table(sites, rings)
+        current_time = datetime.now().strftime("%Y%m%d%H%M%S")
+        with metrics.span('write'):
+            table.to_excel(os.path.join(download_folder, f'ZNIEFF_aires_étude_{current_time}.xlsx'), index=False)
+        for name, count in table['AIRE'].value_counts(sort=False).items():
+            QgsMessageLog.logMessage(f"{count} zonage(s) dans {name}.", "Biblizou")
+        if tache_annulee(task):
+            return
+        self.construct_url_and_download(list(dict.fromkeys(table['ID_MNHN'])), download_folder, task, metrics)
+
+    def run(self):
+        """Point d'entrée principal du module."""
+        self.select_layer()
+        if not self.ae_eloignee:
+            QMessageBox.warning(None, "Erreur", "Aucune couche de référence sélectionnée.")
+            return
+
+        download_folder = self.ask_download_folder()
+        if not download_folder:
             return
 
         self.selectionner_et_stocker(self.patrinat_zn1, self.id_mnhn_zn1)
         self.selectionner_et_stocker(self.patrinat_zn2, self.id_mnhn_zn2)
-        self.construct_url_and_download(self.id_mnhn_zn1 + self.id_mnhn_zn2, download_folder)
+        ids = self.id_mnhn_zn1 + self.id_mnhn_zn2
+        export = QMessageBox.question(None, "Synthèse des espèces",
+                                      "Générer la synthèse XLSX des espèces déterminantes pendant le téléchargement ?",
+                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No) == QMessageBox.Yes
+        if export:
+            lancer_tache("Biblizou : téléchargement et synthèse des XML ZNIEFF",
+                         lambda task: staged(download_folder, lambda work_folder:
+                                             self.download_and_export(ids, work_folder, task)), iface)
+        else:
+            lancer_tache("Biblizou : téléchargement des XML ZNIEFF",
+                         lambda task: staged(download_folder, lambda work_folder:
+                                             self.construct_url_and_download(ids, work_folder, task)), iface)
 
 # Pour exécuter le module dans QGIS
-def run_module():
+def run_module(rings=False):
     module = ZnieffDwlXml()
-    module.run()
+    if rings:
+        module.run_rings()
+    else:
+        module.run()
 
-run_module()
+if __name__ in ('__main__', '__console__'):
+    run_module()
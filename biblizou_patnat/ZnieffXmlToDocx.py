@@ -11,8 +11,10 @@ Dépendances :
     - Python 3.x
     - QGIS (QgsMessageLog)
     - xml.etree.ElementTree
-    - python-docx
+    - python-docx (via DocxBuilder)
     - os, datetime
+    - BiblizouMetrics (rapport <fichier>.docx.run.json)
+    - XmlStore (fiches isolées ou archivées dans biblizou_xml.zip), XmlCatalog (type de fiche selon son contenu)
 
 Utilisation :
     Ce module doit être appelé depuis une extension QGIS. Il prend en entrée un
@@ -20,108 +22,112 @@ Utilisation :
 """
 
 from qgis.PyQt.QtWidgets import QFileDialog
-from qgis.core import QgsMessageBar
+from qgis.core import Qgis
+from qgis.utils import iface
 import xml.etree.ElementTree as ET
-from docx import Document
-from docx.shared import Pt, RGBColor
+from DocxBuilder import DocxBuilder, normalize_text
 from datetime import datetime
 import os
+from BiblizouMetrics import RunMetrics
+from XmlStore import parse_xml
+from XmlCatalog import catalog_files, ZNIEFF
+from BiblizouStaging import staged
+from BiblizouTask import lancer_tache, tache_annulee, pousser_message
+
+
+def site_descriptions(root):
+    """(titre, paragraphes normalisés) de chaque site ZNIEFF de la fiche, dans l'ordre du document."""
+    for znieff_elem in root.iter('ZNIEFF'):
+        lb_zn = normalize_text(znieff_elem.findtext('LB_ZN', ''))
+        nm_sffzn = normalize_text(znieff_elem.findtext('NM_SFFZN', ''))
+        tx_gene_elem = znieff_elem.find('TX_GENE')
+
+        paragraphs = []
+        if tx_gene_elem is not None:
+            paragraphs = [normalize_text(p_elem.text) for p_elem in tx_gene_elem.findall('p')]
+        yield f"{lb_zn} - {nm_sffzn}", paragraphs
 
 
 class ZnieffXmlToDocx:
     def __init__(self, iface):
         self.iface = iface
+        self.task = None
+        self.metrics = RunMetrics('ZnieffXmlToDocx')
+
+    def push_message(self, title, text, level):
+        """Affiche un message dans la barre QGIS (différé si le traitement tourne en tâche de fond)."""
+        pousser_message(self.iface, self.task, title, text, level)
 
     def run(self):
         """Exécuter le module."""
-        try:
-            folder_path = self.obtain_folder_path()
-            if not folder_path:
-                return
-            self.process_xml_files_in_folder(folder_path)
-            self.iface.messageBar().pushMessage("Succès", "Le fichier DOCX a été généré avec succès!",
-                                                level=QgsMessageBar.INFO)
-        except Exception as e:
-            self.iface.messageBar().pushMessage("Erreur", str(e), level=QgsMessageBar.CRITICAL)
+        folder_path = self.obtain_folder_path()
+        if not folder_path:
+            return
+        lancer_tache("Biblizou : descriptions ZNIEFF (DOCX)",
+                     lambda task: staged(folder_path, lambda work_folder:
+                                         self.process_xml_files_in_folder(work_folder, task)),
+                     self.iface)
 
     def obtain_folder_path(self):
         """Ouvre un dialogue pour sélectionner un dossier contenant les fichiers XML."""
         folder = QFileDialog.getExistingDirectory(None, "Sélectionner un dossier contenant les fichiers XML")
         if not folder:
-            self.iface.messageBar().pushMessage("Info", "Aucun dossier sélectionné.", level=QgsMessageBar.WARNING)
+            self.iface.messageBar().pushMessage("Info", "Aucun dossier sélectionné.", level=Qgis.Warning)
         return folder
 
-    def xml_to_docx(self, xml_file, doc):
-        """Extrait les données des fichiers XML et les ajoute au document DOCX."""
+    def xml_to_docx(self, xml_file, builder):
+        """Extrait les descriptions des fichiers XML (textes normalisés) et les ajoute au document DOCX."""
         try:
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-
-            for znieff_elem in root.iter('ZNIEFF'):
-                nm_sffzn_elem = znieff_elem.find('NM_SFFZN')
-                lb_zn_elem = znieff_elem.find('LB_ZN')
-                tx_gene_elem = znieff_elem.find('TX_GENE')
-
-                lb_zn = lb_zn_elem.text if lb_zn_elem is not None else ''
-                nm_sffzn = nm_sffzn_elem.text if nm_sffzn_elem is not None else ''
-                combined_text = f"{lb_zn} - {nm_sffzn}"
-
-                para = doc.add_paragraph()
-                run = para.add_run(combined_text)
-                run.bold = True
-                run.underline = True
-                run.font.color.rgb = RGBColor(0, 153, 153)
-                run.font.name = 'Calibri'
-                run.font.size = Pt(11)
-
-                if tx_gene_elem is not None:
-                    for p_elem in tx_gene_elem.findall('p'):
-                        p_text = p_elem.text if p_elem is not None else ''
-                        para = doc.add_paragraph(p_text)
-                        para.paragraph_format.left_indent = Pt(28)
-                        run = para.runs[0]
-                        run.font.name = 'Calibri'
-                        run.font.size = Pt(11)
-                        run.font.color.rgb = RGBColor(0, 0, 0)
-                doc.add_paragraph('')
+            tree = parse_xml(xml_file)
+            for title, paragraphs in site_descriptions(tree.getroot()):
+                builder.add_site(title, paragraphs)
 
         except ET.ParseError as e:
-            self.iface.messageBar().pushMessage("Erreur", f"Erreur d'analyse XML dans {xml_file}: {e}",
-                                                level=QgsMessageBar.CRITICAL)
+            self.metrics.incr('files.failed')
+            self.push_message("Erreur", f"Erreur d'analyse XML dans {xml_file}: {e}", Qgis.Critical)
         except Exception as e:
-            self.iface.messageBar().pushMessage("Erreur", f"Erreur avec le fichier {xml_file}: {e}",
-                                                level=QgsMessageBar.CRITICAL)
-
-    def clean_document(self, doc):
-        """Nettoie le document en supprimant les espaces et lignes vides inutiles."""
-        for para in doc.paragraphs:
-            for run in para.runs:
-                run.text = ' '.join(run.text.split())
-            if para.text.strip() == '':
-                para.clear()
-
-    def process_xml_files_in_folder(self, folder_path):
+            self.metrics.incr('files.failed')
+            self.push_message("Erreur", f"Erreur avec le fichier {xml_file}: {e}", Qgis.Critical)
+
+    def process_xml_files_in_folder(self, folder_path, task=None):
         """Traite tous les fichiers XML d'un dossier et génère un fichier DOCX."""
+        self.task = task
+        self.metrics = RunMetrics('ZnieffXmlToDocx')
         if not os.path.isdir(folder_path):
-            self.iface.messageBar().pushMessage("Erreur", f"Le chemin {folder_path} n'est pas un dossier valide.",
-                                                level=QgsMessageBar.CRITICAL)
+            self.push_message("Erreur", f"Le chemin {folder_path} n'est pas un dossier valide.",
+                              Qgis.Critical)
             return
 
-        xml_files = [f for f in os.listdir(folder_path) if
-                     f.endswith('.xml') and not f.startswith('FR') and len(f) == 13]
+        xml_files = catalog_files(folder_path, ZNIEFF)
         if not xml_files:
-            self.iface.messageBar().pushMessage("Info", "Aucun fichier XML valide trouvé dans le dossier.",
-                                                level=QgsMessageBar.WARNING)
+            self.push_message("Info", "Aucun fichier XML valide trouvé dans le dossier.", Qgis.Warning)
             return
 
         current_time = datetime.now().strftime("%Y%m%d%H%M%S")
         docx_file = os.path.join(folder_path, f'ZNIEFF_Descriptions_des_sites_{current_time}.docx')
-        doc = Document()
+        builder = DocxBuilder()
 
-        for xml_file in xml_files:
+        for idx, xml_file in enumerate(xml_files, start=1):
+            if tache_annulee(task):
+                return
             full_path = os.path.join(folder_path, xml_file)
-            self.xml_to_docx(full_path, doc)
-
-        self.clean_document(doc)
-        doc.save(docx_file)
-        self.iface.messageBar().pushMessage("Succès", f"Document créé : {docx_file}", level=QgsMessageBar.INFO)
+            with self.metrics.span('parse'):
+                self.xml_to_docx(full_path, builder)
+            self.metrics.incr('files.parsed')
+            if task is not None:
+                task.avancer("Fichiers analysés", idx, len(xml_files))
+
+        self.metrics.incr('rows.written', builder.paragraph_count)
+        with self.metrics.span('save'):
+            builder.save(docx_file)
+        self.metrics.write_report(docx_file, folder=folder_path)
+        self.push_message("Succès", f"Document créé : {docx_file}", Qgis.Success)
+
+
+# Pour exécuter le module dans QGIS
+def run_module(iface):
+    module = ZnieffXmlToDocx(iface)
+    module.run()
+
+if __name__ in ('__main__', '__console__'):
+    run_module(iface)
@@ -9,25 +9,41 @@ Description : Module pour extraire des données d'espèces déterminantes à par
 Dépendances :
     - Python 3.x
     - QGIS (QgsMessageLog)
-    - xml.etree.ElementTree
+    - XmlBackend, XmlSchema (extraction déclarative : schéma ZNIEFF_ESPECES)
     - pandas
     - openpyxl
     - os, datetime
+    - BiblizouMetrics (rapport <fichier>.xlsx.run.json), ColumnStore (synthèses par règne)
+    - XlsxStream, BiblizouConfig (mode flux à mémoire bornée : STREAMING, STREAMING_MEMORY_MB ; présentation
+      longue : XLSX_LAYOUT)
+    - OutputBackends (CSV, Parquet, SQLite, GeoPackage, ODS selon BiblizouConfig.OUTPUT_FORMATS)
+    - RunMemo (réutilisation des livrables d'une exécution identique, BIBLIZOU_FORCE_REBUILD=1 pour tout refaire)
+    - XmlStore (fiches isolées ou archivées dans biblizou_xml.zip), XmlCatalog (type de fiche selon son contenu)
 
 Utilisation :
     Ce module doit être appelé depuis une extension QGIS.
 """
 
 from qgis.core import QgsMessageLog, Qgis
-from qgis.gui import QgsMessageBar
+from qgis.utils import iface
 from PyQt5.QtWidgets import QFileDialog
-import xml.etree.ElementTree as ET
 import pandas as pd
 import os
-from openpyxl import load_workbook
 from openpyxl.styles import Alignment, Border, Side, PatternFill, Font
 from datetime import datetime
-import time
+from BiblizouMetrics import RunMetrics
+from XmlBackend import parse_root, PARSE_ERRORS
+from XmlSchema import ZNIEFF_ESPECES
+from ColumnStore import ColumnAccumulator
+from XlsxStream import StreamingWorkbook, export_long, to_excel_rows, unique_title
+from OutputBackends import DataOutputs
+from RunMemo import fingerprint, reuse_outputs
+import BiblizouConfig
+from XmlCatalog import catalog_files, ZNIEFF
+from BiblizouStaging import staged
+from BiblizouTask import lancer_tache, tache_annulee
+
+SYNTHESES = ('Animalia', 'Plantae')  # règnes ayant un onglet de synthèse
 
 
 class ZnieffXmlToXlsxEsp:
@@ -36,6 +52,8 @@ class ZnieffXmlToXlsxEsp:
         Module d'extraction des espèces déterminantes à partir de fichiers XML ZNIEFF et exportation vers Excel.
         """
         self.iface = iface
+        self.task = None
+        self.metrics = RunMetrics('ZnieffXmlToXlsxEsp')
 
     def log(self, message, level=Qgis.Info):
         QgsMessageLog.logMessage(message, 'Biblizou_PatNat', level)
@@ -51,72 +69,191 @@ class ZnieffXmlToXlsxEsp:
 
     def xml_to_dataframe(self, xml_file):
         try:
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-            regnes, groupes, cd_noms, nom_complets, nom_vern = [], [], [], [], []
-            lb_zn, nm_sffzn = "", ""
-
-            for znieff_elem in root.iter('ZNIEFF'):
-                nm_sffzn_elem = znieff_elem.find('NM_SFFZN')
-                lb_zn_elem = znieff_elem.find('LB_ZN')
-
-                nm_sffzn = nm_sffzn_elem.text if nm_sffzn_elem is not None else ""
-                lb_zn = lb_zn_elem.text if lb_zn_elem is not None else ""
-
-                for espece_row_elem in znieff_elem.iter('ESPECE_ROW'):
-                    fg_esp_elem = espece_row_elem.find('FG_ESP')
-                    if fg_esp_elem is not None and fg_esp_elem.text == 'D':
-                        regnes.append(espece_row_elem.findtext('REGNE', ""))
-                        groupes.append(espece_row_elem.findtext('GROUPE', ""))
-                        cd_noms.append(espece_row_elem.findtext('CD_NOM', ""))
-                        nom_complets.append(espece_row_elem.findtext('NOM_COMPLET', ""))
-                        nom_vern.append(espece_row_elem.findtext('NOM_VERN', ""))
-
-            data = {'REGNE': regnes, 'GROUPE': groupes, 'CD_NOM': cd_noms, 'NOM_COMPLET': nom_complets,
-                    'NOM_VERN': nom_vern}
-            df = pd.DataFrame(data)
-            return df, lb_zn, nm_sffzn
-        except ET.ParseError as e:
+            df, site = ZNIEFF_ESPECES.compile().frame(parse_root(xml_file))
+            return df, site['LB_ZN'], site['NM_SFFZN']
+        except PARSE_ERRORS as e:
+            self.metrics.incr('files.failed')
             self.log(f"Erreur de parsing XML : {e}", Qgis.Critical)
             return pd.DataFrame(), "", ""
         except Exception as e:
+            self.metrics.incr('files.failed')
             self.log(f"Erreur inattendue : {e}", Qgis.Critical)
             return pd.DataFrame(), "", ""
 
-    def process_xml_files_in_folder(self, folder_path):
+    def process_xml_files_in_folder(self, folder_path, task=None):
+        self.task = task
+        self.metrics = RunMetrics('ZnieffXmlToXlsxEsp')
         if not os.path.isdir(folder_path):
             self.log(f"Le chemin {folder_path} n'est pas un répertoire valide.", Qgis.Warning)
             return
 
-        xml_files = [f for f in os.listdir(folder_path) if f.endswith('.xml')]
-        nm_sffzn_data, animalia_data, plantae_data = {}, [], []
+        xml_files = catalog_files(folder_path, ZNIEFF)
+        excel_file = self.output_file(folder_path)
+        # Exécution identique déjà faite (mêmes fiches, mêmes options) : livrables recopiés
+        key = fingerprint('ZnieffXmlToXlsxEsp', folder_path, xml_files)
+        reused = reuse_outputs(folder_path, key, excel_file, self.metrics)
+        if reused:
+            self.log(f"Données inchangées, livrables réutilisés : {', '.join(reused)}")
+            return
+
+        def frames():
+            for xml_file in xml_files:
+                with self.metrics.span('parse'):
+                    parsed = self.xml_to_dataframe(os.path.join(folder_path, xml_file))
+                self.metrics.incr('files.parsed')
+                yield parsed
+
+        if self.export_frames(frames(), excel_file, task, len(xml_files)):
+            self.metrics.write_report(excel_file, folder=folder_path, fingerprint=key)
+
+    def output_file(self, folder_path):
         current_time = datetime.now().strftime("%Y%m%d%H%M%S")
-        excel_file = os.path.join(folder_path, f'ZNIEFF_synthèse_des_esp_déterminantes_{current_time}.xlsx')
+        return os.path.join(folder_path, f'ZNIEFF_synthèse_des_esp_déterminantes_{current_time}.xlsx')
+
+    def reuse_previous(self, folder_path):
+        """Réutilisation vérifiée dans le dossier d'origine, avant sa copie en local (staged) : fichiers
+        recopiés, liste vide s'il faut lancer le traitement."""
+        self.metrics = RunMetrics('ZnieffXmlToXlsxEsp')
+        key = fingerprint('ZnieffXmlToXlsxEsp', folder_path, catalog_files(folder_path, ZNIEFF))
+        reused = reuse_outputs(folder_path, key, self.output_file(folder_path), self.metrics)
+        if reused:
+            self.log(f"Données inchangées, livrables réutilisés : {', '.join(reused)}")
+        return reused
+
+    def site_columns(self, lb_zn, nm_sffzn):
+        """Colonnes propres au site dans les tables au format long."""
+        return {'ID_MNHN': nm_sffzn, 'NOM_SITE': lb_zn}
+
+    def export_frames(self, frames, excel_file, task=None, total=None):
+        """Exporte un itérable de (df, lb_zn, nm_sffzn), consommé au fil de l'eau, dans les formats demandés
+        (BiblizouConfig.OUTPUT_FORMATS) : classeur XLSX (export_xlsx) et/ou tables de données (OutputBackends).
+
+        Utilisé par process_xml_files_in_folder et par la chaîne téléchargement -> export (ZnieffDwlXml)."""
+        try:
+            with DataOutputs(excel_file, 'especes_determinantes', self.metrics) as outputs:
+                frames = outputs.mirror(frames, lambda df, lb_zn, nm_sffzn: (df, self.site_columns(lb_zn, nm_sffzn)))
+                if outputs.xlsx:
+                    done = self.export_xlsx(frames, excel_file, task, total)
+                else:
+                    done = outputs.drain(frames, task, total)
+                if not done:
+                    outputs.discard()
+                elif outputs.paths:
+                    self.log(f"Tables exportées : {', '.join(outputs.paths)}")
+                return done
+        except Exception as e:
+            self.log(f"Erreur d'écriture des tables : {e}", Qgis.Critical)
+            return False
 
+    def export_xlsx(self, frames, excel_file, task=None, total=None):
+        """Écrit le classeur à partir d'un itérable de (df, lb_zn, nm_sffzn), consommé au fil de l'eau.
+
+        Chaque site est écrit dès sa réception ; seule la synthèse, en colonnes, reste en mémoire.
+        Pour les lots importants (BiblizouConfig.STREAMING), voir export_xlsx_streaming ; avec
+        BiblizouConfig.XLSX_LAYOUT = 'long', une seule table filtrable est écrite (XlsxStream.export_long)."""
+        if BiblizouConfig.XLSX_LAYOUT == 'long':
+            try:
+                sites = ((df, self.site_columns(lb_zn, nm_sffzn)) for df, lb_zn, nm_sffzn in frames)
+                with self.metrics.span('write'):
+                    return export_long(sites, excel_file, task, total, self.metrics)
+            except Exception as e:
+                self.log(f"Erreur d'écriture dans le fichier Excel : {e}", Qgis.Critical)
+                return False
+        mode = BiblizouConfig.STREAMING
+        if mode == 'always' or (mode == 'auto' and (total or 0) >= BiblizouConfig.STREAMING_MIN_FILES):
+            return self.export_xlsx_streaming(frames, excel_file, task, total)
+        synthese = ColumnAccumulator(ZNIEFF_ESPECES.columns, encoded=['REGNE', 'GROUPE'])
+        # Un onglet par fiche : deux sites au nom tronqué identique ne s'écrasent pas
+        titles = {f"Synthèse {regne}".casefold() for regne in SYNTHESES}
         try:
             with pd.ExcelWriter(excel_file, engine='openpyxl') as writer:
-                for xml_file in xml_files:
-                    df, lb_zn, nm_sffzn = self.xml_to_dataframe(os.path.join(folder_path, xml_file))
-                    if not df.empty:
-                        nm_sffzn_data.setdefault(nm_sffzn, []).append(df)
-                        animalia_data.extend(df[df['REGNE'] == "Animalia"].to_dict('records'))
-                        plantae_data.extend(df[df['REGNE'] == "Plantae"].to_dict('records'))
-
-                for nm_sffzn, dfs in nm_sffzn_data.items():
-                    combined_df = pd.concat(dfs, ignore_index=True).sort_values(by=['GROUPE', 'NOM_COMPLET'])
-                    sheet_name = self.truncate_sheet_name(f"{nm_sffzn} - {lb_zn}")
-                    combined_df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-                if animalia_data:
-                    pd.DataFrame(animalia_data).to_excel(writer, sheet_name="Synthèse Animalia", index=False)
-                if plantae_data:
-                    pd.DataFrame(plantae_data).to_excel(writer, sheet_name="Synthèse Plantae", index=False)
+                for idx, (df, lb_zn, nm_sffzn) in enumerate(frames, start=1):
+                    if tache_annulee(task):
+                        break
+                    if task is not None and total:
+                        task.avancer("Fichiers analysés", idx, total)
+                    if df.empty:
+                        continue
+                    with self.metrics.span('synthese'):
+                        synthese.append(df)
+                    sheet_name = unique_title(f"{nm_sffzn} - {lb_zn}", titles)
+                    with self.metrics.span('write'):
+                        df.sort_values(by=['GROUPE', 'NOM_COMPLET']).to_excel(writer, sheet_name=sheet_name,
+                                                                              index=False)
+                    self.metrics.incr('rows.written', len(df))
+
+                with self.metrics.span('write'):
+                    for regne, rows in synthese.finalize().groupby('REGNE', observed=True):
+                        if regne in SYNTHESES:
+                            to_excel_rows(rows, writer, f"Synthèse {regne}", index=False)
+                            self.metrics.incr('rows.written', len(rows))
 
+            if tache_annulee(task):
+                os.remove(excel_file)
+                return False
             self.log(f"Exportation terminée : {excel_file}")
+            return True
         except Exception as e:
             self.log(f"Erreur d'écriture dans le fichier Excel : {e}", Qgis.Critical)
+            return False
+
+    def export_xlsx_streaming(self, frames, excel_file, task=None, total=None):
+        """Variante à mémoire bornée d'export_xlsx : les onglets partent aussitôt sur disque (XlsxStream) et
+        la synthèse, entièrement codée, est déversée au-delà de BiblizouConfig.STREAMING_MEMORY_MB."""
+        synthese = ColumnAccumulator(ZNIEFF_ESPECES.columns, encoded=ZNIEFF_ESPECES.columns,
+                                     memory_limit=BiblizouConfig.STREAMING_MEMORY_MB * 2 ** 20)
+        self.log(f"Export en flux (mémoire bornée à {BiblizouConfig.STREAMING_MEMORY_MB} Mo) : {excel_file}")
+        titles = {f"Synthèse {regne}".casefold() for regne in SYNTHESES}
+        try:
+            with StreamingWorkbook(excel_file) as workbook:
+                for idx, (df, lb_zn, nm_sffzn) in enumerate(frames, start=1):
+                    if tache_annulee(task):
+                        break
+                    if task is not None and total:
+                        task.avancer("Fichiers analysés", idx, total)
+                    if df.empty:
+                        continue
+                    with self.metrics.span('synthese'):
+                        synthese.append(df)
+                    with self.metrics.span('write'):
+                        workbook.append_frame(unique_title(f"{nm_sffzn} - {lb_zn}", titles),
+                                              df.sort_values(by=['GROUPE', 'NOM_COMPLET']))
+                    self.metrics.incr('rows.written', len(df))
+
+                if not tache_annulee(task):
+                    with self.metrics.span('write'):
+                        for regne in SYNTHESES:
+                            for block in synthese.iter_frames():
+                                rows = block[block['REGNE'] == regne]
+                                if not rows.empty:
+                                    workbook.append_frame(f"Synthèse {regne}", rows)
+                                    self.metrics.incr('rows.written', len(rows))
+            if tache_annulee(task):
+                os.remove(excel_file)
+                return False
+            self.log(f"Exportation terminée : {excel_file}")
+            return True
+        except Exception as e:
+            self.log(f"Erreur d'écriture dans le fichier Excel : {e}", Qgis.Critical)
+            return False
+        finally:
+            self.metrics.incr('synthese.spilled', len(synthese.spilled))
+            synthese.close()
 
     def run(self):
         folder_path = self.obtain_folder_path()
         if folder_path:
-            self.process_xml_files_in_folder(folder_path)
+            lancer_tache("Biblizou : espèces déterminantes ZNIEFF (XLSX)",
+                         lambda task: staged(folder_path, lambda work_folder:
+                                             self.process_xml_files_in_folder(work_folder, task),
+                                             reuse=self.reuse_previous),
+                         self.iface)
+
+# Pour exécuter le module dans QGIS
+def run_module(iface):
+    module = ZnieffXmlToXlsxEsp(iface)
+    module.run()
+
+if __name__ in ('__main__', '__console__'):
+    run_module(iface)
+
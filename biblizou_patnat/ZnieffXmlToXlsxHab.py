@@ -9,29 +9,59 @@ Description : Module pour extraire des données d'habitats déterminants à part
 Dépendances :
     - Python 3.x
     - QGIS (QgsMessageLog)
-    - xml.etree.ElementTree
+    - XmlBackend, XmlSchema (extraction déclarative : schéma ZNIEFF_HABITATS)
     - pandas
     - openpyxl
     - os, datetime
+    - BiblizouMetrics (rapport <fichier>.xlsx.run.json)
+    - XlsxStream (écriture en flux aux limites d'Excel ; présentation longue, BiblizouConfig.XLSX_LAYOUT = 'long')
+    - OutputBackends (CSV, Parquet, SQLite, GeoPackage, ODS selon BiblizouConfig.OUTPUT_FORMATS)
+    - RunMemo (réutilisation des livrables d'une exécution identique, BIBLIZOU_FORCE_REBUILD=1 pour tout refaire)
+    - XmlStore (fiches isolées ou archivées dans biblizou_xml.zip), XmlCatalog (type de fiche selon son contenu)
 
 Utilisation :
     Ce module doit être appelé depuis une extension QGIS.
 """
 
-from qgis.core import QgsMessageLog
+from qgis.core import QgsMessageLog, Qgis
 from qgis.gui import QgsMessageBar
+from qgis.utils import iface
 from PyQt5.QtWidgets import QFileDialog, QDialog
-import xml.etree.ElementTree as ET
 import pandas as pd
 import os
 from openpyxl.styles import Alignment, Border, Side, PatternFill, Font
-from openpyxl import load_workbook
 from datetime import datetime
+from BiblizouMetrics import RunMetrics
+from XmlBackend import parse_root, PARSE_ERRORS
+from XmlSchema import ZNIEFF_HABITATS
+from XmlCatalog import catalog_files, ZNIEFF
+from XlsxStream import StreamingWorkbook, export_long, unique_title
+from OutputBackends import DataOutputs
+from RunMemo import fingerprint, reuse_outputs, deliverables
+import BiblizouConfig
+from BiblizouStaging import staged
+from BiblizouTask import lancer_tache, tache_annulee, pousser_message
+
+
+# Mise en forme Biblizou : en-tête blanc sur fond sarcelle, cellules bordées, présences ('X') surlignées
+HEADER_FONT = Font(name='Calibri', bold=True, color="FFFFFF", size=10)
+HEADER_FILL = PatternFill(start_color="009999", end_color="009999", fill_type="solid")
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='center')
+CELL_FONT = Font(color="000000", size=9)
+CELL_ALIGNMENT = Alignment(horizontal='left', vertical='center')
+CELL_BORDER = Border(left=Side(style='thin', color="D9D9D9"), right=Side(style='thin', color="D9D9D9"),
+                     top=Side(style='thin', color="D9D9D9"), bottom=Side(style='thin', color="D9D9D9"))
+PRESENCE_FILL = PatternFill(start_color="91d2ff", end_color="91d2ff", fill_type="solid")
 
 
 class ZnieffXmlToXlsxHab:
     def __init__(self, iface):
         self.iface = iface
+        self.task = None
+        self.metrics = RunMetrics('ZnieffXmlToXlsxHab')
+
+    def push_message(self, title, text, level):
+        pousser_message(self.iface, self.task, title, text, level)
 
     def run(self):
         # Demander à l'utilisateur de choisir un dossier contenant les fichiers XML
@@ -40,93 +70,145 @@ class ZnieffXmlToXlsxHab:
             self.iface.messageBar().pushMessage("Annulation", "Aucun dossier sélectionné.", level=Qgis.Info)
             return
 
-        self.process_xml_files_in_folder(folder_path)
+        lancer_tache("Biblizou : habitats déterminants ZNIEFF (XLSX)",
+                     lambda task: staged(folder_path, lambda work_folder:
+                                         self.process_xml_files_in_folder(work_folder, task),
+                                         reuse=self.reuse_previous),
+                     self.iface)
 
     def truncate_sheet_name(self, sheet_name):
         return sheet_name[:31]
 
     def xml_to_dataframe(self, xml_file):
         try:
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
-            lb_codes, lb_habs, lb_zn, nm_sffzn = [], [], "", ""
-
-            for znieff_elem in root.iter('ZNIEFF'):
-                nm_sffzn_elem = znieff_elem.find('NM_SFFZN')
-                lb_zn_elem = znieff_elem.find('LB_ZN')
-                if nm_sffzn_elem is not None:
-                    nm_sffzn = nm_sffzn_elem.text
-                if lb_zn_elem is not None:
-                    lb_zn = lb_zn_elem.text
-                for typo_info_row_elem in znieff_elem.iter('TYPO_INFO_ROW'):
-                    fg_typo_elem = typo_info_row_elem.find('FG_TYPO')
-                    if fg_typo_elem is not None and fg_typo_elem.text == 'D':
-                        for lb_code_elem in typo_info_row_elem.iter('LB_CODE'):
-                            lb_codes.append(lb_code_elem.text)
-                        for lb_hab_elem in typo_info_row_elem.iter('LB_HAB'):
-                            lb_habs.append(lb_hab_elem.text)
-
-            data = {'LB_CODE': lb_codes, 'LB_HAB': lb_habs}
-            df = pd.DataFrame(data)
-            return df, lb_zn, nm_sffzn
-        except ET.ParseError as e:
+            df, site = ZNIEFF_HABITATS.compile().frame(parse_root(xml_file))
+            return df, site['LB_ZN'], site['NM_SFFZN']
+        except PARSE_ERRORS as e:
+            self.metrics.incr('files.failed')
             QgsMessageLog.logMessage(f"Erreur de parsing XML: {xml_file} - {e}", "Biblizou", level=Qgis.Critical)
-            return pd.DataFrame(columns=['LB_CODE', 'LB_HAB']), "", ""
+            return ZNIEFF_HABITATS.empty(), "", ""
         except Exception as e:
+            self.metrics.incr('files.failed')
             QgsMessageLog.logMessage(f"Erreur inattendue avec {xml_file}: {e}", "Biblizou", level=Qgis.Critical)
-            return pd.DataFrame(columns=['LB_CODE', 'LB_HAB']), "", ""
+            return ZNIEFF_HABITATS.empty(), "", ""
 
-    def process_xml_files_in_folder(self, folder_path):
-        if not os.path.isdir(folder_path):
-            self.iface.messageBar().pushMessage("Erreur", "Le chemin sélectionné n'est pas un dossier valide.",
-                                                level=Qgis.Warning)
+    def style_cell(self, cell, header):
+        """Mise en forme Biblizou d'une cellule, appliquée pendant l'écriture du classeur (StreamingWorkbook)."""
+        if header:
+            cell.font, cell.fill, cell.alignment = HEADER_FONT, HEADER_FILL, HEADER_ALIGNMENT
             return
+        cell.font, cell.alignment, cell.border = CELL_FONT, CELL_ALIGNMENT, CELL_BORDER
+        if cell.value == 'X':
+            cell.fill = PRESENCE_FILL
+
+    def parsed_sites(self, folder_path, xml_files):
+        """(df, {'ID_MNHN', 'NOM_SITE'}) de chaque fiche, pour la présentation longue."""
+        for xml_file in xml_files:
+            with self.metrics.span('parse'):
+                df, lb_zn, nm_sffzn = self.xml_to_dataframe(os.path.join(folder_path, xml_file))
+            self.metrics.incr('files.parsed')
+            yield df, {'ID_MNHN': nm_sffzn, 'NOM_SITE': lb_zn}
 
-        xml_files = [f for f in os.listdir(folder_path) if
-                     f.endswith('.xml') and not f.startswith('FR') and len(f) == 13]
-        unique_lb_codes, unique_lb_habs = set(), set()
-        hab_presence = {}
+    def output_file(self, folder_path):
         current_time = datetime.now().strftime("%Y%m%d%H%M%S")
-        excel_file = os.path.join(folder_path, f'ZNIEFF_synthèse_des_habitats_déterminants_{current_time}.xlsx')
+        return os.path.join(folder_path, f'ZNIEFF_synthèse_des_habitats_déterminants_{current_time}.xlsx')
+
+    def reuse_previous(self, folder_path):
+        """Réutilisation vérifiée dans le dossier d'origine, avant sa copie en local (staged) : fichiers
+        recopiés, liste vide s'il faut lancer le traitement."""
+        self.metrics = RunMetrics('ZnieffXmlToXlsxHab')
+        key = fingerprint('ZnieffXmlToXlsxHab', folder_path, catalog_files(folder_path, ZNIEFF))
+        reused = reuse_outputs(folder_path, key, self.output_file(folder_path), self.metrics)
+        if reused:
+            self.push_message("Succès", f"Données inchangées, livrables réutilisés : {', '.join(reused)}",
+                              Qgis.Success)
+        return reused
+
+    def process_xml_files_in_folder(self, folder_path, task=None):
+        self.task = task
+        self.metrics = RunMetrics('ZnieffXmlToXlsxHab')
+        if not os.path.isdir(folder_path):
+            self.push_message("Erreur", "Le chemin sélectionné n'est pas un dossier valide.", Qgis.Warning)
+            return
+
+        xml_files = catalog_files(folder_path, ZNIEFF)
+        excel_file = self.output_file(folder_path)
 
         try:
-            with pd.ExcelWriter(excel_file, engine='openpyxl') as writer:
-                for xml_file in xml_files:
-                    full_path = os.path.join(folder_path, xml_file)
-                    df, lb_zn, nm_sffzn = self.xml_to_dataframe(full_path)
-                    if not df.empty:
-                        unique_lb_codes.update(df['LB_CODE'].unique())
-                        unique_lb_habs.update(df['LB_HAB'].unique())
-                        sheet_name = f"{nm_sffzn} - {lb_zn}"
-                        sheet_name_truncated = self.truncate_sheet_name(sheet_name)
-                        hab_presence[sheet_name_truncated] = set(df['LB_HAB'])
-                        df.to_excel(writer, sheet_name=sheet_name_truncated, index=False)
-                summary_data = {'LB_CODE': list(unique_lb_codes), 'LB_HAB': list(unique_lb_habs)}
-                for sheet_name in hab_presence:
-                    summary_data[sheet_name] = ['X' if hab in hab_presence[sheet_name] else '' for hab in
-                                                summary_data['LB_HAB']]
-                summary_df = pd.DataFrame(summary_data)
-                summary_df.to_excel(writer, sheet_name='Synthèse', index=False)
-            wb = load_workbook(excel_file)
-            for sheet_name in wb.sheetnames:
-                ws = wb[sheet_name]
-                for cell in ws[1]:
-                    cell.font = Font(name='Calibri', bold=True, color="FFFFFF", size=10)
-                    cell.fill = PatternFill(start_color="009999", end_color="009999", fill_type="solid")
-                    cell.alignment = Alignment(horizontal='center', vertical='center')
-                for row in ws.iter_rows(min_row=2):
-                    for cell in row:
-                        cell.font = Font(color="000000", size=9)
-                        cell.alignment = Alignment(horizontal='left', vertical='center')
-                        cell.border = Border(left=Side(style='thin', color="D9D9D9"),
-                                             right=Side(style='thin', color="D9D9D9"),
-                                             top=Side(style='thin', color="D9D9D9"),
-                                             bottom=Side(style='thin', color="D9D9D9"))
-                        if cell.value == 'X':
-                            cell.fill = PatternFill(start_color="91d2ff", end_color="91d2ff", fill_type="solid")
-                if sheet_name != 'Synthèse':
-                    ws.sheet_state = 'hidden'
-            wb.save(excel_file)
-            self.iface.messageBar().pushMessage("Succès", f"Données exportées dans {excel_file}", level=Qgis.Success)
+            # Exécution identique déjà faite (mêmes fiches, mêmes options) : livrables recopiés
+            key = fingerprint('ZnieffXmlToXlsxHab', folder_path, xml_files)
+            reused = reuse_outputs(folder_path, key, excel_file, self.metrics)
+            if reused:
+                self.push_message("Succès", f"Données inchangées, livrables réutilisés : {', '.join(reused)}",
+                                  Qgis.Success)
+                return
+            # Formats demandés (BiblizouConfig.OUTPUT_FORMATS) : tables de données écrites pendant la lecture
+            if not self.export_sites(self.parsed_sites(folder_path, xml_files), excel_file, task, len(xml_files)):
+                return
+            self.metrics.write_report(excel_file, folder=folder_path, fingerprint=key)
+            self.push_message("Succès", f"Données exportées dans {', '.join(deliverables(excel_file))}",
+                              Qgis.Success)
         except Exception as e:
-            self.iface.messageBar().pushMessage("Erreur", f"Problème lors de l'export Excel : {e}", level=Qgis.Critical)
+            self.push_message("Erreur", f"Problème lors de l'export : {e}", Qgis.Critical)
+
+    def export_sites(self, sites, excel_file, task=None, total=None):
+        """Exporte un itérable de (df, {colonne du site: valeur}), consommé au fil de l'eau, dans les formats
+        demandés (BiblizouConfig.OUTPUT_FORMATS) : classeur XLSX (export_xlsx) et/ou tables de données
+        (OutputBackends). Utilisé par process_xml_files_in_folder et par XmlToDeliverables."""
+        with DataOutputs(excel_file, 'habitats_determinants', self.metrics) as outputs:
+            sites = outputs.mirror(sites)
+            if outputs.xlsx:
+                done = self.export_xlsx(sites, excel_file, task, total)
+            else:
+                done = outputs.drain(sites, task, total)
+            if not done:
+                outputs.discard()
+            return done
+
+    def export_xlsx(self, sites, excel_file, task=None, total=None):
+        """Classeur mis en forme (un onglet par site et synthèse, ou table longue) à partir d'un itérable de
+        (df, {'ID_MNHN', 'NOM_SITE'}) ; False si la tâche a été annulée."""
+        if BiblizouConfig.XLSX_LAYOUT == 'long':
+            return export_long(sites, excel_file, task, total, self.metrics)
+        habitats = set()     # couples (LB_CODE, LB_HAB) rencontrés
+        hab_presence = {}    # onglet : couples présents sur le site
+        titles = {'synthèse'}  # un onglet par fiche, sans fusionner deux sites au nom tronqué identique
+        # Mise en forme pendant l'écriture ; seuls les onglets de synthèse restent visibles
+        with StreamingWorkbook(excel_file, style=self.style_cell,
+                               hide=lambda sheet_name: not sheet_name.startswith('Synthèse')) as workbook:
+            for idx, (df, site) in enumerate(sites, start=1):
+                if tache_annulee(task):
+                    break
+                if task is not None:
+                    task.avancer("Fichiers analysés", idx, total)
+                if not df.empty:
+                    pairs = set(df[['LB_CODE', 'LB_HAB']].drop_duplicates().itertuples(index=False, name=None))
+                    habitats.update(pairs)
+                    sheet_name = unique_title(f"{site['ID_MNHN']} - {site['NOM_SITE']}", titles)
+                    hab_presence[sheet_name] = pairs
+                    with self.metrics.span('write'):
+                        workbook.append_frame(sheet_name, df)
+                    self.metrics.incr('rows.written', len(df))
+            # Code et libellé restent appariés : une ligne par couple, présence lue sur le couple
+            habitats = sorted(habitats)
+            summary_data = {'LB_CODE': [code for code, _ in habitats], 'LB_HAB': [hab for _, hab in habitats]}
+            for sheet_name, present in hab_presence.items():
+                summary_data[sheet_name] = ['X' if pair in present else '' for pair in habitats]
+            with self.metrics.span('synthese'):
+                summary_df = pd.DataFrame(summary_data)
+                # Une colonne par site : transposée ou répartie au-delà de 16 384 colonnes (XlsxStream)
+                workbook.append_wide('Synthèse', summary_df, key_columns=2)
+            self.metrics.incr('rows.written', len(summary_df))
+        if tache_annulee(task):
+            os.remove(excel_file)
+            return False
+        return True
+
+# Pour exécuter le module dans QGIS
+def run_module(iface):
+    module = ZnieffXmlToXlsxHab(iface)
+    module.run()
+
+if __name__ in ('__main__', '__console__'):
+    run_module(iface)
+
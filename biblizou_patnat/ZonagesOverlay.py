@@ -0,0 +1,204 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : ZonagesOverlay.py
+Groupe : Biblizou_PatNat
+Description : Algorithme de traitement QGIS qui croise en une seule passe les zonages ZNIEFF1, ZNIEFF2, SIC
+    et ZPS avec l'aire d'étude et écrit les identifiants et géométries découpées dans un GeoPackage unique.
+    Remplace les quatre native:intersection, les deux native:mergevectorlayers et les couches temporaires
+    du modèle _old/02_qgis_intersect_and_export.py.
+Dépendances :
+    - Python 3.x
+    - QGIS (QgsProcessingAlgorithm, QgsVectorFileWriter)
+    - GeometryCache
+
+Utilisation :
+    Depuis la console Python de QGIS :
+        run_module(iface)   # ouvre la boîte de dialogue de l'algorithme
+    ou en script :
+        import processing
+        processing.run(ZonagesOverlayAlgorithm(), {'AIRE_ETUDE': couche, 'OUTPUT': 'zonages.gpkg'})
+
+    Chaque zonage est facultatif : par défaut, les couches « Patrinat : ZNIEFF1 », « Patrinat : ZNIEFF2 »,
+    « Patrinat : SIC » et « Patrinat : ZPS » du projet sont utilisées si elles existent.
+    Couche produite « zonages » (MultiPolygon, SCR de l'aire d'étude) :
+        zonage (texte), id_mnhn (texte), nom (texte), surface_site_ha (réel), surface_ae_ha (réel)
+"""
+
+from qgis.core import (
+    QgsProject,
+    QgsGeometry,
+    QgsFeature,
+    QgsField,
+    QgsFields,
+    QgsWkbTypes,
+    QgsFeatureRequest,
+    QgsVectorFileWriter,
+    QgsCoordinateTransform,
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterFileDestination
+)
+from qgis.PyQt.QtCore import QVariant
+from qgis.utils import iface
+from GeometryCache import StudyArea
+
+ZONAGES = (
+    ('ZNIEFF1', 'Patrinat : ZNIEFF1'),
+    ('ZNIEFF2', 'Patrinat : ZNIEFF2'),
+    ('SIC', 'Patrinat : SIC'),
+    ('ZPS', 'Patrinat : ZPS'),
+)
+ID_FIELDS = ('id_mnhn', 'sitecode')
+NAME_FIELDS = ('nom', 'nom_site', 'sitename', 'lb_zn')
+
+
+def find_field(layer, candidates):
+    """Nom du premier champ de la couche correspondant (sans tenir compte de la casse) à l'un des candidats."""
+    names = {field.name().lower(): field.name() for field in layer.fields()}
+    for candidate in candidates:
+        if candidate in names:
+            return names[candidate]
+    return None
+
+
+def polygon_parts(geometry):
+    """Parties surfaciques d'une intersection (les contacts réduits à des lignes ou des points sont écartés),
+    ou None s'il n'en reste aucune."""
+    if QgsWkbTypes.flatType(geometry.wkbType()) == QgsWkbTypes.GeometryCollection:
+        parts = [part for part in geometry.asGeometryCollection() if part.type() == QgsWkbTypes.PolygonGeometry]
+        geometry = QgsGeometry.collectGeometry(parts) if parts else QgsGeometry()
+    if geometry.isEmpty() or geometry.type() != QgsWkbTypes.PolygonGeometry:
+        return None
+    return geometry
+
+
+def output_fields():
+    fields = QgsFields()
+    fields.append(QgsField('zonage', QVariant.String, len=10))
+    fields.append(QgsField('id_mnhn', QVariant.String, len=20))
+    fields.append(QgsField('nom', QVariant.String, len=254))
+    fields.append(QgsField('surface_site_ha', QVariant.Double, len=12, prec=2))
+    fields.append(QgsField('surface_ae_ha', QVariant.Double, len=12, prec=2))
+    return fields
+
+
+class ZonagesOverlayAlgorithm(QgsProcessingAlgorithm):
+    AIRE_ETUDE = 'AIRE_ETUDE'
+    OUTPUT = 'OUTPUT'
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(self.AIRE_ETUDE, "Aire d'étude",
+                                                              types=[QgsProcessing.TypeVectorPolygon]))
+        for key, layer_name in ZONAGES:
+            layers = QgsProject.instance().mapLayersByName(layer_name)
+            self.addParameter(QgsProcessingParameterFeatureSource(key, key, types=[QgsProcessing.TypeVectorPolygon],
+                                                                  defaultValue=layers[0].id() if layers else None,
+                                                                  optional=True))
+        self.addParameter(QgsProcessingParameterFileDestination(self.OUTPUT, "Zonages (GeoPackage)",
+                                                                fileFilter='GeoPackage (*.gpkg *.GPKG)'))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        # Sources de traitement plutôt que couches du projet : lues sans risque depuis le fil de Processing
+        aire_etude = self.parameterAsSource(parameters, self.AIRE_ETUDE, context)
+        if aire_etude is None:
+            raise QgsProcessingException("Aire d'étude introuvable.")
+        output = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+        sources = [(key, self.parameterAsSource(parameters, key, context)) for key, _ in ZONAGES]
+        sources = [(key, source) for key, source in sources if source is not None]
+        if not sources:
+            raise QgsProcessingException("Aucune couche de zonage fournie.")
+        # Aire d'étude fusionnée une fois, reprojetée puis préparée pour chaque zonage (StudyArea)
+        geometries = [feature.geometry() for feature in aire_etude.getFeatures() if feature.hasGeometry()]
+        if not geometries:
+            raise QgsProcessingException("L'aire d'étude ne contient aucune géométrie.")
+        dissolved = QgsGeometry.unaryUnion(geometries)
+        output_crs = aire_etude.sourceCrs()
+
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = 'GPKG'
+        options.layerName = 'zonages'
+        fields = output_fields()
+        writer = QgsVectorFileWriter.create(output, fields, QgsWkbTypes.MultiPolygon, output_crs,
+                                            context.transformContext(), options)
+        if writer.hasError() != QgsVectorFileWriter.NoError:
+            raise QgsProcessingException(f"Écriture impossible dans {output} : {writer.errorMessage()}")
+
+        total = sum(max(source.featureCount(), 0) for _, source in sources) or 1
+        done = 0
+        counts = {}
+        for key, source in sources:
+            geometry = QgsGeometry(dissolved)
+            if source.sourceCrs() != output_crs:
+                geometry.transform(QgsCoordinateTransform(output_crs, source.sourceCrs(), context.transformContext()))
+            area = StudyArea(geometry)
+            to_output = QgsCoordinateTransform(source.sourceCrs(), output_crs, context.transformContext())
+            id_field, name_field = find_field(source, ID_FIELDS), find_field(source, NAME_FIELDS)
+            counts[key] = 0
+
+            request = QgsFeatureRequest().setFilterRect(area.bbox)
+            request.setInvalidGeometryCheck(QgsFeatureRequest.GeometrySkipInvalid)
+            for feature in source.getFeatures(request):
+                if feedback.isCanceled():
+                    del writer
+                    return {}
+                done += 1
+                geometry = feature.geometry()
+                if not area.intersects(geometry):
+                    continue
+                clipped = polygon_parts(geometry.intersection(area.geometry))
+                if clipped is None:
+                    continue
+                surface_site = geometry.area() / 10000
+                clipped.transform(to_output)
+                clipped.convertToMultiType()
+
+                out = QgsFeature(fields)
+                out.setGeometry(clipped)
+                out.setAttributes([key,
+                                   str(feature[id_field]) if id_field else None,
+                                   str(feature[name_field]) if name_field else None,
+                                   round(surface_site, 2),
+                                   round(clipped.area() / 10000, 2)])
+                if not writer.addFeature(out):
+                    message = writer.errorMessage()
+                    del writer
+                    raise QgsProcessingException(f"Écriture impossible dans {output} : {message}")
+                counts[key] += 1
+            feedback.setProgress(100 * done / total)
+            feedback.pushInfo(f"{key} : {counts[key]} zonage(s) dans l'aire d'étude.")
+
+        del writer
+        return {self.OUTPUT: output, 'COUNTS': counts}
+
+    def name(self):
+        return 'zonagesoverlay'
+
+    def displayName(self):
+        return "Zonages dans l'aire d'étude (ZNIEFF / Natura 2000)"
+
+    def group(self):
+        return 'Biblizou_PatNat'
+
+    def groupId(self):
+        return 'biblizou_patnat'
+
+    def shortHelpString(self):
+        return ("Croise en une passe les zonages ZNIEFF1, ZNIEFF2, SIC et ZPS avec l'aire d'étude et écrit "
+                "identifiants, noms, surfaces et géométries découpées dans une couche GeoPackage « zonages ».")
+
+    def createInstance(self):
+        return ZonagesOverlayAlgorithm()
+
+
+# Pour exécuter le module dans QGIS
+def run_module(iface):
+    import processing
+    processing.execAlgorithmDialog(ZonagesOverlayAlgorithm())
+
+if __name__ in ('__main__', '__console__'):
+    run_module(iface)
@@ -0,0 +1,304 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : ZonagesTable.py
+Groupe : Biblizou_PatNat
+Description : Tableau des zonages ZNIEFF / Natura 2000 autour de l'aire d'étude : type, surface, distance,
+    azimut et orientation, nombre d'espèces et d'habitats issus des fiches XML (liste _TO_DO.py).
+    Les géométries sont extraites une seule fois, puis surfaces, distances et azimuts sont calculés
+    en bloc avec Shapely 2 / NumPy au lieu d'appels de géométrie QGIS entité par entité.
+Dépendances :
+    - Python 3.x
+    - QGIS (QgsProject, QgsMessageLog)
+    - shapely >= 2.0, numpy, pandas, openpyxl
+    - GeometryCache, ZonagesOverlay, BiblizouTask, BiblizouMetrics
+
+Utilisation :
+    Ce module doit être appelé depuis une extension QGIS : choix de la couche d'aire d'étude et du dossier
+    des fiches XML, puis écriture de Zonages_distances_<date>.xlsx dans ce dossier.
+
+    Classement par aires d'étude emboîtées (AE immédiate / rapprochée / éloignée), utilisé par les
+    téléchargeurs (run_module(rings=True)) : ask_rings() demande soit une couche par aire, soit une couche
+    et des distances tampon, puis ring_table() affecte chaque zonage à l'aire la plus intérieure qu'il
+    touche, en un seul passage indexé (STRtree, ou une distance par site pour les tampons).
+
+    En script :
+        sites = extract_sites(couches, aire_etude.crs())
+        table = build_table(sites, study_area(aire_etude, aire_etude.crs()).geometry)
+        table = join_syntheses(table, dossier_xml)
+"""
+
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import shapely
+from qgis.core import QgsProject, QgsCoordinateTransform, QgsRectangle, QgsMessageLog, Qgis
+from qgis.PyQt.QtWidgets import QFileDialog, QInputDialog
+from qgis.utils import iface
+from GeometryCache import study_area
+from XmlStore import xml_exists
+from BiblizouStaging import staged
+from ZonagesOverlay import ZONAGES, ID_FIELDS, NAME_FIELDS, find_field
+from BiblizouMetrics import RunMetrics
+from BiblizouTask import lancer_tache, tache_annulee, pousser_message
+
+ORIENTATIONS = np.array(['N', 'NE', 'E', 'SE', 'S', 'SO', 'O', 'NO'])
+RING_NAMES = ('AE immédiate', 'AE rapprochée', 'AE éloignée')
+
+
+def extract_sites(layers, target_crs, bbox=None):
+    """Lit une seule fois les zonages : {'ZONAGE', 'ID_MNHN', 'NOM', 'geometry' (tableau Shapely)}.
+
+    layers : [(type de zonage, QgsVectorLayer)] ; bbox : QgsRectangle facultatif dans target_crs."""
+    zonages, ids, noms, wkbs = [], [], [], []
+    for key, layer in layers:
+        id_field, name_field = find_field(layer, ID_FIELDS), find_field(layer, NAME_FIELDS)
+        transform = None
+        if layer.crs() != target_crs:
+            transform = QgsCoordinateTransform(layer.crs(), target_crs, QgsProject.instance())
+        for feature in layer.getFeatures():
+            if not feature.hasGeometry():
+                continue
+            geometry = feature.geometry()
+            if transform is not None:
+                geometry.transform(transform)
+            if bbox is not None and not geometry.boundingBox().intersects(bbox):
+                continue
+            zonages.append(key)
+            ids.append(str(feature[id_field]) if id_field else '')
+            noms.append(str(feature[name_field]) if name_field else '')
+            wkbs.append(bytes(geometry.asWkb()))
+    return {'ZONAGE': zonages, 'ID_MNHN': ids, 'NOM': noms,
+            'geometry': shapely.from_wkb(wkbs) if wkbs else np.array([], dtype=object)}
+
+
+def orientation(bearings):
+    """Secteur cardinal (8 directions) de chaque azimut en degrés."""
+    return ORIENTATIONS[((np.asarray(bearings) + 22.5) // 45).astype(int) % 8]
+
+
+def build_table(sites, area):
+    """Surface (ha), distance (m), azimut (degrés depuis le nord) et orientation de chaque site.
+
+    area : géométrie Shapely de l'aire d'étude, ou QgsGeometry (convertie). Distance nulle si le site
+    recoupe l'aire d'étude ; l'azimut est alors celui des centroïdes."""
+    if not isinstance(area, shapely.Geometry):
+        area = shapely.from_wkb(bytes(area.asWkb()))
+    geometries = sites['geometry']
+    shapely.prepare(area)
+
+    surfaces = shapely.area(geometries) / 10000
+    distances = shapely.distance(area, geometries)
+    intersects = shapely.intersects(area, geometries)
+
+    # Azimut depuis le centroïde de l'aire d'étude vers le point du site le plus proche (centroïde si recoupé)
+    origin = shapely.get_coordinates(shapely.centroid(area))[0]
+    nearest = shapely.get_coordinates(shapely.get_point(shapely.shortest_line(area, geometries), 1))
+    centroids = shapely.get_coordinates(shapely.centroid(geometries))
+    targets = np.where(intersects[:, None], centroids, nearest)
+    dx, dy = targets[:, 0] - origin[0], targets[:, 1] - origin[1]
+    bearings = (np.degrees(np.arctan2(dx, dy)) + 360) % 360
+
+    return pd.DataFrame({
+        'ZONAGE': sites['ZONAGE'],
+        'ID_MNHN': sites['ID_MNHN'],
+        'NOM': sites['NOM'],
+        'SURFACE_HA': surfaces.round(2),
+        'DISTANCE_M': distances.round(0),
+        'AZIMUT_DEG': bearings.round(0),
+        'ORIENTATION': orientation(bearings),
+        'DANS_AE': intersects,
+    }).sort_values(['DISTANCE_M', 'ZONAGE', 'ID_MNHN'], ignore_index=True)
+
+
+def synthesis_counts(folder_path, ids):
+    """Nombre d'espèces et d'habitats par site, d'après les fiches <id>.xml présentes dans le dossier."""
+    from ZnieffXmlToXlsxEsp import ZnieffXmlToXlsxEsp
+    from ZnieffXmlToXlsxHab import ZnieffXmlToXlsxHab
+    from NaturaXmlToXlsxEsp import NaturaXmlToXlsxEsp
+    from NaturaXmlToXlsxHab import NaturaXmlToXlsxHab
+    znieff_esp, znieff_hab = ZnieffXmlToXlsxEsp(None), ZnieffXmlToXlsxHab(None)
+    natura_esp, natura_hab = NaturaXmlToXlsxEsp(None), NaturaXmlToXlsxHab(None)
+
+    rows = []
+    for site_id in sorted(set(ids)):
+        xml_file = os.path.join(folder_path, f"{site_id}.xml")
+        if not xml_exists(xml_file):
+            continue
+        if site_id.startswith('FR'):
+            species = natura_esp.extract_species(xml_file)[0]
+            nb_especes = len({cd_nom for cd_nom, _ in species})
+            nb_habitats = len(natura_hab.xml_to_dataframe(xml_file)[0])
+        else:
+            nb_especes = len(znieff_esp.xml_to_dataframe(xml_file)[0])
+            nb_habitats = len(znieff_hab.xml_to_dataframe(xml_file)[0])
+        rows.append({'ID_MNHN': site_id, 'NB_ESPECES': nb_especes, 'NB_HABITATS': nb_habitats})
+    return pd.DataFrame(rows, columns=['ID_MNHN', 'NB_ESPECES', 'NB_HABITATS'])
+
+
+def join_syntheses(table, folder_path):
+    """Ajoute au tableau les comptes d'espèces et d'habitats issus des fiches XML du dossier."""
+    counts = synthesis_counts(folder_path, table['ID_MNHN'])
+    table = table.merge(counts, on='ID_MNHN', how='left')
+    table[['NB_ESPECES', 'NB_HABITATS']] = table[['NB_ESPECES', 'NB_HABITATS']].fillna(0).astype(int)
+    return table
+
+
+class Rings:
+    def __init__(self, names, crs, bbox, areas=None, area=None, radii=None):
+        """Aires d'étude emboîtées, de la plus intérieure à la plus extérieure.
+
+        Soit areas (une géométrie Shapely par aire), soit area + radii (distances tampon croissantes, en m)."""
+        self.names = list(names)
+        self.crs = crs
+        self.bbox = bbox
+        self.areas = areas
+        self.area = area
+        self.radii = radii
+
+
+def classify_rings(geometries, rings):
+    """Indice de l'aire la plus intérieure touchée par chaque site (-1 : hors de toutes les aires)."""
+    if rings.radii is not None:
+        # Une seule distance par site ; l'aire i contient les sites à distance <= radii[i]
+        distances = shapely.distance(rings.area, geometries)
+        index = np.searchsorted(np.asarray(rings.radii, dtype=float), distances, side='left')
+        return np.where(index < len(rings.radii), index, -1)
+
+    # Un seul index spatial des sites, interrogé par toutes les aires à la fois
+    outside = len(rings.areas)
+    index = np.full(len(geometries), outside)
+    if len(geometries):
+        ring_idx, site_idx = shapely.STRtree(geometries).query(np.asarray(rings.areas, dtype=object),
+                                                               predicate='intersects')
+        np.minimum.at(index, site_idx, ring_idx)
+    return np.where(index < outside, index, -1)
+
+
+def ring_table(sites, rings):
+    """Zonages situés dans au moins une aire, avec le nom de l'aire la plus intérieure (colonne AIRE)."""
+    index = classify_rings(sites['geometry'], rings)
+    inside = index >= 0
+    names = np.asarray(rings.names, dtype=object)
+    table = pd.DataFrame({
+        'ZONAGE': np.asarray(sites['ZONAGE'], dtype=object)[inside],
+        'ID_MNHN': np.asarray(sites['ID_MNHN'], dtype=object)[inside],
+        'NOM': np.asarray(sites['NOM'], dtype=object)[inside],
+        'AIRE': names[index[inside]],
+        'RANG': index[inside],
+    })
+    return table.sort_values(['RANG', 'ZONAGE', 'ID_MNHN'], ignore_index=True).drop(columns='RANG')
+
+
+def ask_rings():
+    """Demande les aires d'étude emboîtées : une couche par aire, ou une couche et des distances tampon."""
+    layers = [layer.name() for layer in QgsProject.instance().mapLayers().values()]
+    modes = ["Une couche par aire (immédiate, rapprochée, éloignée)", "Une couche et des distances tampon"]
+    mode, ok = QInputDialog.getItem(None, "Aires d'étude", "Mode de définition des aires :", modes, 0, False)
+    if not ok:
+        return None
+
+    if mode == modes[0]:
+        chosen = []
+        for name in RING_NAMES:
+            layer_name, ok = QInputDialog.getItem(None, "Aires d'étude", f"Couche de l'{name} :", layers, 0, False)
+            if not ok:
+                return None
+            chosen.append(QgsProject.instance().mapLayersByName(layer_name)[0])
+        crs = chosen[0].crs()
+        geometries = [study_area(layer, crs) for layer in chosen]
+        if any(geometry is None for geometry in geometries):
+            return None
+        areas = [shapely.from_wkb(bytes(geometry.geometry.asWkb())) for geometry in geometries]
+        return Rings(RING_NAMES, crs, QgsRectangle(geometries[-1].bbox), areas=areas)
+
+    layer_name, ok = QInputDialog.getItem(None, "Aires d'étude", "Couche de l'aire d'étude :", layers, 0, False)
+    if not ok:
+        return None
+    text, ok = QInputDialog.getText(None, "Aires d'étude", "Distances tampon croissantes en mètres (ex. : 0;500;5000) :",
+                                    text="0;500;5000")
+    if not ok:
+        return None
+    try:
+        radii = sorted(float(value) for value in text.replace(',', '.').split(';') if value.strip())
+    except ValueError:
+        QgsMessageLog.logMessage(f"Distances tampon invalides : {text}", "Biblizou", Qgis.Warning)
+        return None
+    if not radii:
+        return None
+    layer = QgsProject.instance().mapLayersByName(layer_name)[0]
+    area = study_area(layer, layer.crs())
+    if area is None:
+        return None
+    names = RING_NAMES if len(radii) == len(RING_NAMES) else [f"AE {radius:g} m" for radius in radii]
+    bbox = QgsRectangle(area.bbox)
+    bbox.grow(radii[-1])
+    return Rings(names, layer.crs(), bbox, area=shapely.from_wkb(bytes(area.geometry.asWkb())), radii=radii)
+
+
+class ZonagesTable:
+    def __init__(self, iface):
+        self.iface = iface
+        self.task = None
+        self.metrics = RunMetrics('ZonagesTable')
+
+    def push_message(self, title, text, level):
+        pousser_message(self.iface, self.task, title, text, level)
+
+    def run(self):
+        """Point d'entrée principal du module."""
+        layers = [layer.name() for layer in QgsProject.instance().mapLayers().values()]
+        selected_layer, ok = QInputDialog.getItem(None, "Sélection de la couche",
+                                                  "Choisissez la couche d'aire d'étude :", layers, 0, False)
+        if not ok or not selected_layer:
+            return
+        folder_path = QFileDialog.getExistingDirectory(None, "Sélectionner le dossier contenant les fichiers XML")
+        if not folder_path:
+            return
+
+        # Lecture des couches dans le fil principal ; le calcul et l'écriture tournent en tâche de fond
+        aire_etude = QgsProject.instance().mapLayersByName(selected_layer)[0]
+        self.metrics = RunMetrics('ZonagesTable')
+        area = study_area(aire_etude, aire_etude.crs())
+        if area is None:
+            return
+        zonages = [(key, QgsProject.instance().mapLayersByName(name)) for key, name in ZONAGES]
+        with self.metrics.span('extract'):
+            sites = extract_sites([(key, found[0]) for key, found in zonages if found], aire_etude.crs())
+        area_geometry = shapely.from_wkb(bytes(area.geometry.asWkb()))
+        lancer_tache("Biblizou : tableau des zonages (XLSX)",
+                     lambda task: staged(folder_path, lambda work_folder:
+                                         self.process(sites, area_geometry, work_folder, task)),
+                     self.iface)
+
+    def process(self, sites, area, folder_path, task=None):
+        self.task = task
+        try:
+            with self.metrics.span('table'):
+                table = build_table(sites, area)
+            if tache_annulee(task):
+                return
+            with self.metrics.span('synthese'):
+                table = join_syntheses(table, folder_path)
+            current_time = datetime.now().strftime("%Y%m%d%H%M%S")
+            excel_file = os.path.join(folder_path, f'Zonages_distances_{current_time}.xlsx')
+            with self.metrics.span('write'):
+                table.to_excel(excel_file, sheet_name='Zonages', index=False)
+            self.metrics.incr('rows.written', len(table))
+            self.metrics.write_report(excel_file, folder=folder_path)
+            self.push_message("Succès", f"Tableau des zonages enregistré : {excel_file}", Qgis.Success)
+        except Exception as e:
+            QgsMessageLog.logMessage(f"Tableau des zonages : {e}", "Biblizou", Qgis.Critical)
+            self.push_message("Erreur", f"Problème lors du calcul du tableau des zonages : {e}", Qgis.Critical)
+
+
+# Pour exécuter le module dans QGIS
+def run_module(iface):
+    module = ZonagesTable(iface)
+    module.run()
+
+if __name__ in ('__main__', '__console__'):
+    run_module(iface)
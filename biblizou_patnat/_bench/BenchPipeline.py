@@ -0,0 +1,270 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : BenchPipeline.py
+Groupe : Biblizou_PatNat
+Description : Banc de mesure des étapes du traitement Biblizou (analyse XML, synthèse croisée, export et
+    mise en forme XLSX, génération DOCX, chaîne en flux téléchargement -> XLSX) sur des corpus ZNIEFF/N2000 synthétiques.
+Dépendances :
+    - Python 3.x
+    - QGIS (interpréteur Python de QGIS, pour importer les modules Biblizou)
+    - pandas, openpyxl, python-docx, lxml (facultatif, comparé à ElementTree)
+    - SyntheticXml.py, MockInpnServer.py
+
+Utilisation :
+    python BenchPipeline.py --scales 10 100 1000 --label v1.0
+    python BenchPipeline.py --scales 100 --compare results/bench_v1.0_20250401120000.json
+
+    python BenchPipeline.py --scales 100 --mock-server --latency 50 --error-rate 0.01
+
+    Les appels TaxRef sont servis par un référentiel local (taxref_stub.json) au lieu de l'API en ligne.
+    Avec --mock-server, les modules interrogent réellement un serveur HTTP local (MockInpnServer) aux
+    latences, taux d'erreur et limitations choisis, et le téléchargement des fiches est aussi mesuré.
+    Chaque exécution est enregistrée en JSON dans le dossier results/ pour comparer les versions.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from SyntheticXml import generate_corpus
+from MockInpnServer import start_server
+import BiblizouConfig
+import BiblizouHttp
+import XmlBackend
+from XmlSchema import ZNIEFF_ESPECES
+from ColumnStore import ColumnAccumulator
+from ZnieffDwlXml import ZnieffDwlXml
+from NaturaDwlXml import NaturaDwlXml
+from ZnieffXmlToXlsxEsp import ZnieffXmlToXlsxEsp
+from ZnieffXmlToXlsxHab import ZnieffXmlToXlsxHab
+from NaturaXmlToXlsxEsp import NaturaXmlToXlsxEsp
+from NaturaXmlToXlsxHab import NaturaXmlToXlsxHab
+from ZnieffXmlToDocx import ZnieffXmlToDocx
+from NaturaXmlToDocx import NaturaXmlToDocx
+
+
+class NaturaXmlToXlsxEspStub(NaturaXmlToXlsxEsp):
+    """NaturaXmlToXlsxEsp dont les appels TaxRef sont servis par le référentiel local."""
+
+    def __init__(self, taxref):
+        super().__init__(None)
+        self.taxref = taxref
+
+    def get_taxref_data(self, cd_nom, cache={}):
+        if cd_nom in cache:
+            return cache[cd_nom]
+        data = self.taxref.get(cd_nom, {})
+        result = {
+            'REGNE': data.get('kingdomName', ''),
+            'GROUPE': data.get('vernacularGroup2', ''),
+            'NOM_COMPLET': data.get('fullName', ''),
+            'NOM_VERN': data.get('frenchVernacularName', '')
+        }
+        cache[cd_nom] = result
+        return result
+
+
+def timed(stages, name, function, *args):
+    """Exécute function(*args), enregistre sa durée sous stages[name] et retourne son résultat."""
+    start = time.perf_counter()
+    result = function(*args)
+    stages[name] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def xml_files(folder_path, natura):
+    return sorted(os.path.join(folder_path, f) for f in os.listdir(folder_path)
+                  if f.endswith('.xml') and f.startswith('FR') == natura)
+
+
+def backend_throughput(stages, znieff_files, natura_files):
+    """Lecture des espèces avec chaque moteur XML disponible : durée dans stages['xml_backend.<moteur>'] et
+    débits (fiches/s, lignes/s, Mo/s) dans stages['xml_backend.throughput']."""
+    size = sum(os.path.getsize(f) for f in znieff_files + natura_files) / 1e6
+    znieff_esp, natura_esp = ZnieffXmlToXlsxEsp(None), NaturaXmlToXlsxEsp(None)
+    configured, throughput = BiblizouConfig.XML_BACKEND, {}
+    for name in ('etree', 'lxml'):
+        BiblizouConfig.XML_BACKEND = name
+        if XmlBackend.backend() != name:
+            continue
+        start = time.perf_counter()
+        rows = sum(len(znieff_esp.xml_to_dataframe(f)[0]) for f in znieff_files)
+        rows += sum(len(natura_esp.extract_species(f)[0]) for f in natura_files)
+        seconds = time.perf_counter() - start
+        stages[f'xml_backend.{name}'] = round(seconds, 4)
+        throughput[name] = {'fichiers_s': round((len(znieff_files) + len(natura_files)) / seconds, 1),
+                            'lignes_s': round(rows / seconds), 'mo_s': round(size / seconds, 2)}
+    BiblizouConfig.XML_BACKEND = configured
+    stages['xml_backend.throughput'] = throughput
+
+
+def run_scale(folder_path, taxref_path, server_options=None):
+    """Mesure chaque étape sur un corpus déjà généré et retourne {étape: secondes}.
+
+    server_options : paramètres de MockInpnServer ; si fourni, TaxRef et l'INPN sont interrogés en HTTP."""
+    stages = {}
+    with open(taxref_path, encoding='utf-8') as f:
+        taxref = json.load(f)
+    znieff_files, natura_files = xml_files(folder_path, False), xml_files(folder_path, True)
+
+    server = None
+    if server_options is not None:
+        server, base_url = start_server(taxref=taxref, corpus=folder_path, **server_options)
+        BiblizouConfig.TAXREF_API_URL, BiblizouConfig.INPN_DOCS_URL = f"{base_url}/api", f"{base_url}/docs"
+        # Cache négatif propre à la mesure, pour ne pas mélanger avec celui de l'utilisateur
+        BiblizouHttp.negative_cache = BiblizouHttp.NegativeCache(os.path.join(folder_path, 'negative_cache.json'))
+        download_folder = tempfile.mkdtemp(prefix='biblizou_bench_dwl_')
+        # Le constructeur attend les couches du projet QGIS : seul le téléchargement est mesuré ici
+        downloader = ZnieffDwlXml.__new__(ZnieffDwlXml)
+        ids = [os.path.basename(f)[:-4] for f in znieff_files]
+        timed(stages, 'znieff_dwl.construct_url_and_download', downloader.construct_url_and_download, ids,
+              download_folder)
+        shutil.rmtree(download_folder, ignore_errors=True)
+        # Chaîne en flux téléchargement -> analyse -> (enrichissement TaxRef) -> XLSX, à comparer à la
+        # somme des étapes séquentielles
+        for name, cls, files in (('znieff_dwl', ZnieffDwlXml, znieff_files), ('n2000_dwl', NaturaDwlXml, natura_files)):
+            download_folder = tempfile.mkdtemp(prefix='biblizou_bench_dwl_')
+            downloader = cls.__new__(cls)
+            timed(stages, f'{name}.download_and_export', downloader.download_and_export,
+                  [os.path.basename(f)[:-4] for f in files], download_folder)
+            shutil.rmtree(download_folder, ignore_errors=True)
+
+    backend_throughput(stages, znieff_files, natura_files)
+    znieff_esp = ZnieffXmlToXlsxEsp(None)
+    frames = timed(stages, 'znieff_esp.xml_to_dataframe',
+                   lambda: [znieff_esp.xml_to_dataframe(f) for f in znieff_files])
+    znieff_hab = ZnieffXmlToXlsxHab(None)
+    hab_frames = timed(stages, 'znieff_hab.xml_to_dataframe',
+                       lambda: [znieff_hab.xml_to_dataframe(f) for f in znieff_files])
+    natura_esp = NaturaXmlToXlsxEspStub(taxref) if server is None else NaturaXmlToXlsxEsp(None)
+    timed(stages, 'n2000_esp.xml_to_dataframe',
+          lambda: [natura_esp.xml_to_dataframe(f, {}) for f in natura_files])
+    natura_hab = NaturaXmlToXlsxHab(None)
+    timed(stages, 'n2000_hab.xml_to_dataframe', lambda: [natura_hab.xml_to_dataframe(f) for f in natura_files])
+
+    def pivot():
+        # Synthèse croisée en colonnes catégorielles (ColumnStore) : REGNE, GROUPE et SITE restent codés
+        synthese = ColumnAccumulator(ZNIEFF_ESPECES.columns + ['SITE'], encoded=['REGNE', 'GROUPE', 'SITE'])
+        for df, lb_zn, nm_sffzn in frames:
+            synthese.append(df, SITE=f"{nm_sffzn} - {lb_zn}")
+        global_df = synthese.finalize()
+        stages['synthese.memoire'] = {'mo': round(global_df.memory_usage(deep=True).sum() / 1e6, 2)}
+        return global_df.pivot_table(index=['GROUPE', 'CD_NOM', 'NOM_COMPLET', 'NOM_VERN'], columns='SITE',
+                                     values='REGNE', aggfunc=lambda x: "X", fill_value="", observed=True)
+    timed(stages, 'synthese.pivot_table', pivot)
+
+    timed(stages, 'znieff_esp.process_xml_files_in_folder', znieff_esp.process_xml_files_in_folder, folder_path)
+    timed(stages, 'znieff_hab.process_xml_files_in_folder', znieff_hab.process_xml_files_in_folder, folder_path)
+    natura_hab.folder_path = folder_path
+    timed(stages, 'n2000_hab.process_xml_files_in_folder', natura_hab.process_xml_files_in_folder)
+    timed(stages, 'znieff_docx.process_xml_files_in_folder', ZnieffXmlToDocx(None).process_xml_files_in_folder,
+          folder_path)
+    timed(stages, 'n2000_docx.process_xml_files_in_folder', NaturaXmlToDocx(None).process_xml_files_in_folder,
+          folder_path)
+
+    # Classeur mis en forme pendant l'écriture (StreamingWorkbook), à partir des fiches déjà analysées
+    hab_sites = [(df, {'ID_MNHN': nm_sffzn, 'NOM_SITE': lb_zn}) for df, lb_zn, nm_sffzn in hab_frames]
+    timed(stages, 'znieff_hab.export_sites', znieff_hab.export_sites, hab_sites,
+          os.path.join(folder_path, 'bench_habitats.xlsx'))
+
+    if server is not None:
+        stages['mock_server.counters'] = dict(server.RequestHandlerClass.state.counters)
+        server.shutdown()
+    return stages
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(current, reference_path):
+    """Affiche le rapport durée actuelle / durée de référence pour chaque étape commune."""
+    with open(reference_path, encoding='utf-8') as f:
+        reference = json.load(f)
+    print(f"\nComparaison avec {reference.get('label')} ({reference.get('git_revision')}) :")
+    for scale, stages in current['scales'].items():
+        ref_stages = reference['scales'].get(scale, {})
+        for stage, seconds in stages.items():
+            if isinstance(seconds, dict):
+                continue
+            if stage in ref_stages and ref_stages[stage]:
+                print(f"  {scale:>5} sites  {stage:<45} {ref_stages[stage]:>9.3f}s -> {seconds:>9.3f}s"
+                      f"  (x{seconds / ref_stages[stage]:.2f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc de mesure des traitements Biblizou")
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000], help="Nombre de sites par corpus")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help="Nombre de répétitions (on garde le meilleur temps)")
+    parser.add_argument('--label', default='', help="Étiquette de la version mesurée")
+    parser.add_argument('--results', default=os.path.join(BENCH_DIR, 'results'))
+    parser.add_argument('--compare', help="Fichier de résultats de référence")
+    parser.add_argument('--keep', action='store_true', help="Conserver les corpus générés")
+    parser.add_argument('--mock-server', action='store_true', help="Passer par le serveur HTTP local TaxRef/INPN")
+    parser.add_argument('--latency', type=float, default=0.0, help="Latence du serveur local (ms)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Variation de la latence (± ms)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Proportion de réponses 500")
+    parser.add_argument('--rate-limit', type=int, default=0, help="Requêtes par seconde avant 429")
+    args = parser.parse_args()
+    server_options = None
+    if args.mock_server:
+        server_options = {'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+                          'rate_limit': args.rate_limit, 'seed': args.seed}
+
+    report = {'label': args.label, 'server': server_options, 'git_revision': git_revision(), 'date': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'seed': args.seed, 'scales': {}}
+
+    for scale in args.scales:
+        best = {}
+        for _ in range(args.repeat):
+            folder_path = tempfile.mkdtemp(prefix=f'biblizou_bench_{scale}_')
+            try:
+                taxref_path = generate_corpus(folder_path, scale, args.seed)
+                for stage, seconds in run_scale(folder_path, taxref_path, server_options).items():
+                    if isinstance(seconds, dict):
+                        best[stage] = seconds
+                    else:
+                        best[stage] = min(seconds, best.get(stage, seconds))
+            finally:
+                if args.keep:
+                    print(f"Corpus conservé : {folder_path}")
+                else:
+                    shutil.rmtree(folder_path, ignore_errors=True)
+        report['scales'][str(scale)] = best
+        for stage, seconds in best.items():
+            if isinstance(seconds, dict):
+                print(f"{scale:>5} sites  {stage:<45} {seconds}")
+            else:
+                print(f"{scale:>5} sites  {stage:<45} {seconds:>9.3f}s")
+
+    os.makedirs(args.results, exist_ok=True)
+    current_time = datetime.now().strftime("%Y%m%d%H%M%S")
+    result_file = os.path.join(args.results, f"bench_{args.label or report['git_revision']}_{current_time}.json")
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nRésultats enregistrés : {result_file}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : MockInpnServer.py
+Groupe : Biblizou_PatNat
+Description : Serveur HTTP local imitant les services TaxRef et INPN utilisés par Biblizou, pour les tests
+    de charge et les mesures de performance hors ligne.
+Dépendances :
+    - Python 3.x
+    - http.server, threading, json, random
+    - SyntheticXml.py
+
+Utilisation :
+    python MockInpnServer.py --port 8765 --latency 80 --jitter 40 --error-rate 0.02 --rate-limit 20
+    puis, côté QGIS ou banc de mesure :
+        BIBLIZOU_TAXREF_URL=http://127.0.0.1:8765/api
+        BIBLIZOU_INPN_URL=http://127.0.0.1:8765/docs
+
+    Points d'accès servis :
+        /api/taxa/{id}
+        /api/taxa/fuzzyMatch?term=...
+        /api/status/search/lines?taxrefId=...&taxrefId=...
+        /docs/ZNIEFF/znieffxml/{id}.xml
+        /docs/natura2000/fsdxml/{id}.xml
+
+    Les réponses sont déterministes pour une graine donnée (contenu, erreurs et latences tirés au sort par
+    requête dans l'ordre d'arrivée). Un identifiant non numérique (ex. : ID_MNHN) renvoie 404, comme en
+    production ; --missing permet d'en déclarer d'autres.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from SyntheticXml import build_taxref, znieff_xml, natura_xml, REGNES
+
+
+class MockInpnState:
+    """Paramètres et compteurs partagés par toutes les requêtes du serveur."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0, missing=(), seed=0,
+                 taxref=None, corpus=None):
+        self.latency = latency / 1000.0
+        self.jitter = jitter / 1000.0
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.missing = set(missing)
+        self.seed = seed
+        self.corpus = corpus
+        self.rng = random.Random(seed)
+        self.taxref = taxref if taxref is not None else build_taxref(2000, random.Random(seed))
+        self.taxons = sorted(self.taxref)
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.counters = {'requests': 0, 'ok': 0, 'not_found': 0, 'errors': 0, 'throttled': 0}
+
+    def draw(self):
+        """Tire la latence et l'éventuelle erreur 500 de la requête courante."""
+        with self.lock:
+            self.counters['requests'] += 1
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            fail = self.rng.random() < self.error_rate
+        return delay, fail
+
+    def throttled(self):
+        """Fenêtre glissante d'une seconde : True si la limite de requêtes par seconde est dépassée."""
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            while self.recent and now - self.recent[0] > 1.0:
+                self.recent.popleft()
+            if len(self.recent) >= self.rate_limit:
+                return True
+            self.recent.append(now)
+            return False
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def taxon(self, cd_nom):
+        """Fiche TaxRef du taxon, générée de façon déterministe s'il est absent du référentiel."""
+        key = str(cd_nom)
+        with self.lock:
+            if key in self.taxref:
+                return self.taxref[key]
+            rng = random.Random(f"{self.seed}-{key}")
+            regne = rng.choice(list(REGNES))
+            self.taxref[key] = {'id': int(key), 'kingdomName': regne, 'vernacularKingdomName': regne,
+                                'vernacularGroup2': rng.choice(REGNES[regne]),
+                                'scientificName': f"Taxon {key}", 'fullName': f"Taxon {key} L., 1758",
+                                'frenchVernacularName': f"Taxon {key}", 'referenceId': int(key)}
+            return self.taxref[key]
+
+
+class MockInpnHandler(BaseHTTPRequestHandler):
+    state = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type='application/hal+json;charset=UTF-8', headers=None):
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, payload):
+        self.send_body(200, json.dumps(payload, ensure_ascii=False))
+
+    def not_found(self):
+        self.state.count('not_found')
+        self.send_body(404, json.dumps({'message': 'Not Found'}))
+
+    def do_GET(self):
+        state = self.state
+        if state.throttled():
+            state.count('throttled')
+            self.send_body(429, json.dumps({'message': 'Too Many Requests'}), headers={'Retry-After': '1'})
+            return
+        delay, fail = state.draw()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            state.count('errors')
+            self.send_body(500, json.dumps({'message': 'Internal Server Error'}))
+            return
+
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        query = parse_qs(url.query)
+
+        if parts[:2] == ['api', 'taxa'] and len(parts) == 3 and parts[2] == 'fuzzyMatch':
+            term = query.get('term', [''])[0]
+            cd_nom = str(60000 + (sum(map(ord, term)) % 2000) * 7)
+            taxon = state.taxon(cd_nom)
+            self.send_json({'_embedded': {'taxa': [{'scientificName': term or taxon['scientificName'],
+                                                    'referenceId': taxon['referenceId']}]}})
+        elif parts[:2] == ['api', 'taxa'] and len(parts) == 3:
+            if not parts[2].isdigit() or parts[2] in state.missing:
+                self.not_found()
+                return
+            self.send_json(state.taxon(parts[2]))
+        elif parts[:4] == ['api', 'status', 'search', 'lines']:
+            status = []
+            for taxref_id in query.get('taxrefId', []):
+                if taxref_id.isdigit():
+                    taxon = state.taxon(taxref_id)
+                    status.append({'taxon': {'id': taxon['id'], 'scientificName': taxon['scientificName']},
+                                   'statusTypeName': 'Liste rouge régionale', 'statusCode': 'LC'})
+            self.send_json({'_embedded': {'status': status}})
+        elif parts[:3] in (['docs', 'ZNIEFF', 'znieffxml'], ['docs', 'natura2000', 'fsdxml']) and len(parts) == 4:
+            if not self.send_xml(parts[1] == 'ZNIEFF', parts[3][:-4] if parts[3].endswith('.xml') else ''):
+                return
+        else:
+            self.not_found()
+            return
+        state.count('ok')
+
+    def send_xml(self, znieff, site_id):
+        """Sert la fiche XML demandée ; retourne False si elle a été servie en 404."""
+        state = self.state
+        valid = site_id.isdigit() if znieff else (site_id.startswith('FR') and site_id[2:].isdigit())
+        if not valid or site_id in state.missing:
+            self.not_found()
+            return False
+        if state.corpus and os.path.isfile(os.path.join(state.corpus, f"{site_id}.xml")):
+            with open(os.path.join(state.corpus, f"{site_id}.xml"), 'rb') as f:
+                body = f.read()
+        else:
+            rng = random.Random(f"{state.seed}-{site_id}")
+            if znieff:
+                body = znieff_xml(site_id, state.taxons, state.taxref, rng)
+            else:
+                body = natura_xml(site_id, state.taxons, state.taxref, rng)
+        self.send_body(200, body, 'application/xml;charset=UTF-8')
+        return True
+
+
+def start_server(host='127.0.0.1', port=0, **options):
+    """Démarre le serveur dans un fil d'exécution séparé et retourne (serveur, url de base).
+
+    port=0 laisse le système choisir un port libre. Arrêt : serveur.shutdown()."""
+    handler = type('Handler', (MockInpnHandler,), {'state': MockInpnState(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur local TaxRef/INPN pour Biblizou")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Latence moyenne par requête (ms)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Variation aléatoire de la latence (± ms)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Proportion de réponses 500 (0 à 1)")
+    parser.add_argument('--rate-limit', type=int, default=0, help="Requêtes par seconde avant réponse 429 (0 = illimité)")
+    parser.add_argument('--missing', nargs='*', default=[], help="Identifiants à servir en 404")
+    parser.add_argument('--corpus', help="Dossier de fiches XML à servir en priorité (ex. : corpus SyntheticXml)")
+    parser.add_argument('--taxref', help="Référentiel TaxRef JSON (ex. : taxref_stub.json)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    taxref = None
+    if args.taxref:
+        with open(args.taxref, encoding='utf-8') as f:
+            taxref = json.load(f)
+    server, base_url = start_server(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                                    error_rate=args.error_rate, rate_limit=args.rate_limit, missing=args.missing,
+                                    seed=args.seed, taxref=taxref, corpus=args.corpus)
+    print(f"Serveur TaxRef/INPN local : {base_url}")
+    print(f"  BIBLIZOU_TAXREF_URL={base_url}/api")
+    print(f"  BIBLIZOU_INPN_URL={base_url}/docs")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(server.RequestHandlerClass.state.counters, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Auteur : ExEco Environnement - François Botcazou
+Date de création : 2025/04
+Dernière mise à jour : 2025/04
+Version : 1.0
+Nom : SyntheticXml.py
+Groupe : Biblizou_PatNat
+Description : Génère des corpus XML ZNIEFF et Natura 2000 synthétiques (structure INPN) pour les mesures
+    de performance, ainsi que le référentiel TaxRef correspondant.
+Dépendances :
+    - Python 3.x
+    - os, json, random, xml.sax.saxutils
+
+Utilisation :
+    generate_corpus(dossier, nb_sites) crée nb_sites fiches ZNIEFF et nb_sites fiches N2000 dans le
+    dossier, plus un fichier taxref_stub.json (cd_nom -> réponse /api/taxa/{id}). Le tirage est
+    déterministe pour une graine donnée, afin de comparer les versions sur un même corpus.
+"""
+
+import os
+import json
+import random
+from xml.sax.saxutils import escape
+
+REGNES = {
+    'Animalia': ['Oiseaux', 'Mammifères', 'Amphibiens', 'Reptiles', 'Insectes', 'Poissons', 'Mollusques'],
+    'Plantae': ['Angiospermes', 'Ptéridophytes', 'Mousses', 'Gymnospermes'],
+    'Fungi': ['Lichens', 'Champignons'],
+}
+GENRES = ['Alauda', 'Bufo', 'Carex', 'Drosera', 'Erica', 'Falco', 'Gentiana', 'Hyla', 'Iris', 'Juncus',
+          'Lacerta', 'Myotis', 'Nardus', 'Osmunda', 'Pinguicula', 'Rana', 'Salamandra', 'Triturus', 'Ulex']
+EPITHETES = ['arvensis', 'bufo', 'canescens', 'rotundifolia', 'tetralix', 'peregrinus', 'pneumonanthe',
+             'arborea', 'pseudacorus', 'squarrosus', 'viridis', 'myotis', 'stricta', 'regalis', 'lusitanica']
+HABITATS = [('4010', 'Landes humides atlantiques septentrionales à Erica tetralix'),
+            ('4030', 'Landes sèches européennes'),
+            ('6410', 'Prairies à Molinia sur sols calcaires, tourbeux ou argilo-limoneux'),
+            ('7110', 'Tourbières hautes actives'),
+            ('7150', 'Dépressions sur substrats tourbeux du Rhynchosporion'),
+            ('9120', 'Hêtraies acidophiles atlantiques à sous-bois à Ilex'),
+            ('91E0', 'Forêts alluviales à Alnus glutinosa et Fraxinus excelsior'),
+            ('1130', 'Estuaires'),
+            ('1140', 'Replats boueux ou sableux exondés à marée basse'),
+            ('1330', 'Prés-salés atlantiques')]
+CORINE = [('31.11', 'Landes humides atlantiques septentrionales'), ('37.312', 'Prairies à Molinie acidiphiles'),
+          ('44.91', 'Bois marécageux à Aulne'), ('51.1', 'Tourbières hautes à peu près naturelles'),
+          ('53.11', 'Phragmitaies'), ('22.31', 'Communautés amphibies pérennes septentrionales')]
+MOTS = ['vallée', 'tourbière', 'lande', 'boisement', 'ruisseau', 'prairie', 'humide', 'patrimonial', 'espèce',
+        'habitat', 'gestion', 'pâturage', 'drainage', 'enrésinement', 'fermeture', 'milieu', 'intérêt']
+
+
+def build_taxref(nb_taxons, rng):
+    """Construit un référentiel TaxRef fictif : cd_nom -> réponse JSON de /api/taxa/{id}."""
+    taxref = {}
+    for i in range(nb_taxons):
+        cd_nom = str(60000 + i * 7)
+        regne = rng.choice(list(REGNES))
+        nom = f"{rng.choice(GENRES)} {rng.choice(EPITHETES)}"
+        taxref[cd_nom] = {
+            'id': int(cd_nom),
+            'kingdomName': regne,
+            'vernacularKingdomName': regne,
+            'vernacularGroup2': rng.choice(REGNES[regne]),
+            'scientificName': nom,
+            'fullName': f"{nom} L., 1758",
+            'frenchVernacularName': f"{nom.split()[0]} commun, {nom.split()[1]}",
+            'referenceId': int(cd_nom),
+        }
+    return taxref
+
+
+def paragraphes(rng, nb):
+    return [' '.join(rng.choice(MOTS) for _ in range(rng.randint(40, 120))) + '.' for _ in range(nb)]
+
+
+def znieff_xml(nm_sffzn, taxons, taxref, rng):
+    """Fiche ZNIEFF : ZNIEFF / NM_SFFZN / LB_ZN / TX_GENE / ESPECE_ROW / TYPO_INFO_ROW."""
+    lb_zn = f"{rng.choice(MOTS).capitalize()} de {rng.choice(GENRES)}"
+    lignes = ['<?xml version="1.0" encoding="UTF-8"?>', '<ZNIEFFS>', '<ZNIEFF>',
+              f'<NM_SFFZN>{nm_sffzn}</NM_SFFZN>', f'<LB_ZN>{escape(lb_zn)}</LB_ZN>', '<TX_GENE>']
+    lignes += [f'<p>{escape(p)}</p>' for p in paragraphes(rng, rng.randint(2, 6))]
+    lignes += ['</TX_GENE>', '<ESPECE>']
+    for cd_nom in rng.sample(taxons, min(len(taxons), rng.randint(20, 150))):
+        taxon = taxref[cd_nom]
+        lignes.append('<ESPECE_ROW>'
+                      f'<FG_ESP>{rng.choice("DDDA")}</FG_ESP>'
+                      f'<REGNE>{taxon["kingdomName"]}</REGNE>'
+                      f'<GROUPE>{escape(taxon["vernacularGroup2"])}</GROUPE>'
+                      f'<CD_NOM>{cd_nom}</CD_NOM>'
+                      f'<NOM_COMPLET>{escape(taxon["fullName"])}</NOM_COMPLET>'
+                      f'<NOM_VERN>{escape(taxon["frenchVernacularName"])}</NOM_VERN>'
+                      '</ESPECE_ROW>')
+    lignes += ['</ESPECE>', '<TYPO_INFO>']
+    for lb_code, lb_hab in rng.sample(CORINE, rng.randint(1, len(CORINE))):
+        lignes.append('<TYPO_INFO_ROW>'
+                      f'<FG_TYPO>{rng.choice("DDA")}</FG_TYPO>'
+                      f'<LB_CODE>{lb_code}</LB_CODE>'
+                      f'<LB_HAB>{escape(lb_hab)}</LB_HAB>'
+                      '</TYPO_INFO_ROW>')
+    lignes += ['</TYPO_INFO>', '</ZNIEFF>', '</ZNIEFFS>']
+    return '\n'.join(lignes)
+
+
+def natura_xml(sitecode, taxons, taxref, rng):
+    """Fiche Natura 2000 : BIOTOP / SITECODE / SITE_NAME / SPECIES_ROW / HABIT1_ROW / COMMENTAIRE_ROW."""
+    site_name = f"{rng.choice(MOTS).capitalize()} et {rng.choice(MOTS)} de {rng.choice(GENRES)}"
+    lignes = ['<?xml version="1.0" encoding="UTF-8"?>', '<BIOTOPS>', '<BIOTOP>',
+              f'<SITECODE>{sitecode}</SITECODE>', f'<SITE_NAME>{escape(site_name)}</SITE_NAME>',
+              '<COMMENTAIRE>', '<COMMENTAIRE_ROW>',
+              f'<QUALITY>{escape(paragraphes(rng, 1)[0])}</QUALITY>',
+              f'<VULNAR>{escape(paragraphes(rng, 1)[0])}</VULNAR>',
+              '</COMMENTAIRE_ROW>', '</COMMENTAIRE>', '<SPECIES>']
+    for cd_nom in rng.sample(taxons, min(len(taxons), rng.randint(5, 40))):
+        lignes.append('<SPECIES_ROW>'
+                      f'<CD_NOM>{cd_nom}</CD_NOM>'
+                      f'<NOM>{escape(taxref[cd_nom]["scientificName"])}</NOM>'
+                      '</SPECIES_ROW>')
+    lignes += ['</SPECIES>', '<HABIT1>']
+    for cd_ue, lb_habdh_fr in rng.sample(HABITATS, rng.randint(2, len(HABITATS))):
+        lignes.append('<HABIT1_ROW>'
+                      f'<CD_UE>{cd_ue}</CD_UE>'
+                      f'<LB_HABDH_FR>{escape(lb_habdh_fr)}</LB_HABDH_FR>'
+                      '</HABIT1_ROW>')
+    lignes += ['</HABIT1>', '</BIOTOP>', '</BIOTOPS>']
+    return '\n'.join(lignes)
+
+
+def generate_corpus(folder_path, nb_sites, seed=0, nb_taxons=None):
+    """Génère nb_sites fiches ZNIEFF et nb_sites fiches N2000 dans folder_path.
+
+    Les noms de fichiers respectent les conventions INPN (9 chiffres pour les ZNIEFF, FRxxxxxxx pour
+    Natura 2000). Retourne le chemin du référentiel TaxRef fictif."""
+    rng = random.Random(seed)
+    os.makedirs(folder_path, exist_ok=True)
+    taxref = build_taxref(nb_taxons or max(200, nb_sites * 20), rng)
+    taxons = list(taxref)
+
+    for i in range(nb_sites):
+        nm_sffzn = f"{530000000 + i:09d}"
+        with open(os.path.join(folder_path, f"{nm_sffzn}.xml"), 'w', encoding='utf-8') as f:
+            f.write(znieff_xml(nm_sffzn, taxons, taxref, rng))
+        sitecode = f"FR{5300000 + i:07d}"
+        with open(os.path.join(folder_path, f"{sitecode}.xml"), 'w', encoding='utf-8') as f:
+            f.write(natura_xml(sitecode, taxons, taxref, rng))
+
+    taxref_path = os.path.join(folder_path, 'taxref_stub.json')
+    with open(taxref_path, 'w', encoding='utf-8') as f:
+        json.dump(taxref, f, ensure_ascii=False)
+    return taxref_path